@@ -0,0 +1,88 @@
+import sys
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from src.benchmark import (
+    benchmark_graph,
+    environment,
+    compare_results,
+    read_results,
+    write_results
+)
+from src.synthetic import GraphSpec, generate_graph
+from config import config_dict
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time the phases of the walk pipeline on synthetic graphs and write the results as json.")
+    parser.add_argument("--sizes", help="Numbers of nodes of the benchmark graphs", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--walk-lens", dest="walk_lens", help="Walk lengths to time", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--threads", help="Numbers of numba threads to time the parallel phase with", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--n-runs", dest="n_runs", help="Number of timed runs of each phase", type=int, default=5)
+    parser.add_argument("--seed", help="Seed of the graphs and walks", type=int, default=0)
+    parser.add_argument("--output", help="json file to write the results to", type=str)
+    parser.add_argument(
+        "--compare",
+        help="Compare with a baseline json file. With two files, compares them without running the benchmarks.",
+        type=str,
+        nargs="+",
+        metavar="FILE"
+    )
+    parser.add_argument("--tolerance", help="Relative slowdown of the median time that counts as a regression", type=float, default=0.1)
+    return parser.parse_args()
+
+
+def run_size(n_nodes: int, args):
+    "Benchmark one graph size; runs in its own process so the peak RSS belongs to this size only"
+    layer_names = config_dict["big"]["layers"]
+    _, graph = generate_graph(GraphSpec(n_nodes=n_nodes), layer_names, seed=args.seed)
+    records = benchmark_graph(graph, layer_names, args.walk_lens, args.threads, args.n_runs, seed=args.seed)
+    return [{"graph_size": n_nodes, **record} for record in records]
+
+
+def print_records(records: list):
+    for r in records:
+        setting = ", ".join(f"{key}={r[key]}" for key in ("walk_len", "n_threads") if key in r)
+        line = f"n={r['graph_size']:>10} {r['phase']:<9} {setting:<24} p50={r['times']['p50']:.4g}s p90={r['times']['p90']:.4g}s"
+        if "steps_per_second" in r:
+            line += f" steps/s={r['steps_per_second']:.3g}"
+        if "efficiency" in r:
+            line += f" efficiency={r['efficiency']:.2f}"
+        print(line + f" peak rss={r['peak_rss_mb']:.0f}MB")
+
+
+def print_comparison(comparison: list):
+    for c in comparison:
+        key = ", ".join(f"{k}={v}" for k, v in c["key"].items() if v is not None)
+        flag = "REGRESSION" if c["regression"] else ""
+        print(f"{key:<50} {c['baseline_p50']:.4g}s -> {c['current_p50']:.4g}s ({c['ratio']:.2f}x) {flag}")
+
+
+def main():
+    args = parse_args()
+
+    if args.compare and len(args.compare) == 2:
+        results = read_results(args.compare[1])
+    else:
+        records = []
+        context = multiprocessing.get_context("spawn")
+        for n_nodes in args.sizes:
+            print(f"benchmarking a graph with {n_nodes} nodes")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                size_records = pool.submit(run_size, n_nodes, args).result()
+            print_records(size_records)
+            records += size_records
+        results = {"environment": environment(), "args": vars(args), "records": records}
+        if args.output:
+            write_results(results, args.output)
+
+    if args.compare:
+        comparison = compare_results(read_results(args.compare[0]), results, args.tolerance)
+        print_comparison(comparison)
+        if any(c["regression"] for c in comparison):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
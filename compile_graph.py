@@ -0,0 +1,64 @@
+"Compile the pickled layers into a memory-mappable graph cache, used by create_walks.py --cache-dir"
+
+import argparse
+
+from src.cache import compile_graph
+from src.deltas import compile_years, read_years_meta
+
+from config import data_dir
+
+
+LAYERS = ["classmate", "household", "family", "colleague", "neighbor"]
+LOCATION_CHOICES = ["snellius", "local", "ossc"]
+
+LAYERS_DRY_RUN = ["household", "classmate"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--dry-run", 
+        dest="dry_run", 
+        help="If given, compiles the layers used by create_walks.py --dry-run.",
+        action=argparse.BooleanOptionalAction
+        )  
+    parser.add_argument("--location", help="Snellius or local machine", choices=LOCATION_CHOICES)
+    parser.add_argument("--cache-dir", dest="cache_dir", help="Directory of the graph cache. Defaults to graph_cache/ in the output directory.", type=str)
+    parser.add_argument("--load-workers", dest="load_workers", help="If larger than 1, loads and converts the layers in this many processes", type=int, default=1)
+    parser.add_argument("--weighted", help="If given, includes alias tables built from the <layer>_<year>_weights_dict.pkl files", action="store_true")
+    parser.add_argument("--years", help="Which years of the network data to compile", type=int, nargs="+", default=[2010])
+    parser.add_argument(
+        "--incremental",
+        help="Store the first year as the base graph and per-layer edge deltas for the other years, as used by create_walks.py --years",
+        action="store_true"
+        )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    DATA_DIR = data_dir[args.location]
+    cache_dir = args.cache_dir or DATA_DIR["output"] + "graph_cache/"
+
+    layers_to_load = LAYERS_DRY_RUN if args.dry_run else LAYERS
+    connected_node_file = "connected_user_set" if args.location == "ossc" else None
+
+    if args.incremental:
+        if args.weighted:
+            raise ValueError("--incremental does not support --weighted")
+        print(f"compiling {args.years} incrementally")
+        path = compile_years(cache_dir, DATA_DIR["input"], args.years, connected_node_file, layers_to_load, args.load_workers)
+        meta = read_years_meta(path)
+        for year in meta["years"]:
+            print(f"{year}: {meta['n_edges'][str(year)]:,} edges, {meta['n_changed'][str(year)]:,} changed from {meta['base_year']}")
+        print(f"multi-year graph at {path}")
+        return
+
+    for year in args.years:
+        print(f"compiling {year}")
+        path = compile_graph(cache_dir, DATA_DIR["input"], year, connected_node_file, layers_to_load, args.load_workers, args.weighted)
+        print(f"graph cache for {year} at {path}")
+
+
+if __name__ == "__main__":
+    main()
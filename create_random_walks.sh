@@ -27,4 +27,5 @@ python create_walks.py \
     --n_walks 5 \
     --walk_len 10 \
     --dest layered_walks \
+    --resume \
     --dry-run
\ No newline at end of file
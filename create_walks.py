@@ -1,17 +1,48 @@
 
-import asyncio
+import sys
 import argparse
+import warnings
+import numba
 import numpy as np
-from pathlib import Path
-import csv 
 
 from src.utils import (
-    batched,
-    load_data,
-    convert_to_numba,
+    load_data_arrays,
+    load_weights,
+    layers_to_read,
+    sample_users,
     get_n_cores
 ) 
-from src.walks_numba import create_walks as create_walks_numba
+from src.graph import convert_to_csr
+from src.cache import load_or_compile_graph, cache_path, read_meta
+from src.deltas import compile_years, load_year_graph, years_path, read_years_meta
+from src.parallel_load import load_csr_parallel
+from src.timing import PhaseTimer
+from src.transitions import NO_TRANSITIONS, read_transition_matrix, transition_table
+from src.walks_numba import create_walks_units, walk_units_into, create_compact_units, compact_units_into
+from src.scheduler import WorkerStats, run_dynamic, summarize_stats, worker_index
+from src.progress import MetricsLog, ProgressMonitor, new_counters
+from src.walk_matrix import walk_width, walk_dtype, compact_arrays
+from src.writers import OUTPUT_FORMATS, make_writer
+from src.pipeline import stream_walks
+from src.shards import (
+    shard_range,
+    shard_filename,
+    write_shard_manifest,
+    merge_shards,
+    remove_shards
+)
+from src.shared import create_walks_processes
+from src.checkpoint import Checkpoint
+from src.memory import (
+    parse_size,
+    stats_from_graph,
+    stats_from_cache,
+    stats_from_pickles,
+    plan_run,
+    format_size,
+    format_plan,
+    format_plan_table
+)
 
 from config import data_dir
 
@@ -23,6 +54,13 @@ SAMPLE_SIZE_DRY_RUN = 10_000
 LAYERS_DRY_RUN = ["household", "classmate"]
 
 
+def positive_float(value: str):
+    value = float(value)
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"{value} is not positive")
+    return value
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -32,24 +70,105 @@ def parse_args():
         action=argparse.BooleanOptionalAction
         )  
     parser.add_argument("--location", help="Snellius or local machine", choices=LOCATION_CHOICES)
-    parser.add_argument("--dest", help="Destination of csv file, relative to data_dir. year will be appended to the end.", type=str)
+    parser.add_argument("--dest", help="Destination of the walk file, relative to data_dir. year will be appended to the end.", type=str)
     parser.add_argument("--n_walks", help="Number of walks per node", type=int, default=5)
     parser.add_argument("--walk_len", help="Length of walks to generate", type=int, default=50)
     parser.add_argument("--year", help="Which year of the network data to use", type=int, default=2010)
-    return parser.parse_args()
-
+    parser.add_argument(
+        "--years",
+        help="Create walks for each of these years, from a base graph and per-year edge deltas compiled once in --cache-dir. Replaces --year.",
+        type=int,
+        nargs="+"
+        )
+    parser.add_argument("--p", help="Probability of keeping the layer at each step; otherwise the layer is resampled uniformly", type=float, default=0.8)
+    parser.add_argument(
+        "--transitions",
+        help="json file with layer-to-layer transition weights, e.g. {\"household\": {\"family\": 2, \"colleague\": 0.5}}. Replaces --p.",
+        type=str
+    )
+    parser.add_argument("--return-param", dest="return_param", help="node2vec return parameter p; 1 with --inout-param 1 gives first-order walks", type=positive_float, default=1.0)
+    parser.add_argument("--inout-param", dest="inout_param", help="node2vec in-out parameter q", type=positive_float, default=1.0)
+    parser.add_argument("--seed", help="Seed of the random walks", type=int, default=95359385252)
+    parser.add_argument("--shard-index", dest="shard_index", help="Which shard of the walks to create", type=int, default=0)
+    parser.add_argument("--num-shards", dest="num_shards", help="Number of shards the walks are split into, e.g. the size of a SLURM job array", type=int, default=1)
+    parser.add_argument(
+        "--merge",
+        help="If given, does not create walks but merges the shards created with --num-shards into a single file.",
+        action="store_true"
+        )
+    parser.add_argument("--cache-dir", dest="cache_dir", help="If given, loads the graph from a compiled cache in this directory, compiling it first if needed. See compile_graph.py.", type=str)
+    parser.add_argument("--load-workers", dest="load_workers", help="If larger than 1, loads and converts the layers in this many processes", type=int, default=1)
+    parser.add_argument("--weighted", help="If given, samples neighbors proportionally to the edge weights in <layer>_<year>_weights_dict.pkl", action="store_true")
+    parser.add_argument("--output-format", dest="output_format", help="Format of the walk files", choices=OUTPUT_FORMATS, default="csv")
+    parser.add_argument("--chunk-size", dest="chunk_size", help="Number of walks generated and written at a time", type=int, default=1_000_000)
+    parser.add_argument(
+        "--backend",
+        help="threads: generate walks with numba threads in this process. processes: share the graph with worker processes that each write a partition of the output.",
+        choices=["threads", "processes"],
+        default="threads"
+        )
+    parser.add_argument("--n-processes", dest="n_processes", help="Number of worker processes with --backend processes. Defaults to the number of cores.", type=int)
+    parser.add_argument(
+        "--scheduler",
+        help="static: split each chunk evenly over numba threads. dynamic: threads claim small chunks from a shared counter. Only with --backend threads.",
+        choices=["static", "dynamic"],
+        default="static"
+        )
+    parser.add_argument("--steal-chunk-size", dest="steal_chunk_size", help="Number of walks claimed at a time with --scheduler dynamic", type=int, default=4096)
+    parser.add_argument("--max-queued", dest="max_queued", help="Maximum number of generated chunks waiting to be written", type=int, default=2)
+    parser.add_argument(
+        "--checkpoint",
+        help="Write the walks in chunk files of --chunk-size walks and record each finished chunk, so an interrupted run can be resumed",
+        action="store_true"
+        )
+    parser.add_argument(
+        "--resume",
+        help="Continue an interrupted --checkpoint run with the same arguments, creating only the missing chunks. Starts from scratch if there is no checkpoint.",
+        action="store_true"
+        )
+    parser.add_argument(
+        "--memory-budget",
+        dest="memory_budget",
+        help="Memory available to the job, e.g. 160G. Picks --chunk-size (as an upper bound) and, with --backend processes, --n-processes to fit it.",
+        type=parse_size
+        )
+    parser.add_argument(
+        "--plan",
+        help="Only print the memory estimate of the run for each backend and output format, without converting the graph or creating walks",
+        action="store_true"
+        )
+    parser.add_argument("--progress-interval", dest="progress_interval", help="Seconds between progress reports on stderr; 0 disables them", type=float, default=30.0)
+    parser.add_argument("--metrics-file", dest="metrics_file", help="If given, appends phase times and progress reports to this file as json lines", type=str)
+    args = parser.parse_args()
+    if args.years and not args.cache_dir:
+        parser.error("--years needs --cache-dir")
+    if args.backend == "processes" and args.scheduler == "dynamic":
+        parser.error("--scheduler dynamic only applies to --backend threads")
+    if args.years and args.weighted:
+        parser.error("--years does not support --weighted")
+    return args
 
 
-async def main():
 
+def main():
     args = parse_args()
+    for year in args.years or [args.year]:
+        create_year_walks(args, year)
+
+
+def create_year_walks(args, year: int):
+    "Create the walks of one year"
     DRY_RUN = args.dry_run
     LOCATION = args.location
     DATA_DIR = data_dir[LOCATION]
     N_WALKS = args.n_walks
     WALK_LEN = args.walk_len
-    YEAR = args.year
+    YEAR = year
     DEST = args.dest
+    SEED = args.seed
+    SHARD_INDEX = args.shard_index
+    NUM_SHARDS = args.num_shards
+    P = args.p
 
     layers_to_load = LAYERS
     if DRY_RUN:
@@ -58,47 +177,204 @@ async def main():
     if DRY_RUN:
         sample_size = SAMPLE_SIZE_DRY_RUN
 
-    print("loading data")    
+    filename = DATA_DIR["output"] + DEST + "_" + str(YEAR)
+    if DRY_RUN:
+        filename += "_dry"
+
+    if args.merge:
+        print(f"Merging {NUM_SHARDS} shards")
+        merge_shards(filename, NUM_SHARDS, args.output_format)
+        return
+
     connected_node_file = "connected_user_set" if LOCATION == "ossc" else None
-    users, layers, node_layer_dict = load_data(
-        DATA_DIR["input"], YEAR, connected_node_file, layers_to_load, sample_size 
+    N_WORKERS = get_n_cores(DRY_RUN)
+    load_method = "parallel" if args.load_workers > 1 else "pickles"
+    graph_cache = None
+    years_graph = None
+    if args.years:
+        years_graph = years_path(args.cache_dir, DATA_DIR["input"], args.years, connected_node_file, layers_to_load)
+        if read_years_meta(years_graph) is not None:
+            load_method = "cache"
+    elif args.cache_dir:
+        graph_cache = cache_path(args.cache_dir, DATA_DIR["input"], YEAR, connected_node_file, layers_to_load, args.weighted)
+        if read_meta(graph_cache) is not None:
+            load_method = "cache"
+
+    def make_plan(stats, backend, output_format, n_processes=None):
+        n_starts = min(sample_size, stats.n_users) if sample_size > 0 else stats.n_users
+        begin, end = shard_range(n_starts * N_WALKS, SHARD_INDEX, NUM_SHARDS)
+        plan = plan_run(
+            stats, end - begin, WALK_LEN, backend, output_format, load_method, N_WORKERS, args.memory_budget,
+            args.chunk_size, args.max_queued, args.load_workers, itemsize=4 if stats.max_node_id <= 2**31 - 1 else 8,
+            n_processes=n_processes
+        )
+        return plan, end - begin
+
+    if args.plan:
+        print(f"reading graph sizes ({load_method})")
+        if years_graph is not None and load_method == "cache":
+            stats = stats_from_graph(*load_year_graph(years_graph, YEAR), layers_to_read(layers_to_load, connected_node_file))
+        elif load_method == "cache":
+            stats = stats_from_cache(graph_cache, layers_to_read(layers_to_load, connected_node_file))
+        else:
+            stats = stats_from_pickles(DATA_DIR["input"], YEAR, connected_node_file, layers_to_load, args.weighted)
+        plan, n_walks = make_plan(stats, args.backend, args.output_format, args.n_processes)
+        print(format_plan(plan, stats, n_walks, WALK_LEN))
+        print(format_plan_table([
+            make_plan(stats, backend, output_format)[0]
+            for backend in ["threads", "processes"] for output_format in OUTPUT_FORMATS
+        ]))
+        return
+
+    metrics = MetricsLog(args.metrics_file)
+    timer = PhaseTimer(metrics=metrics)
+    if args.years:
+        with timer.phase("compile years"):
+            years_graph = compile_years(
+                args.cache_dir, DATA_DIR["input"], args.years, connected_node_file, layers_to_load, args.load_workers
+            )
+        print(f"loading graph of {YEAR} from {years_graph}")
+        with timer.phase("load year graph"):
+            users_numba, graph = load_year_graph(years_graph, YEAR)
+    elif args.cache_dir:
+        print("loading graph cache")
+        with timer.phase("load graph cache"):
+            users_numba, graph = load_or_compile_graph(
+                args.cache_dir, DATA_DIR["input"], YEAR, connected_node_file, layers_to_load,
+                load_workers=args.load_workers, weighted=args.weighted
+            )
+    elif args.load_workers > 1:
+        print(f"loading data with {args.load_workers} processes")
+        users_numba, graph = load_csr_parallel(
+            DATA_DIR["input"], YEAR, connected_node_file, layers_to_load, args.load_workers, timer=timer,
+            weighted=args.weighted
+        )
+    else:
+        print("loading data")    
+        users, layers, _ = load_data_arrays(
+            DATA_DIR["input"], YEAR, connected_node_file, layers_to_load, timer
+        )
+
+        weights = None
+        if args.weighted:
+            with timer.phase("load weights"):
+                weights = load_weights(DATA_DIR["input"], YEAR, connected_node_file, layers_to_load)
+
+        print("converting to csr")
+        with timer.phase("convert to csr"):
+            users_numba, graph = convert_to_csr(users, layers, weights)
+        del users, layers, weights
+
+    matrix = None
+    transitions = NO_TRANSITIONS
+    if args.transitions:
+        matrix = read_transition_matrix(args.transitions, layers_to_read(layers_to_load, connected_node_file))
+        transitions = transition_table(matrix)
+
+    users_numba = sample_users(users_numba, sample_size)
+
+    numba.set_num_threads(min(N_WORKERS, numba.config.NUMBA_NUM_THREADS))
+
+    n_units = len(users_numba) * N_WALKS
+    unit_begin, unit_end = shard_range(n_units, SHARD_INDEX, NUM_SHARDS)
+
+    chunk_size = args.chunk_size
+    n_processes = args.n_processes or N_WORKERS
+    if args.memory_budget:
+        stats = stats_from_graph(users_numba, graph, layers_to_read(layers_to_load, connected_node_file))
+        plan, n_walks = make_plan(stats, args.backend, args.output_format, args.n_processes)
+        print(format_plan(plan, stats, n_walks, WALK_LEN))
+        if not plan.fits:
+            warnings.warn(f"the run is estimated to need {format_size(plan.peak)}, more than --memory-budget {format_size(args.memory_budget)}")
+        chunk_size = plan.chunk_size
+        n_processes = plan.n_workers if args.backend == "processes" else n_processes
+
+    run_params = dict(
+        seed=SEED, walk_len=WALK_LEN, n_walks=N_WALKS, year=YEAR, layers=layers_to_load, n_nodes=len(users_numba),
+        output_format=args.output_format, p=P, transitions=None if matrix is None else matrix.tolist(),
+        return_param=args.return_param, inout_param=args.inout_param
     )
+    checkpoint_params = {**run_params, "weighted": args.weighted} if args.checkpoint or args.resume else None
 
-    print("converting to numba")
-    users_numba, layers_numba, node_layer_dict_numba = convert_to_numba(users, layers, node_layer_dict)
-    
+    worker_stats = [WorkerStats() for _ in range(N_WORKERS)]
+    counters = new_counters(max(N_WORKERS, numba.config.NUMBA_NUM_THREADS))
+    monitor = ProgressMonitor(
+        counters, unit_end - unit_begin, args.progress_interval, metrics,
+        stream=sys.stderr if args.progress_interval > 0 else None
+    )
 
-    N_WORKERS = get_n_cores(DRY_RUN)
+    compact = args.output_format == "compact"
 
-    def walks_wrapper(users):
-        return create_walks_numba(users, WALK_LEN, node_layer_dict_numba, layers_numba, 0.8)
+    def generate_chunk(begin, end):
+        if compact:
+            chunk = compact_arrays(end - begin, WALK_LEN)
+            units_into, create_units = compact_units_into, create_compact_units
+        else:
+            chunk = (np.empty((end - begin, walk_width(WALK_LEN)), dtype=np.int64), np.empty(end - begin, dtype=np.int64))
+            units_into, create_units = walk_units_into, create_walks_units
+        if args.scheduler == "static":
+            create_units(users_numba, begin, end, WALK_LEN, graph, P, transitions, args.return_param, args.inout_param, *chunk, SEED, counters)
+            return chunk
 
-    _ = walks_wrapper(users[:10])
+        def work(b, e):
+            units_into(
+                users_numba, b, e, WALK_LEN, graph, P, transitions, args.return_param, args.inout_param,
+                *(array[b - begin:e - begin] for array in chunk), SEED, counters[worker_index()]
+            )
 
-    async def create_walks_parallel(users, n_workers):
-        result = await asyncio.gather(*(asyncio.to_thread(walks_wrapper, batch) for batch in batched(users, len(users)//n_workers)))
-        return result 
-    
-    print("Creating walks")
-    result = await create_walks_parallel(np.tile(users_numba, N_WALKS), N_WORKERS)
+        for total, stats in zip(worker_stats, run_dynamic(work, begin, end, args.steal_chunk_size, N_WORKERS)):
+            total.busy_time += stats.busy_time
+            total.n_chunks += stats.n_chunks
+            total.n_units += stats.n_units
+        return chunk
 
-    print("Saving")
-    filename = DATA_DIR["output"] + DEST + "_" + str(YEAR)
-    if DRY_RUN:
-        filename += "_dry"
+    if NUM_SHARDS > 1:
+        filename = shard_filename(filename, SHARD_INDEX, NUM_SHARDS)
+
+    print(f"Creating and saving walks {unit_begin} to {unit_end} of {n_units}")
+    if args.backend == "processes":
+        create_walks_processes(
+            users_numba, graph, filename, unit_begin, unit_end, WALK_LEN, P, SEED, n_processes,
+            threads_per_process=max(N_WORKERS // n_processes, 1), chunk_size=chunk_size,
+            output_format=args.output_format, dtype=walk_dtype(graph.node_ids), transitions=transitions,
+            return_param=args.return_param, inout_param=args.inout_param, monitor=monitor,
+            checkpoint_params=checkpoint_params, resume=args.resume
+        )
+        # the partitions are internal to this run: merge them without leaving a manifest
+        merge_shards(filename, n_processes, args.output_format, (unit_begin, unit_end), write_manifest=False)
+        remove_shards(filename, n_processes, args.output_format)
+    elif checkpoint_params is not None:
+        checkpoint = Checkpoint(
+            filename, unit_begin, unit_end, chunk_size, args.output_format, checkpoint_params, args.resume
+        )
+        monitor.total_walks = checkpoint.n_pending_units()
+        if monitor.total_walks < unit_end - unit_begin:
+            print(f"resuming: {len(checkpoint.completed)} of {len(checkpoint.ranges)} chunks are done")
+        with monitor:
+            checkpoint.run(generate_chunk, WALK_LEN, walk_dtype(graph.node_ids), args.max_queued, graph.node_ids)
+    else:
+        writer = make_writer(
+            args.output_format, filename, WALK_LEN, unit_end - unit_begin, walk_dtype(graph.node_ids), graph.node_ids
+        )
+        try:
+            with monitor:
+                stream_walks(generate_chunk, unit_begin, unit_end, chunk_size, writer, args.max_queued)
+        except BaseException:
+            writer.close(check=False)
+            raise
+        writer.close()
+
+    if args.scheduler == "dynamic":
+        summary = summarize_stats(worker_stats)
+        print(f"worker busy time (s): {[round(t, 2) for t in summary['busy_time']]}, imbalance: {summary['imbalance']:.3f}")
 
-    with Path(filename + ".csv").open("w") as csv_file:
-        sample_walk = result[0][0]
-        sample_walk_len = len(sample_walk)
-        writer = csv.writer(csv_file, delimiter=",")
-        header_row = ["SOURCE"] + ["STEP_" + str(i) for i in range(sample_walk_len-1)]
-        writer.writerow(header_row)
-        for walks in result:
-            writer.writerows(walks)
+    if NUM_SHARDS > 1:
+        write_shard_manifest(filename, SHARD_INDEX, NUM_SHARDS, unit_begin, unit_end, **run_params)
+    metrics.close()
 
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
 
 
@@ -0,0 +1,65 @@
+"Generate synthetic layered graphs in the input format of create_walks.py, and optionally as a graph cache"
+
+import argparse
+from pathlib import Path
+
+from src.synthetic import GraphSpec, generate_graph, write_pickles, spec_dict
+from src.cache import cache_key, cache_path, save_graph
+from src.utils import layers_to_read
+from src.timing import PhaseTimer
+
+
+LAYERS = ["classmate", "household", "family", "colleague", "neighbor"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-nodes", dest="n_nodes", help="Number of nodes", type=int, default=1_000_000)
+    parser.add_argument("--dest", help="Directory to write the <layer>_<year>_adjacency_dict.pkl files to", type=str, required=True)
+    parser.add_argument("--years", help="Years to generate; each year is an independent graph", type=int, nargs="+", default=[2010])
+    parser.add_argument("--seed", help="Seed of the first year", type=int, default=0)
+    parser.add_argument("--layers", help="Layers of the graph cache, as loaded by create_walks.py", nargs="+", default=LAYERS)
+    parser.add_argument("--cache-dir", dest="cache_dir", help="If given, also writes the graph cache that create_walks.py --cache-dir reads for --dest", type=str)
+    parser.add_argument("--no-pickles", dest="pickles", help="Only write the graph cache", action="store_false")
+    parser.add_argument("--max-colleagues", dest="max_colleagues", help="Maximum number of colleagues per node", type=int, default=GraphSpec.max_colleagues)
+    parser.add_argument("--max-classmates", dest="max_classmates", help="Maximum number of classmates per node", type=int, default=GraphSpec.max_classmates)
+    parser.add_argument("--max-neighbors", dest="max_neighbors", help="Maximum number of neighbors per node", type=int, default=GraphSpec.max_neighbors)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.pickles and not args.cache_dir:
+        raise ValueError("--no-pickles needs --cache-dir")
+
+    data_dir = str(Path(args.dest)) + "/"
+    Path(data_dir).mkdir(parents=True, exist_ok=True)
+    spec = GraphSpec(
+        n_nodes=args.n_nodes,
+        max_colleagues=args.max_colleagues,
+        max_classmates=args.max_classmates,
+        max_neighbors=args.max_neighbors
+    )
+    layer_names = layers_to_read(args.layers)
+
+    timer = PhaseTimer()
+    for i, year in enumerate(args.years):
+        print(f"generating {year}")
+        with timer.phase(f"generate {year}"):
+            users, graph = generate_graph(spec, layer_names, seed=args.seed + i)
+        print(f"{len(graph.node_ids)} nodes, {len(graph.indices)} directed edges")
+
+        if args.pickles:
+            with timer.phase(f"write pickles {year}"):
+                write_pickles(graph, layer_names, data_dir, year)
+
+        if args.cache_dir:
+            with timer.phase(f"write cache {year}"):
+                inputs, _ = cache_key(data_dir, year, None, args.layers)
+                path = cache_path(args.cache_dir, data_dir, year, None, args.layers)
+                save_graph(path, users, graph, {**inputs, "synthetic": spec_dict(spec), "seed": args.seed + i})
+            print(f"graph cache for {year} at {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 import timeit 
 import asyncio
 import argparse
+import numba
 import numpy as np
 from math import log2
 
@@ -17,8 +18,15 @@ from src.walks import (
 )
 from src.walks_numba import (
     create_walks as create_walks_numba,
-    single_walk as single_walk_numba
+    single_walk as single_walk_numba,
+    create_walks_csr,
+    create_walks_parallel as create_walks_prange,
+    single_walk_csr
 )
+from src.walks_numpy import create_walks_lockstep
+from src.graph import convert_to_csr
+from src.walk_matrix import walk_width
+from src.transitions import NO_TRANSITIONS
 
 from src.async_timing import timer as async_timer
 from config import data_dir, config_dict 
@@ -74,6 +82,9 @@ async def main():
     print("converting to numba")
     users_numba, layers_numba, node_layer_dict_numba = convert_to_numba(users, layers, node_layer_dict)
 
+    print("converting to csr")
+    users_csr, graph = convert_to_csr(users, layers)
+
 
     # ## walks for a single node 
 
@@ -89,7 +100,14 @@ async def main():
         return single_walk_numba(users_numba[0], WALK_LEN, node_layer_dict_numba, layers_numba)
     t_single_numba = timeit.timeit(wrapper, number=N_RUNS) / N_RUNS
 
+    # ### Numba on CSR arrays
+    _ = single_walk_csr(users_csr[0], 5, graph) # compile
+    def wrapper():
+        return single_walk_csr(users_csr[0], WALK_LEN, graph)
+    t_single_csr = timeit.timeit(wrapper, number=N_RUNS) / N_RUNS
+
     print(f"single run numba/python: {t_single_numba/t_single_python}")
+    print(f"single run csr/numba: {t_single_csr/t_single_numba}")
 
     # ## Walks for multiple nodes
     print(f"timing multiple runs, sample size={SAMPLE_SIZE}")
@@ -102,8 +120,21 @@ async def main():
         return create_walks_numba(users_numba, WALK_LEN, node_layer_dict_numba, layers_numba)
     t_mult_numba = timeit.timeit(wrapper, number=N_RUNS) / N_RUNS
     
-    print(f"multiple runs, absolute: {t_mult_python} for python, {t_mult_numba} for numba")
+    _ = create_walks_csr(users_csr[:5], 5, graph)
+    def wrapper():
+        return create_walks_csr(users_csr, WALK_LEN, graph)
+    t_mult_csr = timeit.timeit(wrapper, number=N_RUNS) / N_RUNS
+
+    # ### NumPy, all walks one step at a time
+    def wrapper():
+        return create_walks_lockstep(users_csr, WALK_LEN, graph)
+    t_mult_lockstep = timeit.timeit(wrapper, number=N_RUNS) / N_RUNS
+
+    print(f"multiple runs, absolute: {t_mult_python} for python, {t_mult_numba} for numba, {t_mult_csr} for csr, {t_mult_lockstep} for numpy lockstep")
     print(f"multiple runs numba/python: {t_mult_numba/t_mult_python}")
+    print(f"multiple runs csr/numba: {t_mult_csr/t_mult_numba}")
+    print(f"multiple runs lockstep/python: {t_mult_lockstep/t_mult_python}")
+    print(f"multiple runs lockstep/csr: {t_mult_lockstep/t_mult_csr}")
 
 
     print("timing parallel runs")
@@ -134,6 +165,20 @@ async def main():
     
     print(f"n workers and times: {times}")
 
+    print("timing prange runs")
+    walks = np.empty((len(users_csr), walk_width(WALK_LEN)), dtype=np.int64)
+    lengths = np.empty(len(users_csr), dtype=np.int64)
+    create_walks_prange(users_csr[:10], 5, graph, 0.8, NO_TRANSITIONS, 1.0, 1.0, walks[:10], lengths[:10], 0) # compile
+    def wrapper():
+        return create_walks_prange(users_csr, WALK_LEN, graph, 0.8, NO_TRANSITIONS, 1.0, 1.0, walks, lengths, 0)
+
+    times_prange = {}
+    for n_workers in workers:
+        numba.set_num_threads(min(n_workers, numba.config.NUMBA_NUM_THREADS))
+        times_prange[n_workers] = timeit.timeit(wrapper, number=N_RUNS) / N_RUNS
+
+    print(f"n workers and times (prange): {times_prange}")
+
 
     n_walks = sum(len(x) for x in result)
     data = []
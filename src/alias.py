@@ -0,0 +1,51 @@
+"Alias tables for sampling weighted neighbors in constant time"
+
+import numpy as np
+
+
+def alias_table(weights):
+    """Build the alias table of one adjacency list with Vose's method.
+
+    Draw a neighbor by picking a uniform position `k` and keeping it with probability
+    `prob[k]`, otherwise taking `alias[k]`. If all weights are zero, sampling is uniform.
+
+    Returns:
+        tuple: (float32 array of probabilities, int32 array of alias positions)
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    n = len(weights)
+    prob = np.ones(n, dtype=np.float32)
+    alias = np.arange(n, dtype=np.int32)
+    total = weights.sum()
+    if n == 0 or total <= 0:
+        return prob, alias
+
+    scaled = weights * n / total
+    small = [k for k in range(n) if scaled[k] < 1]
+    large = [k for k in range(n) if scaled[k] >= 1]
+    while small and large:
+        s = small.pop()
+        g = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = g
+        scaled[g] = scaled[g] + scaled[s] - 1
+        if scaled[g] < 1:
+            small.append(g)
+        else:
+            large.append(g)
+    return prob, alias
+
+
+def alias_tables(layer_weights: dict):
+    "Alias tables of all adjacency lists of a layer, given as a dict of node -> weights of its neighbors"
+    return {node: alias_table(weights) for node, weights in layer_weights.items()}
+
+
+def alias_sample(choice_set: list, prob: np.ndarray, alias: np.ndarray):
+    "Weighted counterpart of `src.walks.custom_sample`"
+    if len(choice_set) == 0:
+        return -1
+    k = np.random.randint(len(choice_set))
+    if np.random.rand() >= prob[k]:
+        k = alias[k]
+    return np.int64(choice_set[k])
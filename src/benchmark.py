@@ -0,0 +1,204 @@
+"Benchmarks of the walk pipeline phases, with machine-readable results"
+
+import os
+import json
+import platform
+import subprocess
+import tempfile
+import warnings
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+
+from src.timing import timer, peak_rss_mb
+
+
+PERCENTILES = [50, 90, 99]
+
+
+def summarize_times(times: list):
+    "Mean, min, max and `PERCENTILES` of a list of times in seconds"
+    times = np.asarray(times, dtype=np.float64)
+    summary = {"n_runs": len(times), "mean": times.mean(), "min": times.min(), "max": times.max()}
+    for q in PERCENTILES:
+        summary[f"p{q}"] = np.percentile(times, q)
+    return {key: float(value) for key, value in summary.items()}
+
+
+def time_runs(fn, n_runs: int, n_warmup: int = 1):
+    """Call `fn` `n_warmup` times without timing it (e.g. to compile), then time `n_runs` calls.
+
+    Returns:
+        tuple: (list of times in seconds, result of the last call)
+    """
+    result = None
+    for _ in range(n_warmup):
+        result = fn()
+    times = []
+    for _ in range(n_runs):
+        with timer() as t:
+            result = fn()
+        times.append(t.time)
+    return times, result
+
+
+def count_steps(lengths: np.ndarray):
+    "Number of steps in walks with `lengths` entries, see `src.walk_matrix`"
+    return int(((np.asarray(lengths) - 1) // 2).sum())
+
+
+def benchmark_graph(graph, layer_names: list, walk_lens: list, threads: list, n_runs: int, n_single: int = 1000, seed: int = 0):
+    """Time each phase of the pipeline on one graph.
+
+    Phases:
+        load: unpickle the layers (`src.utils.load_data_arrays`)
+        convert: build the CSR graph (`src.graph.convert_to_csr`)
+        single: latency of single walks (`src.walks_numba.walk_into`)
+        batched: one walk per node on one thread (`src.walks_numba.create_walks_into`)
+        parallel: one walk per node on each number of `threads` (`src.walks_numba.create_walks_units`). The
+            efficiency is relative to the smallest number of threads. Numbers above the available cores are capped.
+
+    Args:
+        graph: `LayeredCSRGraph`, e.g. from `src.synthetic.generate_graph`. It is written as pickles to time loading.
+        layer_names: names of its layers, must contain "family", see `src.utils.layers_to_read`
+        walk_lens: lengths of the walks to time
+        threads: numbers of numba threads to time the parallel phase with
+        n_runs: number of timed runs of each phase
+        n_single: number of single walks to time
+        seed: seed of the walks
+
+    Returns:
+        list of dicts, one per phase and setting, with the times, steps per second and peak RSS
+    """
+    import numba
+    from src.utils import load_data_arrays
+    from src.graph import convert_to_csr
+    from src.transitions import NO_TRANSITIONS
+    from src.rng import seed_stream
+    from src.walks_numba import walk_into, create_walks_into, create_walks_units
+    from src.synthetic import write_pickles
+    from src.progress import new_counters
+
+    records = []
+
+    def record(phase, times, **fields):
+        records.append({"phase": phase, **fields, "times": summarize_times(times), "peak_rss_mb": peak_rss_mb()})
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_pickles(graph, layer_names, data_dir, 2000)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore") # the start nodes are the nodes of the family layer
+            times, (users, loaded, _) = time_runs(
+                lambda: load_data_arrays(data_dir + "/", 2000, None, layer_names), n_runs, n_warmup=0
+            )
+    record("load", times)
+
+    times, (nodes, graph) = time_runs(lambda: convert_to_csr(users, loaded), n_runs, n_warmup=0)
+    del loaded
+    record("convert", times, n_nodes=len(graph.node_ids), n_edges=len(graph.indices))
+
+    for walk_len in walk_lens:
+        buffer = np.empty(2 * walk_len + 1, dtype=np.int64)
+        state = seed_stream(seed, 0)
+        starts = nodes[np.random.default_rng(seed).integers(len(nodes), size=n_single)]
+        walk_into(starts[0], walk_len, graph, 0.8, NO_TRANSITIONS, 1.0, 1.0, buffer, state) # compile
+        times = []
+        steps = 0
+        for start in starts:
+            with timer() as t:
+                n = walk_into(start, walk_len, graph, 0.8, NO_TRANSITIONS, 1.0, 1.0, buffer, state)
+            times.append(t.time)
+            steps += (n - 1) // 2
+        record("single", times, walk_len=walk_len, steps_per_second=steps / sum(times))
+
+        out = np.empty((len(nodes), 2 * walk_len + 1), dtype=np.int64)
+        lengths = np.empty(len(nodes), dtype=np.int64)
+        times, _ = time_runs(
+            lambda: create_walks_into(nodes, walk_len, graph, 0.8, NO_TRANSITIONS, 1.0, 1.0, out, lengths, seed), n_runs
+        )
+        record("batched", times, walk_len=walk_len, steps_per_second=count_steps(lengths) / np.median(times))
+
+        counters = new_counters(numba.config.NUMBA_NUM_THREADS)
+        base_time = None
+        for n_threads in sorted({min(n, numba.config.NUMBA_NUM_THREADS) for n in threads}):
+            numba.set_num_threads(n_threads)
+            times, _ = time_runs(
+                lambda: create_walks_units(
+                    nodes, 0, len(nodes), walk_len, graph, 0.8, NO_TRANSITIONS, 1.0, 1.0, out, lengths, seed, counters
+                ),
+                n_runs
+            )
+            base_time = base_time or np.median(times) * n_threads
+            record(
+                "parallel", times, walk_len=walk_len, n_threads=n_threads,
+                steps_per_second=count_steps(lengths) / np.median(times),
+                efficiency=float(base_time / (n_threads * np.median(times)))
+            )
+    return records
+
+
+def environment():
+    "Metadata of the machine and code version a benchmark ran on"
+    import numba
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numba": numba.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numba_threads": numba.config.NUMBA_NUM_THREADS
+    }
+
+
+def record_key(record: dict):
+    "Identify a benchmark record by everything except its measurements"
+    fields = ("graph_size", "phase", "walk_len", "n_threads")
+    return tuple(record.get(field) for field in fields)
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float = 0.1):
+    """Compare the median times of two benchmark results.
+
+    Args:
+        baseline, current: contents of benchmark json files
+        tolerance: relative slowdown of the median time that counts as a regression
+
+    Returns:
+        list of dicts with the key, both medians and the ratio current / baseline of every record in both results,
+            and whether it is a regression
+    """
+    baseline_records = {record_key(r): r for r in baseline["records"]}
+    comparison = []
+    for record in current["records"]:
+        key = record_key(record)
+        if key not in baseline_records:
+            continue
+        before = baseline_records[key]["times"]["p50"]
+        after = record["times"]["p50"]
+        ratio = after / before if before > 0 else float("inf")
+        comparison.append({
+            "key": dict(zip(("graph_size", "phase", "walk_len", "n_threads"), key)),
+            "baseline_p50": before,
+            "current_p50": after,
+            "ratio": ratio,
+            "regression": ratio > 1 + tolerance
+        })
+    return comparison
+
+
+def read_results(path: str):
+    with Path(path).open() as f:
+        return json.load(f)
+
+
+def write_results(results: dict, path: str):
+    with Path(path).open("w") as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,129 @@
+"On-disk cache of compiled layered graphs"
+
+import json
+import os
+import hashlib
+import shutil
+from pathlib import Path
+import numpy as np
+
+from src.graph import LayeredCSRGraph, convert_to_csr
+from src.utils import load_data_arrays, load_weights
+from src.parallel_load import load_csr_parallel
+
+
+CACHE_VERSION = 2 # increment when the layout of the cache changes
+
+
+def cache_key(data_dir: str, year: int, connected_node_file, layer_types: list, weighted: bool = False):
+    "Identify a compiled graph by its inputs"
+    inputs = {
+        "data_dir": str(Path(data_dir).resolve()),
+        "year": year,
+        "connected_node_file": connected_node_file,
+        "layer_types": list(layer_types),
+        "weighted": weighted
+    }
+    digest = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
+    return inputs, digest
+
+
+def cache_path(cache_dir: str, data_dir: str, year: int, connected_node_file, layer_types: list, weighted: bool = False):
+    "Directory of the cached graph for these inputs"
+    _, digest = cache_key(data_dir, year, connected_node_file, layer_types, weighted)
+    return Path(cache_dir) / f"graph_{year}_{digest}"
+
+
+def save_graph(path, users: np.ndarray, graph: LayeredCSRGraph, meta: dict = None):
+    """Write a graph and its users as flat `.npy` arrays.
+
+    The files are written to a temporary directory that is renamed at the end,
+    so concurrent jobs never see a partial cache.
+
+    Args:
+        path: directory of the cache
+        users: dense indices of the connected users
+        graph: `LayeredCSRGraph`
+        meta: additional information stored in `meta.json`
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    tmp_path.mkdir(parents=True, exist_ok=True)
+
+    np.save(tmp_path / "users.npy", users)
+    for field, array in graph._asdict().items():
+        np.save(tmp_path / f"{field}.npy", array)
+
+    meta = dict(meta or {})
+    meta.update(version=CACHE_VERSION, n_nodes=len(graph.node_ids), n_layers=graph.indptr.shape[0])
+    with (tmp_path / "meta.json").open("w") as f:
+        json.dump(meta, f, indent=2)
+
+    try:
+        tmp_path.rename(path)
+    except OSError: # another job finished the same cache first
+        shutil.rmtree(tmp_path)
+
+
+def read_meta(path):
+    "Return the metadata of a cached graph, or None if there is no valid cache at `path`"
+    meta_file = Path(path) / "meta.json"
+    if not meta_file.exists():
+        return None
+    with meta_file.open() as f:
+        meta = json.load(f)
+    if meta.get("version") != CACHE_VERSION:
+        return None
+    return meta
+
+
+def load_graph(path, mmap_mode: str = "r"):
+    """Load a cached graph.
+
+    With `mmap_mode="r"` the arrays are memory-mapped: loading is almost instant, and
+    jobs on the same node share the pages through the page cache.
+
+    Returns:
+        tuple: (dense indices of the users, `LayeredCSRGraph`)
+    """
+    path = Path(path)
+    if read_meta(path) is None:
+        raise FileNotFoundError(f"no graph cache of version {CACHE_VERSION} at {path}")
+
+    def load(name):
+        return np.asarray(np.load(path / f"{name}.npy", mmap_mode=mmap_mode))
+
+    graph = LayeredCSRGraph(**{field: load(field) for field in LayeredCSRGraph._fields})
+    return load("users"), graph
+
+
+def compile_graph(cache_dir: str, data_dir: str, year: int, connected_node_file=None, layer_types: list = ["neighbor", "colleague"], load_workers: int = 1, weighted: bool = False):
+    """Convert the pickled layers to a `LayeredCSRGraph` and store it in `cache_dir`, unless it is already there.
+
+    If `load_workers` is larger than 1, the layers are loaded in parallel with `src.parallel_load.load_csr_parallel`.
+    If `weighted` is true, the graph includes alias tables built from the edge weights.
+
+    Returns:
+        pathlib.Path: directory of the cached graph
+    """
+    path = cache_path(cache_dir, data_dir, year, connected_node_file, layer_types, weighted)
+    if read_meta(path) is not None:
+        return path
+
+    if load_workers > 1:
+        users, graph = load_csr_parallel(data_dir, year, connected_node_file, layer_types, load_workers, weighted=weighted)
+    else:
+        users, layers, _ = load_data_arrays(data_dir, year, connected_node_file, layer_types)
+        weights = load_weights(data_dir, year, connected_node_file, layer_types) if weighted else None
+        users, graph = convert_to_csr(users, layers, weights)
+        del layers, weights
+
+    inputs, _ = cache_key(data_dir, year, connected_node_file, layer_types, weighted)
+    save_graph(path, users, graph, inputs)
+    return path
+
+
+def load_or_compile_graph(cache_dir: str, data_dir: str, year: int, connected_node_file=None, layer_types: list = ["neighbor", "colleague"], mmap_mode: str = "r", load_workers: int = 1, weighted: bool = False):
+    "Load the cached graph for these inputs, compiling it first if needed. See `compile_graph` and `load_graph`."
+    path = compile_graph(cache_dir, data_dir, year, connected_node_file, layer_types, load_workers, weighted)
+    return load_graph(path, mmap_mode)
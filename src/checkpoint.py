@@ -0,0 +1,161 @@
+"""Checkpointed walk generation that can resume after the job is killed.
+
+The walks are written in numbered chunk files `<filename>_chunk<i>`. `<filename>.checkpoint.json`
+records the parameters of the run and the unit range of every completed chunk. A unit is
+one walk, `repeat * n_nodes + node_position`. A chunk is written under a temporary name and renamed
+into place before it is recorded, so every recorded chunk is complete. Walks are seeded per unit
+(see `src.rng.reseed_walk`), so the global seed is all the RNG state a resumed run needs: it
+recreates exactly the walks of the chunks that were not recorded.
+
+When all chunks exist they are merged into `filename`, and the chunk files and the checkpoint are removed.
+"""
+
+import os
+import json
+from pathlib import Path
+import numpy as np
+
+from src.pipeline import chunk_ranges, stream_chunks
+from src.shards import merge_outputs
+from src.writers import make_writer, rename_output, remove_output
+
+
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+
+def chunk_filename(filename: str, index: int):
+    "Name of the output of one chunk, without file extension"
+    return f"{filename}_chunk{index:06d}"
+
+
+def _normalize(params: dict):
+    "`params` as they are read back from json, to compare them with a saved checkpoint"
+    return json.loads(json.dumps(params))
+
+
+class Checkpoint:
+    """Completed chunks of a checkpointed run.
+
+    Nothing is written until the first chunk completes.
+
+    Args:
+        filename: output file without extension
+        unit_begin, unit_end: range of units to create
+        chunk_size: number of walks per chunk file
+        output_format: one of `src.writers.OUTPUT_FORMATS`
+        params: parameters of the run, e.g. seed, walk_len and n_nodes. A run can only resume a checkpoint with the same parameters.
+        resume: if true, continues from an existing checkpoint of `filename`. Otherwise any existing checkpoint is started over.
+
+    Raises:
+        ValueError if `resume` is true and the existing checkpoint belongs to a different run.
+    """
+    def __init__(self, filename: str, unit_begin: int, unit_end: int, chunk_size: int, output_format: str,
+                 params: dict, resume: bool = False):
+        self.filename = filename
+        self.path = Path(filename + CHECKPOINT_SUFFIX)
+        self.output_format = output_format
+        self.ranges = chunk_ranges(unit_begin, unit_end, chunk_size)
+        self.state = {
+            "unit_begin": unit_begin,
+            "unit_end": unit_end,
+            "chunk_size": chunk_size,
+            "output_format": output_format,
+            "params": _normalize(params),
+            "chunks": []
+        }
+        if resume and self.path.exists():
+            with self.path.open() as f:
+                saved = json.load(f)
+            for key in ("unit_begin", "unit_end", "chunk_size", "output_format", "params"):
+                if saved[key] != self.state[key]:
+                    raise ValueError(f"cannot resume {self.path}: it has {key} {saved[key]}, this run {self.state[key]}")
+            self.state["chunks"] = saved["chunks"]
+
+    @property
+    def completed(self):
+        "Indices of the completed chunks"
+        return {chunk["index"] for chunk in self.state["chunks"]}
+
+    def pending(self):
+        "List of (index, begin, end) of the chunks that still have to be created"
+        completed = self.completed
+        return [(i, begin, end) for i, (begin, end) in enumerate(self.ranges) if i not in completed]
+
+    def n_pending_units(self):
+        return sum(end - begin for _, begin, end in self.pending())
+
+    def record(self, index: int, begin: int, end: int):
+        "Mark a chunk whose files are in place as completed"
+        self.state["chunks"].append({"index": index, "unit_begin": begin, "unit_end": end})
+        self._save()
+
+    def _save(self):
+        # replace the file in one step, so a kill during the write leaves the previous checkpoint
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w") as f:
+            json.dump(self.state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_path.replace(self.path)
+
+    def finish(self):
+        "Merge the chunks into the output and remove them and the checkpoint"
+        if self.pending():
+            raise ValueError(f"{len(self.pending())} chunks of {self.filename} are missing")
+        chunk_names = [chunk_filename(self.filename, i) for i in range(len(self.ranges))]
+        merge_outputs(self.filename, chunk_names, self.output_format)
+        self.path.unlink(missing_ok=True)
+        for name in chunk_names:
+            remove_output(name, self.output_format)
+
+    def run(self, generate_chunk, walk_len: int, dtype=np.int64, max_queued: int = 2, node_ids: np.ndarray = None):
+        """Create and write the pending chunks with `src.pipeline.stream_chunks`, then `finish`.
+
+        Args:
+            generate_chunk: function (begin, end) -> (walks, lengths) that creates the walks of units [begin, end),
+                or compact walks with the "compact" output format
+            walk_len: the length of the random walks
+            dtype: integer type of the output, see `src.walk_matrix.walk_dtype`
+            max_queued: maximum number of chunks waiting to be written
+            node_ids: original node identifiers, for the "compact" output format
+        """
+        pending = self.pending()
+        writer = ChunkWriter(self, pending, walk_len, dtype, node_ids)
+        stream_chunks(generate_chunk, [(begin, end) for _, begin, end in pending], writer, max_queued)
+        self.finish()
+
+
+class ChunkWriter:
+    """Writer for `src.pipeline.stream_chunks` that puts each chunk in its own file and records it in a `Checkpoint`.
+
+    Args:
+        checkpoint: `Checkpoint` of the run
+        pending: list of (index, begin, end) of the chunks that will be written, in order
+        walk_len: the length of the random walks
+        dtype: integer type of the output
+        node_ids: original node identifiers, for the "compact" output format
+    """
+    def __init__(self, checkpoint: Checkpoint, pending: list, walk_len: int, dtype=np.int64, node_ids: np.ndarray = None):
+        self.checkpoint = checkpoint
+        self.pending = iter(pending)
+        self.walk_len = walk_len
+        self.dtype = dtype
+        self.node_ids = node_ids
+
+    def write(self, *chunk):
+        "Write a chunk as `src.writers.make_writer` writers take it, e.g. (walks, lengths)"
+        index, begin, end = next(self.pending)
+        n_walks = len(chunk[0])
+        if n_walks != end - begin:
+            raise ValueError(f"chunk {index} should have {end - begin} walks, got {n_walks}")
+        name = chunk_filename(self.checkpoint.filename, index)
+        output_format = self.checkpoint.output_format
+        writer = make_writer(output_format, name + "_partial", self.walk_len, n_walks, self.dtype, self.node_ids)
+        try:
+            writer.write(*chunk)
+        except BaseException:
+            writer.close(check=False)
+            raise
+        writer.close()
+        rename_output(name + "_partial", name, output_format)
+        self.checkpoint.record(index, begin, end)
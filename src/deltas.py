@@ -0,0 +1,304 @@
+"""Graphs of several years stored as one base graph and per-year edge deltas.
+
+All years share one node map, the union of their node identifiers, so a dense index is the same
+node in every year. The base year is stored as a regular graph cache (see `src.cache.save_graph`).
+For each other year, every layer stores the edges it lacks (removed) and has in addition (added)
+compared to the base, as sorted keys `row * n_nodes + col`. `load_year_graph` memory-maps the base
+and merges a year's deltas into it in one pass over the edges, without reading any pickles.
+
+Nodes that are not in a year are isolated in that year's graph. Neighbors are still sorted by their
+dense index, and walks are seeded by the position of their start node in the users of the year, so the
+walks of a year are the same as with the graph compiled for that year alone.
+"""
+
+import json
+import os
+import hashlib
+import shutil
+from pathlib import Path
+import numba
+import numpy as np
+
+from src.graph import LayeredCSRGraph, SUBSET_COUNTS, layer_mask_from_indptr, index_dtype
+from src.cache import CACHE_VERSION, cache_path, compile_graph, load_graph, read_meta, save_graph
+
+
+def years_key(data_dir: str, years: list, connected_node_file, layer_types: list, base_year: int):
+    "Identify a multi-year graph by its inputs"
+    inputs = {
+        "data_dir": str(Path(data_dir).resolve()),
+        "years": sorted(years),
+        "base_year": base_year,
+        "connected_node_file": connected_node_file,
+        "layer_types": list(layer_types)
+    }
+    digest = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
+    return inputs, digest
+
+
+def years_path(cache_dir: str, data_dir: str, years: list, connected_node_file, layer_types: list, base_year: int = None):
+    "Directory of the multi-year graph for these inputs. The base year defaults to the first year."
+    base_year = min(years) if base_year is None else base_year
+    _, digest = years_key(data_dir, years, connected_node_file, layer_types, base_year)
+    return Path(cache_dir) / f"graphs_{min(years)}-{max(years)}_{digest}"
+
+
+def read_years_meta(path):
+    "Return the metadata of a multi-year graph, or None if there is no complete one at `path`"
+    meta_file = Path(path) / "meta.json"
+    if not meta_file.exists():
+        return None
+    with meta_file.open() as f:
+        meta = json.load(f)
+    if meta.get("version") != CACHE_VERSION:
+        return None
+    return meta
+
+
+def expand_graph(graph: LayeredCSRGraph, node_ids: np.ndarray):
+    """Express an unweighted graph over a superset of its nodes.
+
+    Args:
+        graph: `LayeredCSRGraph`
+        node_ids: sorted node identifiers that include all of `graph.node_ids`
+
+    Returns:
+        tuple: (array mapping the dense indices of `graph` to those of `node_ids`, `LayeredCSRGraph` over `node_ids`)
+    """
+    remap = np.searchsorted(node_ids, graph.node_ids)
+    indptr = np.zeros((graph.indptr.shape[0], len(node_ids) + 1), dtype=np.int64)
+    for l in range(indptr.shape[0]):
+        indptr[l, 0] = graph.indptr[l, 0]
+        indptr[l, remap + 1] = np.diff(graph.indptr[l])
+        np.cumsum(indptr[l], out=indptr[l])
+    indices = remap.astype(index_dtype(len(node_ids)))[graph.indices] # the order within each list is kept
+    layer_mask = layer_mask_from_indptr(indptr)
+    return remap, graph._replace(
+        node_ids=np.asarray(node_ids),
+        indptr=indptr,
+        indices=indices,
+        layer_mask=layer_mask,
+        layer_count=SUBSET_COUNTS[layer_mask].astype(np.uint8)
+    )
+
+
+@numba.njit(nogil=True)
+def diff_layer(base_indptr: numba.int64[:], base_indices, indptr: numba.int64[:], indices):
+    """Edges of one layer that are only in the base graph (removed) or only in the other graph (added).
+
+    Both graphs must have the same nodes. Adjacency lists are compared as sorted multisets.
+
+    Args:
+        base_indptr, base_indices: offsets of the layer in the base graph (one row of `indptr`) and its `indices`
+        indptr, indices: the same for the other graph
+
+    Returns:
+        tuple: (sorted keys `row * n_nodes + col` of the removed edges, and of the added edges)
+    """
+    n_nodes = base_indptr.shape[0] - 1
+    removed = np.empty(base_indptr[n_nodes] - base_indptr[0], dtype=np.int64)
+    added = np.empty(indptr[n_nodes] - indptr[0], dtype=np.int64)
+    n_removed = 0
+    n_added = 0
+    for i in range(n_nodes):
+        a, a_end = base_indptr[i], base_indptr[i + 1]
+        b, b_end = indptr[i], indptr[i + 1]
+        while a < a_end or b < b_end:
+            if b == b_end or (a < a_end and base_indices[a] < indices[b]):
+                removed[n_removed] = i * n_nodes + base_indices[a]
+                n_removed += 1
+                a += 1
+            elif a == a_end or indices[b] < base_indices[a]:
+                added[n_added] = i * n_nodes + indices[b]
+                n_added += 1
+                b += 1
+            else:
+                a += 1
+                b += 1
+    return removed[:n_removed], added[:n_added]
+
+
+@numba.njit(nogil=True)
+def apply_layer(base_indptr: numba.int64[:], base_indices, removed: numba.int64[:], added: numba.int64[:],
+                indptr: numba.int64[:], indices):
+    """Write the adjacency lists of one layer of the base graph with the deltas of `diff_layer` applied.
+
+    Args:
+        base_indptr, base_indices: offsets of the layer in the base graph and its `indices`
+        removed, added: keys from `diff_layer`
+        indptr: offsets of the layer in the output, see `apply_deltas`
+        indices: output array of neighbors
+    """
+    n_nodes = base_indptr.shape[0] - 1
+    r = 0
+    k = 0
+    for i in range(n_nodes):
+        out = indptr[i]
+        node_end = (i + 1) * n_nodes
+        for a in range(base_indptr[i], base_indptr[i + 1]):
+            key = i * n_nodes + base_indices[a]
+            while k < added.shape[0] and added[k] < key:
+                indices[out] = added[k] - i * n_nodes
+                out += 1
+                k += 1
+            if r < removed.shape[0] and removed[r] == key:
+                r += 1
+            else:
+                indices[out] = base_indices[a]
+                out += 1
+        while k < added.shape[0] and added[k] < node_end:
+            indices[out] = added[k] - i * n_nodes
+            out += 1
+            k += 1
+
+
+def apply_deltas(base: LayeredCSRGraph, removed: list, added: list):
+    """The graph of another year from the base graph and the deltas of each layer.
+
+    Args:
+        base: unweighted `LayeredCSRGraph`
+        removed, added: per layer, the keys from `diff_layer`
+
+    Returns:
+        `LayeredCSRGraph` with the nodes of `base`
+    """
+    n_layers, n_nodes = base.indptr.shape[0], base.indptr.shape[1] - 1
+    indptr = np.zeros((n_layers, n_nodes + 1), dtype=np.int64)
+    offset = 0
+    for l in range(n_layers):
+        degrees = (
+            np.diff(base.indptr[l])
+            - np.bincount(removed[l] // n_nodes, minlength=n_nodes)
+            + np.bincount(added[l] // n_nodes, minlength=n_nodes)
+        )
+        indptr[l, 0] = offset
+        np.cumsum(degrees, out=indptr[l, 1:])
+        indptr[l, 1:] += offset
+        offset = indptr[l, -1]
+
+    indices = np.empty(offset, dtype=base.indices.dtype)
+    for l in range(n_layers):
+        apply_layer(base.indptr[l], base.indices, removed[l], added[l], indptr[l], indices)
+    layer_mask = layer_mask_from_indptr(indptr)
+    return base._replace(
+        indptr=indptr,
+        indices=indices,
+        layer_mask=layer_mask,
+        layer_count=SUBSET_COUNTS[layer_mask].astype(np.uint8)
+    )
+
+
+def save_deltas(path, users: np.ndarray, removed: list, added: list, meta: dict = None):
+    "Write the users and per-layer deltas of one year, through a temporary directory like `src.cache.save_graph`"
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    tmp_path.mkdir(parents=True, exist_ok=True)
+
+    np.save(tmp_path / "users.npy", users)
+    for l, (layer_removed, layer_added) in enumerate(zip(removed, added)):
+        np.save(tmp_path / f"removed_{l}.npy", layer_removed)
+        np.save(tmp_path / f"added_{l}.npy", layer_added)
+    meta = dict(meta or {})
+    meta.update(version=CACHE_VERSION, n_layers=len(removed))
+    with (tmp_path / "meta.json").open("w") as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True) # left by an interrupted compilation
+    tmp_path.rename(path)
+
+
+def compile_years(cache_dir: str, data_dir: str, years: list, connected_node_file=None,
+                  layer_types: list = ["neighbor", "colleague"], load_workers: int = 1, base_year: int = None):
+    """Compile the graphs of several years into a base graph and per-year deltas in `cache_dir`, unless they are already there.
+
+    Each year is first compiled on its own with `src.cache.compile_graph`, so the pickles of every year are read
+    once. Year caches that did not exist before are removed at the end.
+
+    Args:
+        cache_dir: directory of the graph caches
+        data_dir, connected_node_file, layer_types, load_workers: see `src.cache.compile_graph`
+        years: years to compile
+        base_year: year stored as the full graph. Defaults to the first year.
+
+    Returns:
+        pathlib.Path: directory of the multi-year graph
+
+    Raises:
+        ValueError if `base_year` is not one of `years`.
+    """
+    base_year = min(years) if base_year is None else base_year
+    if base_year not in years:
+        raise ValueError(f"base year {base_year} is not one of {years}")
+    path = years_path(cache_dir, data_dir, years, connected_node_file, layer_types, base_year)
+    if read_years_meta(path) is not None:
+        return path
+
+    year_paths = {}
+    created = []
+    for year in years:
+        year_paths[year] = cache_path(cache_dir, data_dir, year, connected_node_file, layer_types)
+        if read_meta(year_paths[year]) is None:
+            created.append(year_paths[year])
+        compile_graph(cache_dir, data_dir, year, connected_node_file, layer_types, load_workers)
+
+    node_ids = np.unique(np.concatenate([
+        np.load(year_paths[year] / "node_ids.npy", mmap_mode="r") for year in years
+    ]))
+    inputs, _ = years_key(data_dir, years, connected_node_file, layer_types, base_year)
+    path.mkdir(parents=True, exist_ok=True)
+
+    users, graph = load_graph(year_paths[base_year])
+    remap, base = expand_graph(graph, node_ids)
+    save_graph(path / "base", remap[users], base, {**inputs, "year": base_year})
+    base = load_graph(path / "base")[1]
+
+    n_edges = {base_year: len(base.indices)}
+    n_changed = {base_year: 0}
+    for year in years:
+        if year == base_year:
+            continue
+        users, graph = load_graph(year_paths[year])
+        remap, graph = expand_graph(graph, node_ids)
+        removed, added = zip(*(
+            diff_layer(base.indptr[l], base.indices, graph.indptr[l], graph.indices) for l in range(base.indptr.shape[0])
+        ))
+        save_deltas(path / f"delta_{year}", remap[users], removed, added, {**inputs, "year": year})
+        n_edges[year] = len(graph.indices)
+        n_changed[year] = sum(len(a) for a in removed) + sum(len(a) for a in added)
+        del graph
+
+    meta = dict(inputs, version=CACHE_VERSION, n_nodes=len(node_ids), n_edges=n_edges, n_changed=n_changed)
+    with (path / "meta.json").open("w") as f: # written last: marks the multi-year graph as complete
+        json.dump(meta, f, indent=2)
+    for year_path in created:
+        shutil.rmtree(year_path)
+    return path
+
+
+def load_year_graph(path, year: int, mmap_mode: str = "r"):
+    """Load the graph of one year from a multi-year graph.
+
+    The base year is memory-mapped like `src.cache.load_graph`. Other years are built in memory from the
+    memory-mapped base and their deltas.
+
+    Returns:
+        tuple: (dense indices of the users of `year`, `LayeredCSRGraph`)
+
+    Raises:
+        FileNotFoundError if there is no multi-year graph at `path`, or it does not include `year`.
+    """
+    path = Path(path)
+    meta = read_years_meta(path)
+    if meta is None:
+        raise FileNotFoundError(f"no multi-year graph of version {CACHE_VERSION} at {path}")
+    if year not in meta["years"]:
+        raise FileNotFoundError(f"the multi-year graph at {path} has years {meta['years']}, not {year}")
+    users, base = load_graph(path / "base", mmap_mode)
+    if year == meta["base_year"]:
+        return users, base
+
+    delta_path = path / f"delta_{year}"
+    n_layers = base.indptr.shape[0]
+    removed = [np.load(delta_path / f"removed_{l}.npy", mmap_mode=mmap_mode) for l in range(n_layers)]
+    added = [np.load(delta_path / f"added_{l}.npy", mmap_mode=mmap_mode) for l in range(n_layers)]
+    return np.load(delta_path / "users.npy"), apply_deltas(base, removed, added)
@@ -0,0 +1,196 @@
+"Compressed sparse row (CSR) representation of layered graphs"
+
+from typing import NamedTuple
+from itertools import chain
+import numpy as np
+
+
+MAX_LAYERS = 8 # layer masks are stored as uint8
+
+
+def layer_subset_table(n_layers: int = MAX_LAYERS):
+    """Enumerate the layers contained in each bitmask of `n_layers` layers.
+
+    Returns:
+        tuple: (
+            array of shape (2**n_layers, n_layers); row `mask` lists the layer indices in `mask`
+                in increasing order, padded with -1,
+            array of shape (2**n_layers,) with the number of layers in each mask
+            )
+    """
+    masks = np.arange(2**n_layers)
+    bits = (masks[:, None] >> np.arange(n_layers)) & 1
+    order = np.argsort(-bits, axis=1, kind="stable")
+    table = np.where(np.take_along_axis(bits, order, axis=1) == 1, order, -1).astype(np.int64)
+    return table, bits.sum(axis=1).astype(np.int64)
+
+
+SUBSET_LAYERS, SUBSET_COUNTS = layer_subset_table()
+
+
+def layer_mask_from_indptr(indptr: np.ndarray):
+    "Bitmask of the layers in which each node has at least one edge"
+    has_edges = (np.diff(indptr, axis=1) > 0).astype(np.uint8)
+    mask = np.zeros(indptr.shape[1] - 1, dtype=np.uint8)
+    for l in range(indptr.shape[0]):
+        mask |= has_edges[l] << l
+    return mask
+
+
+class LayeredCSRGraph(NamedTuple):
+    """Layered graph stored as flat arrays.
+
+    Node identifiers are remapped to dense indices `0, ..., n_nodes - 1`. All layers
+    share one `indices` array: the neighbors of node `i` on layer `l` are
+    `indices[indptr[l, i]:indptr[l, i + 1]]`.
+
+    Attributes:
+        node_ids: sorted original node identifiers; `node_ids[i]` is the identifier of node `i`.
+        indptr: array of shape (n_layers, n_nodes + 1) with offsets into `indices`.
+        indices: dense indices of the neighbors, stacked layer by layer.
+        layer_mask: uint8 bitmask per node of the layers in which it has at least one edge.
+        layer_count: uint8 number of layers in `layer_mask`.
+        alias_prob: float32 alias probability of each edge, aligned with `indices`. Empty if the graph is unweighted.
+        alias_index: int32 alias position of each edge within its adjacency list. Empty if the graph is unweighted.
+    """
+    node_ids: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    layer_mask: np.ndarray
+    layer_count: np.ndarray
+    alias_prob: np.ndarray
+    alias_index: np.ndarray
+
+
+def alias_arrays(indptr: np.ndarray, weights):
+    """Alias tables of a graph with edge weights `weights` aligned with its `indices`.
+
+    Returns empty arrays if `weights` is None, which marks the graph as unweighted.
+    """
+    if weights is None:
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int32)
+    from src.walks_numba import build_alias_tables
+    return build_alias_tables(indptr, np.asarray(weights, dtype=np.float64))
+
+
+def index_dtype(n_nodes: int):
+    "Smallest integer type that can hold dense indices of `n_nodes` nodes"
+    return np.int32 if n_nodes < np.iinfo(np.int32).max else np.int64
+
+
+def to_dense(graph: LayeredCSRGraph, ids):
+    """Map original node identifiers to dense indices.
+
+    Raises:
+        KeyError if any identifier is not in the graph.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    idx = np.searchsorted(graph.node_ids, ids)
+    idx[idx == len(graph.node_ids)] = 0
+    missing = graph.node_ids[idx] != ids
+    if missing.any():
+        raise KeyError(f"{missing.sum()} node identifiers are not in the graph, e.g. {ids[missing][0]}")
+    return idx.astype(np.int64)
+
+
+def fill_indptr(indptr_row: np.ndarray, rows: np.ndarray, degrees: np.ndarray, offset: int):
+    """Fill the offsets of one layer.
+
+    Args:
+        indptr_row: array of shape (n_nodes + 1,) to fill
+        rows: dense indices of the nodes with an adjacency list on this layer
+        degrees: lengths of the adjacency lists
+        offset: position of the first edge of this layer in `indices`
+    """
+    counts = np.bincount(rows, weights=degrees, minlength=len(indptr_row) - 1).astype(np.int64)
+    indptr_row[0] = offset
+    np.cumsum(counts, out=indptr_row[1:])
+    indptr_row[1:] += offset
+
+
+def layer_arrays(layer: dict):
+    "Return the keys, degrees and concatenated neighbors of an adjacency dict as arrays"
+    keys = np.fromiter(layer.keys(), dtype=np.int64, count=len(layer))
+    degrees = np.fromiter((len(v) for v in layer.values()), dtype=np.int64, count=len(layer))
+    neighbors = np.fromiter(chain.from_iterable(layer.values()), dtype=np.int64, count=degrees.sum())
+    return keys, degrees, neighbors
+
+
+def layer_weight_array(layer: dict, layer_weights):
+    """Concatenated edge weights of a layer, in the order of `layer_arrays`.
+
+    Args:
+        layer: adjacency dict
+        layer_weights: dict of node -> weights of its neighbors, in the order of `layer`. If None, all weights are 1.
+
+    Raises:
+        ValueError if the weights of a node do not match its adjacency list.
+    """
+    n_edges = sum(len(v) for v in layer.values())
+    if layer_weights is None:
+        return np.ones(n_edges, dtype=np.float64)
+    weights = np.fromiter(
+        chain.from_iterable(layer_weights.get(node, ()) for node in layer.keys()), dtype=np.float64
+    )
+    if len(weights) != n_edges:
+        raise ValueError(f"layer has {n_edges} edges but {len(weights)} weights")
+    return weights
+
+
+def convert_to_csr(users: list, layers: list, weights: list = None):
+    """Convert adjacency dicts to a `LayeredCSRGraph`.
+
+    The node set is the union of `users`, the keys and the neighbors in all layers.
+    Neighbors of each node are sorted by their dense index.
+
+    Args:
+        users: list of node identifiers.
+        layers: list of adjacency lists
+        weights: optional list with, for each layer, a dict of node -> weights of its neighbors, or None
+            for a layer with equal weights. If given, the graph stores alias tables for weighted sampling.
+
+    Returns:
+        tuple: (dense indices of `users`, `LayeredCSRGraph`)
+    """
+    assert len(layers) <= MAX_LAYERS
+    arrays = [layer_arrays(layer) for layer in layers]
+
+    node_ids = np.unique(np.concatenate(
+        [np.asarray(users, dtype=np.int64)] + [a for keys, _, nbrs in arrays for a in (keys, nbrs)]
+    ))
+    n_nodes = len(node_ids)
+    dtype = index_dtype(n_nodes)
+
+    indptr = np.zeros((len(layers), n_nodes + 1), dtype=np.int64)
+    indices = []
+    edge_weights = []
+    offset = 0
+    for l, (keys, degrees, neighbors) in enumerate(arrays):
+        rows = np.repeat(np.searchsorted(node_ids, keys), degrees)
+        cols = np.searchsorted(node_ids, neighbors)
+        order = np.lexsort((cols, rows))
+        indices.append(cols[order].astype(dtype))
+        if weights is not None:
+            edge_weights.append(layer_weight_array(layers[l], weights[l])[order])
+
+        fill_indptr(indptr[l], np.searchsorted(node_ids, keys), degrees, offset)
+        offset += len(neighbors)
+
+    if indices:
+        indices = np.concatenate(indices)
+    else:
+        indices = np.empty(0, dtype=dtype)
+    edge_weights = np.concatenate(edge_weights) if weights is not None and edge_weights else None
+
+    layer_mask = layer_mask_from_indptr(indptr)
+    alias_prob, alias_index = alias_arrays(indptr, edge_weights)
+    graph = LayeredCSRGraph(
+        node_ids=node_ids,
+        indptr=indptr,
+        indices=indices,
+        layer_mask=layer_mask,
+        layer_count=SUBSET_COUNTS[layer_mask].astype(np.uint8),
+        alias_prob=alias_prob,
+        alias_index=alias_index
+    )
+    return to_dense(graph, users), graph
@@ -0,0 +1,353 @@
+"""Estimate the memory of a walk run and size it to a memory budget.
+
+The estimates are sums of array sizes plus per-object costs of the pickled adjacency dicts,
+calibrated on CPython 3.11 with 64-bit node identifiers. They are meant for choosing the
+SLURM `--mem`, the chunk size and the number of worker processes, not to the byte.
+"""
+
+import math
+import pickle
+import warnings
+from dataclasses import dataclass, field
+from pathlib import Path
+import numpy as np
+
+from src.graph import index_dtype
+from src.utils import layers_to_read
+
+
+UNITS = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+PY_KEY_BYTES = 190 # per node of an adjacency dict: dict entry, key, list header and over-allocation
+PY_EDGE_BYTES = 36 # per neighbor in an adjacency dict: an int object and a list slot
+PY_NODE_BYTES = 36 # per node of a walk that the csv writer turns into a Python list, see `src.walk_matrix.unpad`
+PY_TOKEN_BYTES = 8 # per layer token, a cached small int
+BASE_BYTES = 300 * 2**20 # interpreter, numpy, numba and the compiled kernels
+WORKER_BASE_BYTES = 250 * 2**20 # the same for each spawned worker process
+HEADROOM = 0.1 # share of the budget that is kept free for what the estimates miss
+MIN_CHUNK_SIZE = 1000 # smaller chunks make the per-chunk overhead dominate
+
+
+def parse_size(text: str):
+    "Number of bytes in a size like 160G, 512M or 1.5T (powers of 1024); a plain number is bytes"
+    text = str(text).strip().upper().removesuffix("B")
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(float(text))
+
+
+def format_size(n_bytes: float):
+    "Size in the largest unit of `UNITS` that keeps it above 1, e.g. 1.5G"
+    for unit in ("T", "G", "M", "K"):
+        if n_bytes >= UNITS[unit]:
+            return f"{n_bytes / UNITS[unit]:.1f}{unit}"
+    return f"{int(n_bytes)}B"
+
+
+@dataclass
+class GraphStats:
+    """Sizes of a layered graph, enough to estimate the memory of every phase.
+
+    Attributes:
+        n_nodes: number of nodes, including nodes that only appear as neighbors
+        n_users: number of start nodes
+        layer_names: names of the layers
+        layer_keys: number of nodes with an adjacency list on each layer
+        layer_edges: number of directed edges on each layer
+        max_node_id: largest node identifier, for the width of the csv output
+        weighted: if true, the graph has alias tables
+    """
+    n_nodes: int
+    n_users: int
+    layer_names: list
+    layer_keys: list
+    layer_edges: list
+    max_node_id: int = 0
+    weighted: bool = False
+
+    @property
+    def n_edges(self):
+        return sum(self.layer_edges)
+
+
+def stats_from_graph(users: np.ndarray, graph, layer_names: list):
+    "`GraphStats` of a loaded `LayeredCSRGraph`"
+    degrees = np.diff(graph.indptr, axis=1)
+    return GraphStats(
+        n_nodes=len(graph.node_ids),
+        n_users=len(users),
+        layer_names=list(layer_names),
+        layer_keys=[int(np.count_nonzero(d)) for d in degrees],
+        layer_edges=[int(graph.indptr[l, -1] - graph.indptr[l, 0]) for l in range(graph.indptr.shape[0])],
+        max_node_id=int(graph.node_ids[-1]) if len(graph.node_ids) else 0,
+        weighted=len(graph.alias_prob) > 0
+    )
+
+
+def stats_from_cache(path, layer_names: list):
+    "`GraphStats` of a graph cache (see `src.cache`), read from memory-mapped arrays"
+    path = Path(path)
+    indptr = np.load(path / "indptr.npy", mmap_mode="r")
+    node_ids = np.load(path / "node_ids.npy", mmap_mode="r")
+    return GraphStats(
+        n_nodes=len(node_ids),
+        n_users=len(np.load(path / "users.npy", mmap_mode="r")),
+        layer_names=list(layer_names),
+        layer_keys=[int(np.count_nonzero(np.diff(indptr[l]))) for l in range(indptr.shape[0])],
+        layer_edges=[int(indptr[l, -1] - indptr[l, 0]) for l in range(indptr.shape[0])],
+        max_node_id=int(node_ids[-1]) if len(node_ids) else 0,
+        weighted=len(np.load(path / "alias_prob.npy", mmap_mode="r")) > 0
+    )
+
+
+def stats_from_pickles(data_dir, year, connected_node_file = None, layer_types: list = ["neighbor", "colleague"], weighted: bool = False):
+    """`GraphStats` of the pickled layers read by `src.utils.load_data`.
+
+    The layers are unpickled one at a time, so this needs the memory of the largest layer only.
+    """
+    layer_types = layers_to_read(layer_types, connected_node_file)
+    users = None
+    if connected_node_file:
+        with Path(data_dir + connected_node_file + "_" + str(year) + ".pkl").open("rb") as pkl_file:
+            connected = pickle.load(pkl_file)
+            users = np.fromiter(connected, dtype=np.int64, count=len(connected))
+    else:
+        warnings.warn("connected_node_file not provided; using edges from family network. Do this only with fake data.")
+
+    node_ids = np.unique(users) if users is not None else np.empty(0, dtype=np.int64)
+    layer_keys, layer_edges = [], []
+    for ltype in layer_types:
+        with Path(data_dir + ltype + "_" + str(year) + "_adjacency_dict.pkl").open("rb") as pkl_file:
+            layer = pickle.load(pkl_file)
+        keys = np.fromiter(layer.keys(), dtype=np.int64, count=len(layer))
+        degrees = np.fromiter(map(len, layer.values()), dtype=np.int64, count=len(layer))
+        neighbors = np.fromiter((v for values in layer.values() for v in values), dtype=np.int64, count=degrees.sum())
+        del layer
+        if users is None and ltype == "family":
+            users = keys
+        layer_keys.append(int(np.count_nonzero(degrees)))
+        layer_edges.append(len(neighbors))
+        node_ids = np.union1d(node_ids, np.concatenate([keys, neighbors]))
+
+    return GraphStats(
+        n_nodes=len(node_ids),
+        n_users=len(users),
+        layer_names=layer_types,
+        layer_keys=layer_keys,
+        layer_edges=layer_edges,
+        max_node_id=int(node_ids[-1]) if len(node_ids) else 0,
+        weighted=weighted
+    )
+
+
+def graph_bytes(stats: GraphStats):
+    "Size of the `LayeredCSRGraph` and the start node array"
+    n, n_layers = stats.n_nodes, len(stats.layer_edges)
+    size = 8 * n + 8 * n_layers * (n + 1) + np.dtype(index_dtype(n)).itemsize * stats.n_edges + 2 * n + 8 * stats.n_users
+    if stats.weighted:
+        size += 8 * stats.n_edges # float32 probabilities and int32 aliases
+    return size
+
+
+def dict_bytes(n_keys: int, n_edges: int):
+    "Size of an unpickled adjacency dict"
+    return PY_KEY_BYTES * n_keys + PY_EDGE_BYTES * n_edges
+
+
+def load_bytes(stats: GraphStats, method: str, load_workers: int = 1):
+    """Peak memory of loading the graph, over all processes.
+
+    Args:
+        stats: `GraphStats`
+        method: "pickles" (`src.utils.load_data_arrays` and `src.graph.convert_to_csr`),
+            "parallel" (`src.parallel_load.load_csr_parallel`) or "cache" (`src.cache.load_graph`)
+        load_workers: number of processes with "parallel"
+    """
+    graph = graph_bytes(stats)
+    if method == "cache":
+        return graph # memory-mapped, but every page is touched by the walks
+    weights = 16 * stats.n_edges if stats.weighted else 0 # float64 weights while the alias tables are built
+    if method == "parallel":
+        # each worker holds one layer and its flattened, sorted copy; the largest layers may run at the same time
+        workers = sorted(
+            (dict_bytes(k, e) + 48 * e + 40 * k for k, e in zip(stats.layer_keys, stats.layer_edges)), reverse=True
+        )
+        return sum(workers[:max(load_workers, 1)]) + graph + weights
+    if method == "pickles":
+        dicts = sum(dict_bytes(k, e) for k, e in zip(stats.layer_keys, stats.layer_edges))
+        arrays = 16 * sum(stats.layer_keys) + 8 * stats.n_edges
+        temporaries = max(16 * (stats.n_users + sum(stats.layer_keys) + stats.n_edges), 32 * max(stats.layer_edges, default=0))
+        return dicts + arrays + temporaries + graph + weights
+    raise ValueError(f"unknown load method {method}")
+
+
+def walk_buffer_bytes(walk_len: int, output_format: str = "csv"):
+    "Size of the walk matrix and lengths of one walk, see `src.walk_matrix`"
+    if output_format == "compact":
+        return 4 * (walk_len + 1) + walk_len + 8 # see `src.walk_matrix.compact_arrays`
+    return 8 * (2 * walk_len + 1) + 8
+
+
+def writer_bytes(walk_len: int, output_format: str, itemsize: int = 8):
+    "Additional memory per walk of the chunk that is being written"
+    width = 2 * walk_len + 1
+    if output_format == "csv":
+        return PY_NODE_BYTES * (walk_len + 1) + PY_TOKEN_BYTES * walk_len + 56
+    if output_format == "parquet":
+        return 2 * (itemsize + 1) * width # converted columns, null masks and the arrow table
+    return 0 # npy and compact write into memory-mapped files
+
+
+def output_bytes(stats: GraphStats, n_walks: int, walk_len: int, output_format: str, itemsize: int = 8):
+    """Size on disk of `n_walks` walks that all have `walk_len` steps, an upper bound.
+
+    Parquet is compressed; its estimate is the uncompressed size.
+    """
+    if output_format == "csv":
+        digits = len(str(stats.max_node_id)) + 1
+        return n_walks * ((walk_len + 1) * digits + 3 * walk_len)
+    if output_format == "compact":
+        return n_walks * (5 * walk_len + 8) + 8 * stats.n_nodes
+    return n_walks * ((2 * walk_len + 1) * itemsize + 4)
+
+
+@dataclass
+class MemoryPlan:
+    """Memory estimate of one configuration of a run.
+
+    Attributes:
+        backend: "threads" or "processes", see `create_walks.py --backend`
+        output_format: one of `src.writers.OUTPUT_FORMATS`
+        chunk_size: walks generated and written at a time, by each process
+        n_workers: numba threads with the threads backend, worker processes with the processes backend
+        load: peak bytes while loading the graph
+        graph: bytes of the graph while walking, including its shared-memory copy with the processes backend
+        buffers: peak bytes of the walk chunks in flight and the writers
+        peak: peak bytes of the run
+        output: bytes of the output on disk
+        budget: memory budget in bytes, or None
+        notes: reasons the plan does not fit
+    """
+    backend: str
+    output_format: str
+    chunk_size: int
+    n_workers: int
+    load: int
+    graph: int
+    buffers: int
+    peak: int
+    output: int
+    budget: int = None
+    notes: list = field(default_factory=list)
+
+    @property
+    def fits(self):
+        return self.budget is None or self.peak <= self.budget
+
+
+def plan_run(stats: GraphStats, n_walks: int, walk_len: int, backend: str = "threads", output_format: str = "csv",
+             load_method: str = "pickles", n_cores: int = 1, budget: int = None, chunk_size: int = 1_000_000,
+             max_queued: int = 2, load_workers: int = 1, itemsize: int = 8, n_processes: int = None):
+    """Estimate the memory of a run and, with a budget, pick the chunk size and number of workers.
+
+    With a budget, the chunk size is the largest up to `chunk_size` whose buffers fit in the budget minus
+    `HEADROOM`. With the processes backend, it also picks the largest number of worker processes up to
+    `n_cores` (or `n_processes`) that still gets chunks of at least `MIN_CHUNK_SIZE` walks.
+
+    Args:
+        stats: `GraphStats` of the graph
+        n_walks: number of walks the run creates
+        walk_len: the length of the random walks
+        backend: "threads" or "processes"
+        output_format: one of `src.writers.OUTPUT_FORMATS`
+        load_method, load_workers: how the graph is loaded, see `load_bytes`
+        n_cores: number of cores of the job
+        budget: memory budget in bytes, or None to only estimate
+        chunk_size: largest chunk size to use
+        max_queued: maximum number of chunks waiting to be written with the threads backend
+        itemsize: bytes per entry of the output, see `src.walk_matrix.walk_dtype`
+        n_processes: number of worker processes with the processes backend; picked from the budget if None
+
+    Returns:
+        `MemoryPlan`
+    """
+    load = load_bytes(stats, load_method, load_workers)
+    graph = graph_bytes(stats)
+    per_walk = walk_buffer_bytes(walk_len, output_format)
+    writer = writer_bytes(walk_len, output_format, itemsize)
+    chunk_size = max(min(chunk_size, n_walks), 1)
+
+    def buffers(n_procs, size):
+        # chunks in flight: the queued ones, the one being written and the one being generated
+        if backend == "processes":
+            in_flight = min(4, math.ceil(n_walks / n_procs / max(size, 1))) # workers queue 2 chunks
+            return n_procs * (WORKER_BASE_BYTES + size * (in_flight * per_walk + writer))
+        in_flight = min(max_queued + 2, math.ceil(n_walks / max(size, 1)))
+        return size * (in_flight * per_walk + writer)
+
+    if backend == "processes":
+        graph *= 2 # the parent's copy and the shared-memory copy
+        candidates = [n_processes] if n_processes else range(n_cores, 0, -1)
+    else:
+        candidates = [n_cores]
+
+    notes = []
+    n_workers = candidates[0]
+    if budget is not None:
+        available = budget * (1 - HEADROOM) - BASE_BYTES - graph
+        for n in candidates:
+            per_chunk_walk = buffers(n, 1) - buffers(n, 0)
+            size = min(chunk_size, int((available - buffers(n, 0)) // per_chunk_walk)) if per_chunk_walk else chunk_size
+            if size >= min(MIN_CHUNK_SIZE, chunk_size):
+                n_workers, chunk_size = n, size
+                break
+        else:
+            n_workers = candidates[-1]
+            chunk_size = min(MIN_CHUNK_SIZE, chunk_size)
+            notes.append("the graph leaves no room for walk buffers")
+        if BASE_BYTES + load > budget * (1 - HEADROOM):
+            notes.append(f"loading with {load_method} needs {format_size(BASE_BYTES + load)}; try --cache-dir or fewer --load-workers")
+
+    walking = BASE_BYTES + graph + buffers(n_workers, chunk_size)
+    return MemoryPlan(
+        backend=backend,
+        output_format=output_format,
+        chunk_size=chunk_size,
+        n_workers=n_workers,
+        load=BASE_BYTES + load,
+        graph=graph,
+        buffers=buffers(n_workers, chunk_size),
+        peak=max(BASE_BYTES + load, walking),
+        output=output_bytes(stats, n_walks, walk_len, output_format, itemsize),
+        budget=budget,
+        notes=notes
+    )
+
+
+def format_plan(plan: MemoryPlan, stats: GraphStats, n_walks: int, walk_len: int):
+    "Human-readable summary of a `MemoryPlan`"
+    lines = [
+        f"memory plan: {stats.n_nodes:,} nodes, {stats.n_users:,} start nodes, {stats.n_edges:,} edges on "
+        f"{len(stats.layer_edges)} layers, {n_walks:,} walks of length {walk_len}",
+        "  edges per layer: " + ", ".join(f"{name} {e:,}" for name, e in zip(stats.layer_names, stats.layer_edges)),
+        f"  load:    {format_size(plan.load)}",
+        f"  graph:   {format_size(plan.graph)}",
+        f"  buffers: {format_size(plan.buffers)} (chunks of {plan.chunk_size:,} walks, {plan.n_workers} "
+        f"{'worker processes' if plan.backend == 'processes' else 'threads'})",
+        f"  peak:    {format_size(plan.peak)}" + (f" of {format_size(plan.budget)}" if plan.budget is not None else ""),
+        f"  output:  {format_size(plan.output)} of {plan.output_format} on disk",
+        f"  request: --mem={math.ceil(plan.peak * (1 + HEADROOM) / UNITS['G'])}G"
+    ]
+    lines += [f"  does not fit: {note}" for note in plan.notes]
+    return "\n".join(lines)
+
+
+def format_plan_table(plans: list):
+    "One line per `MemoryPlan`, to compare backends and formats"
+    lines = [f"  {'backend':<10} {'format':<8} {'chunk size':>12} {'workers':>8} {'peak':>8} {'output':>8}  fits"]
+    for plan in plans:
+        lines.append(
+            f"  {plan.backend:<10} {plan.output_format:<8} {plan.chunk_size:>12,} {plan.n_workers:>8} "
+            f"{format_size(plan.peak):>8} {format_size(plan.output):>8}  {'yes' if plan.fits else 'no'}"
+        )
+    return "\n".join(lines)
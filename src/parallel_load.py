@@ -0,0 +1,164 @@
+"Load and convert the layers of a graph in parallel worker processes"
+
+import pickle
+import tempfile
+import warnings
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from src.graph import (
+    LayeredCSRGraph,
+    SUBSET_COUNTS,
+    index_dtype,
+    fill_indptr,
+    layer_mask_from_indptr,
+    alias_arrays,
+    to_dense,
+    layer_arrays,
+    layer_weight_array
+)
+from src.utils import layers_to_read
+from src.timing import PhaseTimer
+
+
+def _flatten_layer(layer_file: str, weight_file, tmp_dir: str, l: int):
+    """Unpickle one layer and store it as flat arrays of original identifiers, sorted by node and neighbor.
+
+    If `weight_file` is given, the edge weights are stored as well; if it does not exist, all weights are 1.
+
+    Returns:
+        int: the number of edges of the layer
+    """
+    with Path(layer_file).open("rb") as pkl_file:
+        layer = dict(pickle.load(pkl_file))
+    keys, degrees, neighbors = layer_arrays(layer)
+
+    weights = None
+    if weight_file is not None:
+        layer_weights = None
+        if Path(weight_file).exists():
+            with Path(weight_file).open("rb") as pkl_file:
+                layer_weights = dict(pickle.load(pkl_file))
+        weights = layer_weight_array(layer, layer_weights)
+    del layer
+
+    tmp_dir = Path(tmp_dir)
+    np.save(tmp_dir / f"keys_file_order_{l}.npy", keys)
+
+    rows = np.repeat(np.arange(len(keys)), degrees)
+    key_order = np.argsort(keys)
+    rank = np.empty_like(key_order)
+    rank[key_order] = np.arange(len(keys))
+    edge_order = np.lexsort((neighbors, rank[rows]))
+
+    np.save(tmp_dir / f"keys_{l}.npy", keys[key_order])
+    np.save(tmp_dir / f"degrees_{l}.npy", degrees[key_order])
+    np.save(tmp_dir / f"neighbors_{l}.npy", neighbors[edge_order])
+    if weights is not None:
+        np.save(tmp_dir / f"weights_{l}.npy", weights[edge_order])
+    np.save(tmp_dir / f"ids_{l}.npy", np.unique(np.concatenate([keys, neighbors])))
+    return len(neighbors)
+
+
+def _map_layer(tmp_dir: str, l: int, offset: int):
+    "Map the neighbors of one layer to dense indices and write them and the offsets into the shared arrays"
+    tmp_dir = Path(tmp_dir)
+    node_ids = np.load(tmp_dir / "node_ids.npy", mmap_mode="r")
+    keys = np.load(tmp_dir / f"keys_{l}.npy")
+    degrees = np.load(tmp_dir / f"degrees_{l}.npy")
+    neighbors = np.load(tmp_dir / f"neighbors_{l}.npy")
+
+    indptr = np.load(tmp_dir / "indptr.npy", mmap_mode="r+")
+    fill_indptr(indptr[l], np.searchsorted(node_ids, keys), degrees, offset)
+    indptr.flush()
+
+    indices = np.load(tmp_dir / "indices.npy", mmap_mode="r+")
+    indices[offset:offset + len(neighbors)] = np.searchsorted(node_ids, neighbors)
+    indices.flush()
+
+    if (tmp_dir / f"weights_{l}.npy").exists():
+        weights = np.load(tmp_dir / "weights.npy", mmap_mode="r+")
+        weights[offset:offset + len(neighbors)] = np.load(tmp_dir / f"weights_{l}.npy")
+        weights.flush()
+
+
+def load_csr_parallel(data_dir,
+                      year,
+                      connected_node_file = None,
+                      layer_types: list = ["neighbor", "colleague"],
+                      n_workers: int = None,
+                      tmp_dir: str = None,
+                      timer: PhaseTimer = None,
+                      weighted: bool = False
+                      ):
+    """Load layered network data directly into a `LayeredCSRGraph`, one worker process per layer.
+
+    Each worker unpickles and flattens one layer and hands it back through `.npy` files in a
+    temporary directory, so no adjacency data is pickled between processes. The time to
+    load is bounded by the largest layer rather than by the sum of all layers.
+
+    Args:
+        data_dir, year, connected_node_file, layer_types: see `src.utils.load_data`
+        n_workers: number of worker processes. Defaults to the number of layers.
+        tmp_dir: where to put the temporary files, e.g. local scratch. Defaults to the system temporary directory.
+        timer: if given, records the time of each phase.
+        weighted: if true, reads the edge weights (see `src.utils.load_weights`) and builds alias tables.
+
+    Returns:
+        tuple: (dense indices of the connected users, `LayeredCSRGraph`)
+    """
+    timer = timer or PhaseTimer(verbose=False)
+    layer_types = layers_to_read(layer_types, connected_node_file)
+
+    if not connected_node_file:
+        warnings.warn("connected_node_file not provided; using edges from family network. Do this only with fake data.")
+
+    layer_files = [data_dir + ltype + "_" + str(year) + "_adjacency_dict.pkl" for ltype in layer_types]
+    weight_files = [data_dir + ltype + "_" + str(year) + "_weights_dict.pkl" if weighted else None for ltype in layer_types]
+    n_layers = len(layer_types)
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp, ProcessPoolExecutor(max_workers=n_workers or n_layers) as pool:
+        tmp_path = Path(tmp)
+
+        with timer.phase("load and flatten layers"):
+            futures = [pool.submit(_flatten_layer, layer_files[l], weight_files[l], tmp, l) for l in range(n_layers)]
+            if connected_node_file:
+                with Path(data_dir + connected_node_file + "_" + str(year) + ".pkl").open("rb") as pkl_file:
+                    connected = pickle.load(pkl_file)
+                    users = np.fromiter(connected, dtype=np.int64, count=len(connected))
+            n_edges = [f.result() for f in futures]
+
+        if not connected_node_file:
+            users = np.load(tmp_path / f"keys_file_order_{layer_types.index('family')}.npy")
+
+        with timer.phase("map to dense indices"):
+            node_ids = np.unique(np.concatenate([users] + [np.load(tmp_path / f"ids_{l}.npy") for l in range(n_layers)]))
+            np.save(tmp_path / "node_ids.npy", node_ids)
+            np.lib.format.open_memmap(tmp_path / "indptr.npy", mode="w+", dtype=np.int64, shape=(n_layers, len(node_ids) + 1))
+            np.lib.format.open_memmap(tmp_path / "indices.npy", mode="w+", dtype=index_dtype(len(node_ids)), shape=(sum(n_edges),))
+            if weighted:
+                np.lib.format.open_memmap(tmp_path / "weights.npy", mode="w+", dtype=np.float64, shape=(sum(n_edges),))
+
+            offsets = np.concatenate([[0], np.cumsum(n_edges)[:-1]]).tolist()
+            futures = [pool.submit(_map_layer, tmp, l, offsets[l]) for l in range(n_layers)]
+            for f in futures:
+                f.result()
+
+            indptr = np.load(tmp_path / "indptr.npy")
+            indices = np.load(tmp_path / "indices.npy")
+
+        with timer.phase("alias tables"):
+            alias_prob, alias_index = alias_arrays(indptr, np.load(tmp_path / "weights.npy") if weighted else None)
+
+    layer_mask = layer_mask_from_indptr(indptr)
+    graph = LayeredCSRGraph(
+        node_ids=node_ids,
+        indptr=indptr,
+        indices=indices,
+        layer_mask=layer_mask,
+        layer_count=SUBSET_COUNTS[layer_mask].astype(np.uint8),
+        alias_prob=alias_prob,
+        alias_index=alias_index
+    )
+    return to_dense(graph, users), graph
@@ -0,0 +1,70 @@
+"Streaming walk generation with bounded memory"
+
+import queue
+import threading
+
+
+def _write_loop(chunks: queue.Queue, writer, errors: list):
+    "Write chunks from the queue until `None` arrives. After an error, keep draining so the producer does not block."
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            return
+        if errors:
+            continue
+        try:
+            writer.write(*chunk)
+        except Exception as e:
+            errors.append(e)
+
+
+def chunk_ranges(unit_begin: int, unit_end: int, chunk_size: int):
+    "Split units [unit_begin, unit_end) into a list of (begin, end) chunks of `chunk_size` units; the last may be shorter"
+    return [(begin, min(begin + chunk_size, unit_end)) for begin in range(unit_begin, unit_end, chunk_size)]
+
+
+def stream_walks(generate_chunk, unit_begin: int, unit_end: int, chunk_size: int, writer, max_queued: int = 2):
+    """Generate walks in chunks and write them on a background thread.
+
+    At most `max_queued` finished chunks wait for the writer; generation blocks when the
+    writer falls behind. A chunk is released as soon as it is written, so the memory used
+    for walks is bounded by about `max_queued + 2` chunks, regardless of the number of walks.
+
+    Args:
+        generate_chunk: function (begin, end) -> (walks, lengths) that creates the walks of units [begin, end)
+        unit_begin: first unit to create
+        unit_end: end of the range of units (exclusive)
+        chunk_size: number of walks per chunk
+        writer: object with a `write(walks, lengths)` method, e.g. `src.writers.CSVWalkWriter`
+        max_queued: maximum number of chunks waiting to be written
+
+    Raises:
+        the first exception raised by `writer.write`.
+    """
+    stream_chunks(generate_chunk, chunk_ranges(unit_begin, unit_end, chunk_size), writer, max_queued)
+
+
+def stream_chunks(generate_chunk, ranges: list, writer, max_queued: int = 2):
+    """`stream_walks` over an explicit list of chunks, e.g. the chunks a resumed run still has to create.
+
+    Args:
+        generate_chunk: function (begin, end) -> (walks, lengths)
+        ranges: list of (begin, end) unit ranges, generated and written in this order
+        writer: object with a `write(walks, lengths)` method
+        max_queued: maximum number of chunks waiting to be written
+    """
+    chunks = queue.Queue(maxsize=max_queued)
+    errors = []
+    thread = threading.Thread(target=_write_loop, args=(chunks, writer, errors), daemon=True)
+    thread.start()
+    try:
+        for begin, end in ranges:
+            chunks.put(generate_chunk(begin, end))
+            if errors:
+                break
+    finally:
+        chunks.put(None)
+        thread.join()
+
+    if errors:
+        raise errors[0]
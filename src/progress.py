@@ -0,0 +1,150 @@
+"""Progress telemetry of long walk runs.
+
+The unit kernels in `src.walks_numba` add to a row of a counter array after every walk.
+Each thread owns one row, padded to a cache line, so the kernels never contend on the
+counters. A `ProgressMonitor` thread sums the rows every few seconds and reports
+progress, throughput and ETA on stderr and, optionally, to a JSON-lines file.
+"""
+
+import sys
+import json
+import threading
+from time import perf_counter, time
+import numpy as np
+
+from src.timing import peak_rss_mb
+
+
+COUNT_WALKS = 0 # walks completed
+COUNT_STEPS = 1 # steps taken
+COUNT_EARLY = 2 # walks that ended before walk_len steps, at a node without edges
+COUNTER_WIDTH = 8 # one 64-byte cache line of int64 per row
+
+
+def new_counters(n_rows: int):
+    "Zeroed counter array with one row per thread"
+    return np.zeros((n_rows, COUNTER_WIDTH), dtype=np.int64)
+
+
+def read_counters(counters: np.ndarray):
+    "Totals over all rows, as a dict of walks, steps and early"
+    totals = counters.sum(axis=0)
+    return {"walks": int(totals[COUNT_WALKS]), "steps": int(totals[COUNT_STEPS]), "early": int(totals[COUNT_EARLY])}
+
+
+class MetricsLog:
+    """Append JSON records to a file, one per line. Safe to use from several threads.
+
+    Args:
+        path: file to append to. If None, records are dropped.
+    """
+    def __init__(self, path: str = None):
+        self.file = open(path, "a") if path else None
+        self.lock = threading.Lock()
+
+    def write(self, event: str, **fields):
+        if self.file is None:
+            return
+        with self.lock:
+            self.file.write(json.dumps({"event": event, "time": time(), **fields}) + "\n")
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def format_duration(seconds: float):
+    "Compact duration like 1h02m, 3m05s or 12s"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class ProgressMonitor:
+    """Poll walk counters on a background thread and report progress.
+
+    Use as a context manager around the walk generation; it reports every `interval`
+    seconds and once more at the end.
+
+    Args:
+        counters: array from `new_counters` that the kernels write to. Can be set later with `attach`.
+        total_walks: number of walks the run will create, for the percentage and ETA
+        interval: seconds between reports; 0 only reports at the end
+        metrics: optional `MetricsLog` that receives a "progress" record with each report
+        stream: where to print the reports; None disables printing
+    """
+    def __init__(self, counters: np.ndarray = None, total_walks: int = 0, interval: float = 30.0,
+                 metrics: MetricsLog = None, stream = sys.stderr):
+        self.counters = counters
+        self.total_walks = total_walks
+        self.interval = interval
+        self.metrics = metrics
+        self.stream = stream
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_time = None
+        self._last = None
+
+    def attach(self, counters: np.ndarray):
+        "Poll `counters` from now on, e.g. counters in shared memory that worker processes write to"
+        self.counters = counters
+
+    def report(self):
+        "Print and log the current progress. Returns the record."
+        now = perf_counter()
+        totals = read_counters(self.counters) if self.counters is not None else {"walks": 0, "steps": 0, "early": 0}
+        elapsed = now - self._start_time
+        last_time, last_steps = self._last
+        self._last = (now, totals["steps"])
+
+        record = {
+            **totals,
+            "total_walks": self.total_walks,
+            "elapsed": elapsed,
+            "walks_per_second": totals["walks"] / elapsed if elapsed > 0 else 0.0,
+            "steps_per_second": (totals["steps"] - last_steps) / (now - last_time) if now > last_time else 0.0,
+            "early_rate": totals["early"] / totals["walks"] if totals["walks"] else 0.0,
+            "peak_rss_mb": peak_rss_mb()
+        }
+        remaining = self.total_walks - totals["walks"]
+        record["eta"] = remaining / record["walks_per_second"] if record["walks_per_second"] > 0 else None
+
+        if self.metrics is not None:
+            self.metrics.write("progress", **record)
+        if self.stream is not None:
+            percent = 100 * totals["walks"] / self.total_walks if self.total_walks else 0.0
+            eta = format_duration(record["eta"]) if record["eta"] is not None else "?"
+            print(
+                f"[{format_duration(elapsed)}] walks {totals['walks']:,}/{self.total_walks:,} ({percent:.1f}%)"
+                f" | {record['steps_per_second']:.3g} steps/s | early {100 * record['early_rate']:.1f}%"
+                f" | eta {eta} | peak rss {record['peak_rss_mb']:.0f}MB",
+                file=self.stream, flush=True
+            )
+        return record
+
+    def _run(self):
+        while not self._stop.wait(self.interval or None):
+            self.report()
+
+    def start(self):
+        self._start_time = perf_counter()
+        self._last = (self._start_time, 0)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.report()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,69 @@
+"Counter-based random number streams for numba kernels"
+
+import numba
+import numpy as np
+
+
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+@numba.njit(nogil=True)
+def splitmix64(x):
+    "Finalizer of the SplitMix64 generator: a bijective hash of a 64-bit integer"
+    z = np.uint64(x)
+    z = (z ^ (z >> np.uint64(30))) * MIX_1
+    z = (z ^ (z >> np.uint64(27))) * MIX_2
+    return z ^ (z >> np.uint64(31))
+
+
+@numba.njit(nogil=True)
+def seed_stream(seed, stream):
+    """Create the state of an independent random stream.
+
+    Args:
+        seed: global seed
+        stream: index of the stream, e.g. the worker index
+
+    Returns:
+        np.ndarray: a single-element uint64 state, advanced in place by `next_u64`
+    """
+    state = np.empty(1, dtype=np.uint64)
+    state[0] = splitmix64(splitmix64(np.uint64(seed)) ^ splitmix64(np.uint64(stream) + GOLDEN_GAMMA))
+    return state
+
+
+@numba.njit(nogil=True)
+def reseed_walk(state, seed, node, repeat):
+    """Reset `state` to the stream of one walk, identified by its start node and repeat.
+
+    The stream only depends on (seed, node, repeat), so a walk is the same no matter
+    which shard or thread generates it.
+    """
+    state[0] = splitmix64(splitmix64(splitmix64(np.uint64(seed)) ^ np.uint64(node)) ^ np.uint64(repeat))
+
+
+@numba.njit(nogil=True)
+def next_u64(state):
+    "Advance the stream and return a uniform 64-bit integer"
+    state[0] += GOLDEN_GAMMA
+    return splitmix64(state[0])
+
+
+@numba.njit(nogil=True)
+def next_float(state):
+    "Uniform float in [0, 1)"
+    return np.float64(next_u64(state) >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+@numba.njit(nogil=True)
+def next_below(state, n):
+    "Uniform integer in [0, n)"
+    return np.int64((next_u64(state) >> np.uint64(11)) % np.uint64(n))
+
+
+@numba.njit(nogil=True)
+def random_seed():
+    "Draw a seed from numba's global generator, so that `np.random.seed` applies"
+    return np.random.randint(0, 2**62)
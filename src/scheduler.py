@@ -0,0 +1,95 @@
+"Dynamic scheduling of walk generation over threads"
+
+import threading
+from dataclasses import dataclass
+from time import perf_counter
+
+
+_worker = threading.local()
+
+
+def worker_index():
+    "Index of the `run_dynamic` worker that runs the calling thread, 0 outside of workers"
+    return getattr(_worker, "index", 0)
+
+
+@dataclass
+class WorkerStats:
+    busy_time: float = 0.0
+    n_chunks: int = 0
+    n_units: int = 0
+
+
+def run_dynamic(work, unit_begin: int, unit_end: int, chunk_size: int, n_workers: int):
+    """Process a range of units with threads that claim small chunks from a shared counter.
+
+    Workers that finish early keep claiming chunks, so uneven chunks (e.g. walks that end
+    early on dead ends) do not leave threads idle at the end. `work` must release the GIL,
+    e.g. a `nogil` numba kernel, for the threads to run in parallel.
+
+    Args:
+        work: function (begin, end) that processes units [begin, end). It can call `worker_index`.
+        unit_begin: first unit
+        unit_end: end of the range of units (exclusive)
+        chunk_size: number of units claimed at a time
+        n_workers: number of threads
+
+    Returns:
+        list: `WorkerStats` of each worker
+
+    Raises:
+        the first exception raised by `work`.
+    """
+    lock = threading.Lock()
+    next_begin = [unit_begin]
+    stats = [WorkerStats() for _ in range(n_workers)]
+    errors = []
+
+    def claim():
+        with lock:
+            begin = next_begin[0]
+            if begin >= unit_end or errors:
+                return None
+            end = min(begin + chunk_size, unit_end)
+            next_begin[0] = end
+            return begin, end
+
+    def worker(index: int, worker_stats: WorkerStats):
+        _worker.index = index
+        while (chunk := claim()) is not None:
+            t = perf_counter()
+            try:
+                work(*chunk)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                return
+            worker_stats.busy_time += perf_counter() - t
+            worker_stats.n_chunks += 1
+            worker_stats.n_units += chunk[1] - chunk[0]
+
+    threads = [threading.Thread(target=worker, args=(i, s)) for i, s in enumerate(stats)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return stats
+
+
+def summarize_stats(stats: list):
+    """Summary of the `WorkerStats` of a run.
+
+    Returns:
+        dict: "busy_time", the busy time of each worker in seconds; "units", the number of units each worker
+            created; "imbalance", the busy time of the slowest worker divided by the mean (1 is perfectly balanced)
+    """
+    busy = [s.busy_time for s in stats]
+    mean_busy = sum(busy) / len(busy)
+    return {
+        "busy_time": busy,
+        "units": [s.n_units for s in stats],
+        "imbalance": max(busy) / mean_busy if mean_busy > 0 else 1.0
+    }
@@ -0,0 +1,177 @@
+"Split walk generation into shards and stitch the shards back together"
+
+import json
+import shutil
+from pathlib import Path
+import numpy as np
+
+from src.writers import read_npy_walks, read_compact_walks, remove_output
+
+
+def shard_range(n_units: int, shard_index: int, num_shards: int):
+    """Range of units of the start node x repeat space that belongs to one shard.
+
+    Returns:
+        tuple: (first unit, end of the range (exclusive))
+    """
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"shard index {shard_index} is not in [0, {num_shards})")
+    return shard_index * n_units // num_shards, (shard_index + 1) * n_units // num_shards
+
+
+def shard_filename(filename: str, shard_index: int, num_shards: int):
+    "Name of the output of one shard, without file extension"
+    return f"{filename}_shard{shard_index:05d}of{num_shards:05d}"
+
+
+def write_shard_manifest(filename: str, shard_index: int, num_shards: int, unit_begin: int, unit_end: int, **params):
+    """Record that a shard was written completely.
+
+    Args:
+        filename: output of the shard, without file extension
+        shard_index, num_shards: which shard this is
+        unit_begin, unit_end: range of units in the shard
+        params: parameters of the run, e.g. seed, walk_len and n_walks. Must be the same for all shards.
+    """
+    manifest = {
+        "shard_index": shard_index,
+        "num_shards": num_shards,
+        "unit_begin": unit_begin,
+        "unit_end": unit_end,
+        "params": params
+    }
+    with Path(filename + ".json").open("w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_shard_manifests(filename: str, num_shards: int, unit_range: tuple = None):
+    """Read and check the manifests of all shards of `filename`.
+
+    Args:
+        filename: output file without extension
+        num_shards: number of shards
+        unit_range: optional (unit_begin, unit_end) the shards must cover, e.g. the range of a shard that
+            was itself split into partitions. By default the shards may start anywhere but must be contiguous.
+
+    Raises:
+        FileNotFoundError if a shard is missing.
+        ValueError if the shards do not cover the unit range exactly or were created with different parameters.
+    """
+    manifests = []
+    for shard_index in range(num_shards):
+        path = Path(shard_filename(filename, shard_index, num_shards) + ".json")
+        if not path.exists():
+            raise FileNotFoundError(f"shard {shard_index} of {num_shards} is missing: {path}")
+        with path.open() as f:
+            manifests.append(json.load(f))
+
+    expected_begin = manifests[0]["unit_begin"] if unit_range is None else unit_range[0]
+    for manifest in manifests:
+        if manifest["unit_begin"] != expected_begin:
+            raise ValueError(f"shard {manifest['shard_index']} starts at unit {manifest['unit_begin']}, expected {expected_begin}")
+        if manifest["params"] != manifests[0]["params"]:
+            raise ValueError(f"shard {manifest['shard_index']} was created with different parameters than shard 0")
+        expected_begin = manifest["unit_end"]
+    if unit_range is not None and expected_begin != unit_range[1]:
+        raise ValueError(f"the shards end at unit {expected_begin}, expected {unit_range[1]}")
+
+    return manifests
+
+
+def _merge_csv(filename: str, shard_names: list):
+    with Path(filename + ".csv").open("wb") as out_file:
+        for i, shard_name in enumerate(shard_names):
+            with Path(shard_name + ".csv").open("rb") as shard_file:
+                header = shard_file.readline()
+                if i == 0:
+                    out_file.write(header)
+                shutil.copyfileobj(shard_file, out_file)
+
+
+def _merge_npy(filename: str, shard_names: list):
+    shards = [read_npy_walks(shard_name) for shard_name in shard_names]
+    n_walks = sum(len(lengths) for _, lengths in shards)
+    walks_out = np.lib.format.open_memmap(
+        filename + ".npy", mode="w+", dtype=shards[0][0].dtype, shape=(n_walks, shards[0][0].shape[1])
+    )
+    lengths_out = np.lib.format.open_memmap(filename + "_lengths.npy", mode="w+", dtype=np.int32, shape=(n_walks,))
+    row = 0
+    for walks, lengths in shards:
+        walks_out[row:row + len(walks)] = walks
+        lengths_out[row:row + len(walks)] = lengths
+        row += len(walks)
+    walks_out.flush()
+    lengths_out.flush()
+
+
+def _merge_compact(filename: str, shard_names: list):
+    shards = [read_compact_walks(shard_name) for shard_name in shard_names]
+    n_walks = sum(len(lengths) for _, _, lengths, _ in shards)
+    nodes_out, layers_out, lengths_out = (
+        np.lib.format.open_memmap(filename + suffix, mode="w+", dtype=array.dtype, shape=(n_walks,) + array.shape[1:])
+        for suffix, array in zip(["_nodes.npy", "_layers.npy", "_n_nodes.npy"], shards[0][:3])
+    )
+    row = 0
+    for nodes, layers, lengths, _ in shards:
+        nodes_out[row:row + len(nodes)] = nodes
+        layers_out[row:row + len(nodes)] = layers
+        lengths_out[row:row + len(nodes)] = lengths
+        row += len(nodes)
+    for array in (nodes_out, layers_out, lengths_out):
+        array.flush()
+    np.save(filename + "_node_ids.npy", shards[0][3])
+
+
+def _merge_parquet(filename: str, shard_names: list):
+    import pyarrow.parquet as pq
+
+    writer = None
+    for shard_name in shard_names:
+        shard = pq.ParquetFile(shard_name + ".parquet")
+        if writer is None:
+            writer = pq.ParquetWriter(filename + ".parquet", shard.schema_arrow, compression="zstd")
+        for i in range(shard.num_row_groups):
+            writer.write_table(shard.read_row_group(i))
+    writer.close()
+
+
+def merge_outputs(filename: str, names: list, output_format: str = "csv"):
+    "Concatenate the outputs `names` (without extension), in this order, into `filename`"
+    merge = {"csv": _merge_csv, "npy": _merge_npy, "parquet": _merge_parquet, "compact": _merge_compact}[output_format]
+    merge(filename, names)
+
+
+def merge_shards(filename: str, num_shards: int, output_format: str = "csv", unit_range: tuple = None,
+                 write_manifest: bool = True):
+    """Concatenate the outputs of all shards of `filename` into a single file in the same format.
+
+    Args:
+        filename: output file without extension
+        num_shards: number of shards
+        output_format: one of `src.writers.OUTPUT_FORMATS`
+        unit_range: optional (unit_begin, unit_end) the shards must cover, see `read_shard_manifests`
+        write_manifest: if true, also writes `filename`.manifest.json listing the shards that were merged
+    """
+    manifests = read_shard_manifests(filename, num_shards, unit_range)
+    shard_names = [shard_filename(filename, i, num_shards) for i in range(num_shards)]
+
+    merge_outputs(filename, shard_names, output_format)
+    if not write_manifest:
+        return
+
+    manifest = {
+        "num_shards": num_shards,
+        "n_units": manifests[-1]["unit_end"],
+        "params": manifests[0]["params"],
+        "shards": manifests
+    }
+    with Path(filename + ".manifest.json").open("w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def remove_shards(filename: str, num_shards: int, output_format: str = "csv"):
+    "Delete the outputs and manifests of all shards of `filename`, e.g. after `merge_shards`"
+    for shard_index in range(num_shards):
+        shard_name = shard_filename(filename, shard_index, num_shards)
+        remove_output(shard_name, output_format)
+        Path(shard_name + ".json").unlink(missing_ok=True)
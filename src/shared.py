@@ -0,0 +1,200 @@
+"Process-pool backend: share the graph once and generate walks in worker processes"
+
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+from src.graph import LayeredCSRGraph
+from src.walk_matrix import walk_width, compact_arrays
+from src.transitions import NO_TRANSITIONS
+from src.progress import ProgressMonitor, new_counters
+from src.writers import make_writer
+from src.pipeline import stream_walks
+from src.shards import shard_filename, write_shard_manifest
+from src.checkpoint import Checkpoint
+
+
+def share_arrays(arrays: dict):
+    """Copy arrays into `multiprocessing.shared_memory` blocks.
+
+    Returns:
+        tuple: (
+            spec that `attach_arrays` turns back into the arrays in another process,
+            list of `SharedMemory` blocks; the caller must `close()` and `unlink()` them when done
+            )
+    """
+    spec = {}
+    blocks = []
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        spec[name] = (block.name, array.shape, array.dtype.str)
+        blocks.append(block)
+    return spec, blocks
+
+
+def attach_arrays(spec: dict):
+    """Attach to arrays shared with `share_arrays` without copying them.
+
+    Returns:
+        tuple: (dict of arrays, list of `SharedMemory` blocks that must stay referenced while the arrays are used)
+    """
+    arrays = {}
+    blocks = []
+    for name, (block_name, shape, dtype) in spec.items():
+        if sys.version_info >= (3, 13):
+            block = shared_memory.SharedMemory(name=block_name, track=False)
+        else:
+            block = shared_memory.SharedMemory(name=block_name)
+            resource_tracker.unregister(block._name, "shared_memory") # the creating process unlinks it
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        blocks.append(block)
+    return arrays, blocks
+
+
+def share_graph(users: np.ndarray, graph: LayeredCSRGraph):
+    "Share the start nodes and a graph with worker processes, see `share_arrays`"
+    return share_arrays({"users": users, **graph._asdict()})
+
+
+def attach_graph(spec: dict):
+    """Attach to a graph shared with `share_graph`.
+
+    Returns:
+        tuple: (start nodes, `LayeredCSRGraph`, shared memory blocks to keep referenced)
+    """
+    arrays, blocks = attach_arrays(spec)
+    users = arrays.pop("users")
+    return users, LayeredCSRGraph(**arrays), blocks
+
+
+_worker_graph = None
+_worker_counters = None
+
+
+def _init_worker(spec: dict, counter_spec: dict, n_threads: int):
+    global _worker_graph, _worker_counters
+    import numba
+    numba.set_num_threads(n_threads)
+    _worker_graph = attach_graph(spec)
+    _worker_counters = attach_arrays(counter_spec)
+
+
+def _write_partition(filename: str, part: int, n_parts: int, unit_begin: int, unit_end: int,
+                     walk_len: int, p: float, transitions: np.ndarray, return_param: float, inout_param: float,
+                     seed: int, chunk_size: int, output_format: str, dtype: str, checkpoint_params: dict, resume: bool):
+    from src.walks_numba import create_walks_units, create_compact_units
+
+    users, graph, _ = _worker_graph
+    counters = _worker_counters[0]["counters"]
+    n_rows = len(counters) // n_parts
+    counters = counters[part * n_rows:(part + 1) * n_rows]
+
+    def generate_chunk(begin, end):
+        if output_format == "compact":
+            walk_nodes, walk_layers, lengths = compact_arrays(end - begin, walk_len)
+            create_compact_units(
+                users, begin, end, walk_len, graph, p, transitions, return_param, inout_param,
+                walk_nodes, walk_layers, lengths, seed, counters
+            )
+            return walk_nodes, walk_layers, lengths
+        walks = np.empty((end - begin, walk_width(walk_len)), dtype=np.int64)
+        lengths = np.empty(end - begin, dtype=np.int64)
+        create_walks_units(
+            users, begin, end, walk_len, graph, p, transitions, return_param, inout_param, walks, lengths, seed, counters
+        )
+        return walks, lengths
+
+    part_filename = shard_filename(filename, part, n_parts)
+    if checkpoint_params is not None:
+        checkpoint = Checkpoint(part_filename, unit_begin, unit_end, chunk_size, output_format, checkpoint_params, resume)
+        checkpoint.run(generate_chunk, walk_len, np.dtype(dtype), node_ids=graph.node_ids)
+    else:
+        writer = make_writer(output_format, part_filename, walk_len, unit_end - unit_begin, np.dtype(dtype), graph.node_ids)
+        try:
+            stream_walks(generate_chunk, unit_begin, unit_end, chunk_size, writer)
+        except BaseException:
+            writer.close(check=False)
+            raise
+        writer.close()
+    write_shard_manifest(part_filename, part, n_parts, unit_begin, unit_end, seed=seed, walk_len=walk_len, p=p)
+
+
+def create_walks_processes(users: np.ndarray, graph: LayeredCSRGraph, filename: str, unit_begin: int, unit_end: int,
+                           walk_len: int, p: float, seed: int, n_processes: int, threads_per_process: int = 1,
+                           chunk_size: int = 1_000_000, output_format: str = "csv", dtype=np.int64,
+                           transitions: np.ndarray = NO_TRANSITIONS, return_param: float = 1.0, inout_param: float = 1.0,
+                           monitor: ProgressMonitor = None, checkpoint_params: dict = None, resume: bool = False):
+    """Create walks in worker processes that share the graph and each write their own output partition.
+
+    The graph is copied once into shared memory; every worker attaches to it without copying.
+    Units [unit_begin, unit_end) are split into `n_processes` partitions written to
+    `src.shards.shard_filename(filename, part, n_processes)`, with a manifest each, so they can be
+    combined with `src.shards.merge_shards`. Walks are seeded per unit, so the result is the
+    same as with the thread backend.
+
+    Args:
+        users: dense indices of the start nodes
+        graph: `LayeredCSRGraph`
+        filename: output file without extension
+        unit_begin, unit_end: range of units to create
+        walk_len: the length of the random walks
+        p: probability of resampling the layer.
+        seed: global seed
+        n_processes: number of worker processes and output partitions
+        threads_per_process: numba threads in each worker
+        chunk_size: number of walks generated and written at a time by each worker
+        output_format: one of `src.writers.OUTPUT_FORMATS`
+        dtype: integer type of the output, see `src.walk_matrix.walk_dtype`
+        transitions: optional layer transition table, see `src.transitions.transition_table`
+        return_param, inout_param: node2vec parameters, see `src.walks_numba.walk_into`
+        monitor: optional `src.progress.ProgressMonitor`. It is attached to progress counters in shared memory
+            and runs while the workers create walks.
+        checkpoint_params: if given, each partition is written in chunks with a `src.checkpoint.Checkpoint`
+            with these parameters.
+        resume: continue from the checkpoints of an earlier run with the same `n_processes`
+    """
+    n_units = unit_end - unit_begin
+    parts = [
+        (unit_begin + part * n_units // n_processes, unit_begin + (part + 1) * n_units // n_processes)
+        for part in range(n_processes)
+    ]
+    monitor = monitor or ProgressMonitor(stream=None)
+    if checkpoint_params is not None:
+        monitor.total_walks = sum(
+            Checkpoint(
+                shard_filename(filename, part, n_processes), begin, end, chunk_size, output_format, checkpoint_params, resume
+            ).n_pending_units()
+            for part, (begin, end) in enumerate(parts)
+        )
+
+    spec, blocks = share_graph(np.asarray(users, dtype=np.int64), graph)
+    counter_spec, counter_blocks = share_arrays({"counters": new_counters(n_processes * threads_per_process)})
+    _, shape, dtype_str = counter_spec["counters"]
+    counters = np.ndarray(shape, dtype=np.dtype(dtype_str), buffer=counter_blocks[0].buf)
+    monitor.attach(counters)
+    try:
+        # numba's threading layer is not fork-safe once it has been started in this process
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=n_processes, mp_context=context, initializer=_init_worker,
+            initargs=(spec, counter_spec, threads_per_process)
+        ) as pool, monitor:
+            futures = [
+                pool.submit(
+                    _write_partition, filename, part, n_processes, begin, end, walk_len, p, transitions,
+                    return_param, inout_param, seed, chunk_size, output_format, np.dtype(dtype).str, checkpoint_params, resume
+                )
+                for part, (begin, end) in enumerate(parts)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        monitor.attach(counters.copy()) # the shared block is released below
+        del counters
+        for block in blocks + counter_blocks:
+            block.close()
+            block.unlink()
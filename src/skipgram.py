@@ -0,0 +1,188 @@
+"""Skip-gram training pairs with negative samples, created together with the walks.
+
+A walk is turned into (center, context) pairs of the entries at most `window` positions
+apart, and every pair gets `n_negatives` nodes drawn from the unigram distribution
+degree^0.75. Layer tokens (`-layer_index - 1`, see `src.walks_numba.walk_into`) are either
+dropped before windowing or kept as entries of the sequence. The walk is never materialized
+outside the kernel; its random stream continues into the negative samples, so the pairs of a
+unit are the same no matter how the units are split over shards or threads.
+"""
+
+import numba
+import numpy as np
+
+from src.graph import LayeredCSRGraph
+from src.rng import reseed_walk, next_float, next_below
+from src.walk_matrix import walk_width
+from src.walks_numba import walk_into, build_alias_tables
+from src.progress import COUNT_WALKS, COUNT_STEPS, COUNT_EARLY
+
+
+def unigram_table(graph: LayeredCSRGraph, power: float = 0.75):
+    """Alias table of the negative sampling distribution: node degree over all layers to the power `power`.
+
+    Returns:
+        tuple: (float32 probabilities, int32 aliases), one entry per dense node index
+    """
+    degrees = (graph.indptr[:, 1:] - graph.indptr[:, :-1]).sum(axis=0)
+    weights = degrees.astype(np.float64) ** power
+    return build_alias_tables(np.array([[0, len(weights)]], dtype=np.int64), weights)
+
+
+def max_pairs(walk_len: int, window: int, keep_layers: bool = False):
+    "Maximum number of pairs of one walk"
+    seq_len = walk_width(walk_len) if keep_layers else walk_len + 1
+    w = min(window, seq_len - 1)
+    return 2 * (w * seq_len - w * (w + 1) // 2) # each distance d <= w occurs seq_len - d times in both directions
+
+
+def pair_arrays(n_walks: int, walk_len: int, window: int, n_negatives: int, keep_layers: bool = False):
+    """Allocate the output of `create_pairs_units` for `n_walks` walks.
+
+    Returns:
+        tuple: (centers, contexts, negatives, n_pairs); see `create_pairs_units`
+    """
+    width = max_pairs(walk_len, window, keep_layers)
+    return (
+        np.empty((n_walks, width), dtype=np.int64),
+        np.empty((n_walks, width), dtype=np.int64),
+        np.empty((n_walks, width, n_negatives), dtype=np.int64),
+        np.empty(n_walks, dtype=np.int64)
+    )
+
+
+def compact_pairs(centers: np.ndarray, contexts: np.ndarray, negatives: np.ndarray, n_pairs: np.ndarray):
+    """Drop the unused entries of the output of `create_pairs_units`.
+
+    Returns:
+        tuple: (centers, contexts, negatives) of all pairs, in unit order
+    """
+    if (n_pairs == centers.shape[1]).all(): # no walk ended early
+        return centers.reshape(-1), contexts.reshape(-1), negatives.reshape(-1, negatives.shape[2])
+    used = np.arange(centers.shape[1]) < n_pairs[:, None]
+    return centers[used], contexts[used], negatives[used]
+
+
+@numba.njit(nogil=True)
+def walk_pairs_into(walk: numba.int64[:], length: int, window: int, keep_layers: bool, centers: numba.int64[:], contexts: numba.int64[:]):
+    """Write the (center, context) pairs of one walk.
+
+    Args:
+        walk: walk as written by `src.walks_numba.walk_into`
+        length: number of entries of the walk
+        window: maximum distance of a context from its center, in nodes (or in entries if `keep_layers`)
+        keep_layers: if true, layer tokens are centers and contexts like nodes. Otherwise they are skipped.
+        centers, contexts: buffers of at least `max_pairs` entries
+
+    Returns:
+        int: the number of pairs written
+    """
+    stride = 1 if keep_layers else 2
+    seq_len = (length + stride - 1) // stride
+    n = 0
+    for i in range(seq_len):
+        for j in range(max(i - window, 0), min(i + window + 1, seq_len)):
+            if j != i:
+                centers[n] = walk[i * stride]
+                contexts[n] = walk[j * stride]
+                n += 1
+    return n
+
+
+@numba.njit(nogil=True)
+def pairs_units_into(
+    nodes: numba.int64[:],
+    unit_begin: int,
+    unit_end: int,
+    walk_len: int,
+    graph,
+    p: float,
+    transitions: numba.float64[:, :, :],
+    return_param: float,
+    inout_param: float,
+    seed: int,
+    window: int,
+    keep_layers: bool,
+    unigram_prob: numba.float32[:],
+    unigram_alias: numba.int32[:],
+    centers: numba.int64[:, :],
+    contexts: numba.int64[:, :],
+    negatives: numba.int64[:, :, :],
+    n_pairs: numba.int64[:],
+    counters: numba.int64[:]
+    ):
+    "Sequential version of `create_pairs_units`, for schedulers that call it from their own threads"
+    n_nodes = nodes.shape[0]
+    n_negatives = negatives.shape[2]
+    n_table = unigram_prob.shape[0]
+    node_ids = graph.node_ids
+    walk = np.empty(2 * walk_len + 1, dtype=np.int64)
+    state = np.empty(1, dtype=np.uint64)
+    for row in range(unit_end - unit_begin):
+        unit = unit_begin + row
+        node_position = unit % n_nodes
+        reseed_walk(state, seed, node_position, unit // n_nodes)
+        n = walk_into(nodes[node_position], walk_len, graph, p, transitions, return_param, inout_param, walk, state)
+        counters[COUNT_WALKS] += 1
+        counters[COUNT_STEPS] += (n - 1) // 2
+        if n < walk.shape[0]:
+            counters[COUNT_EARLY] += 1
+
+        k = walk_pairs_into(walk, n, window, keep_layers, centers[row], contexts[row])
+        for i in range(k):
+            for j in range(n_negatives): # draw from the unigram alias table
+                m = next_below(state, n_table)
+                if next_float(state) >= unigram_prob[m]:
+                    m = unigram_alias[m]
+                negatives[row, i, j] = node_ids[m]
+        n_pairs[row] = k
+
+
+@numba.njit(nogil=True, parallel=True)
+def create_pairs_units(
+    nodes: numba.int64[:],
+    unit_begin: int,
+    unit_end: int,
+    walk_len: int,
+    graph,
+    p: float,
+    transitions: numba.float64[:, :, :],
+    return_param: float,
+    inout_param: float,
+    seed: int,
+    window: int,
+    keep_layers: bool,
+    unigram_prob: numba.float32[:],
+    unigram_alias: numba.int32[:],
+    centers: numba.int64[:, :],
+    contexts: numba.int64[:, :],
+    negatives: numba.int64[:, :, :],
+    n_pairs: numba.int64[:],
+    counters: numba.int64[:, :]
+    ):
+    """Create the skip-gram pairs and negative samples of the walks of a range of units on all numba threads.
+
+    The walks are the same as those of `src.walks_numba.create_walks_units` with the same arguments.
+
+    Args:
+        nodes, unit_begin, unit_end, walk_len, graph, p, transitions, return_param, inout_param, seed: see
+            `src.walks_numba.create_walks_units`
+        window: maximum distance of a context from its center, see `walk_pairs_into`
+        keep_layers: if true, layer tokens are part of the windows. Otherwise only nodes are.
+        unigram_prob, unigram_alias: negative sampling table from `unigram_table`
+        centers, contexts: arrays of shape (unit_end - unit_begin, `max_pairs`) receiving the pairs of each walk
+        negatives: array of shape (unit_end - unit_begin, `max_pairs`, number of negatives per pair)
+        n_pairs: array of shape (unit_end - unit_begin,) receiving the number of pairs of each walk
+        counters: progress counters, see `src.walks_numba.create_walks_units`
+    """
+    n_units = unit_end - unit_begin
+    n_streams = numba.get_num_threads()
+    for stream in numba.prange(n_streams):
+        begin = stream * n_units // n_streams
+        end = (stream + 1) * n_units // n_streams
+        pairs_units_into(
+            nodes, unit_begin + begin, unit_begin + end, walk_len, graph, p, transitions, return_param, inout_param,
+            seed, window, keep_layers, unigram_prob, unigram_alias,
+            centers[begin:end], contexts[begin:end], negatives[begin:end], n_pairs[begin:end],
+            counters[stream % counters.shape[0]]
+        )
@@ -0,0 +1,227 @@
+"""Walks generated on the fly for training, without writing them to disk.
+
+`WalkStream` iterates over fresh walks from a loaded graph. Background threads run the
+`nogil` kernel `src.walks_numba.walk_units_into` on chunks of units ahead of the consumer.
+`WalkDataset` wraps it as a PyTorch `IterableDataset`. Each DataLoader worker (and each
+distributed rank) generates its own shard of the units.
+"""
+
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from src.graph import LayeredCSRGraph
+from src.transitions import NO_TRANSITIONS
+from src.walk_matrix import walk_width
+from src.shards import shard_range
+from src.pipeline import chunk_ranges
+from src.progress import new_counters
+from src.rng import seed_stream
+
+try:
+    import torch
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    torch = None
+    IterableDataset = object
+
+
+def epoch_seed(seed: int, epoch: int):
+    "Seed of the walks of one epoch. Epoch 0 uses `seed` itself, so it has the walks of `create_walks.py --seed seed`."
+    if epoch == 0:
+        return seed
+    return int(seed_stream(seed, epoch)[0] >> np.uint64(1))
+
+
+class WalkStream:
+    """Iterate over walks created on the fly, one walk per (start node, repeat) unit.
+
+    Iterating yields walk matrices in chunks, see `batches`, or single walks. Call `set_epoch` before
+    each epoch to get new walks; the walks of an epoch are the same in every run.
+
+    Args:
+        users: dense indices of the start nodes
+        graph: `LayeredCSRGraph`
+        walk_len: the length of the random walks
+        n_walks: number of walks per start node in an epoch
+        p: probability of keeping the layer, see `src.walks_numba.walk_into`
+        transitions: optional layer transition table, see `src.transitions.transition_table`
+        return_param, inout_param: node2vec parameters, see `src.walks_numba.walk_into`
+        seed: global seed
+        chunk_size: number of walks a thread creates at a time
+        n_threads: number of background threads that create walks
+        prefetch: number of chunks created ahead of the consumer
+        shuffle: if true, the chunks and the walks within a chunk are yielded in a random order that depends on the epoch.
+            Otherwise walks come in unit order: all start nodes once, then all of them again, etc.
+        shard_index, num_shards: only create this shard of the units, see `src.shards.shard_range`
+    """
+    def __init__(self, users: np.ndarray, graph: LayeredCSRGraph, walk_len: int, n_walks: int = 1, p: float = 0.8,
+                 transitions: np.ndarray = NO_TRANSITIONS, return_param: float = 1.0, inout_param: float = 1.0,
+                 seed: int = 0, chunk_size: int = 4096, n_threads: int = 1, prefetch: int = 4, shuffle: bool = False,
+                 shard_index: int = 0, num_shards: int = 1):
+        self.users = np.asarray(users, dtype=np.int64)
+        self.graph = graph
+        self.walk_len = walk_len
+        self.n_walks = n_walks
+        self.p = p
+        self.transitions = transitions
+        self.return_param = return_param
+        self.inout_param = inout_param
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.n_threads = n_threads
+        self.prefetch = max(prefetch, n_threads)
+        self.shuffle = shuffle
+        self.epoch = 0
+        self.counters = new_counters(n_threads)
+        self.set_shard(shard_index, num_shards)
+
+    def set_epoch(self, epoch: int):
+        "Create the walks of `epoch` from now on"
+        self.epoch = epoch
+
+    def set_shard(self, shard_index: int, num_shards: int):
+        "Only create the units of one shard, e.g. of a DataLoader worker"
+        self.unit_begin, self.unit_end = shard_range(len(self.users) * self.n_walks, shard_index, num_shards)
+
+    def __len__(self):
+        return self.unit_end - self.unit_begin
+
+    def _prefetch(self, generate_chunk, rng):
+        """Run `generate_chunk(begin, end, seed, counters)` on the chunks of the current epoch and shard on the
+        background threads, and yield the results in order."""
+        seed = epoch_seed(self.seed, self.epoch)
+        ranges = chunk_ranges(self.unit_begin, self.unit_end, self.chunk_size)
+        if rng is not None:
+            ranges = [ranges[i] for i in rng.permutation(len(ranges))]
+
+        thread_index = itertools.count()
+        local = threading.local()
+
+        def init_thread():
+            local.counters = self.counters[next(thread_index)]
+
+        def run(begin, end):
+            return generate_chunk(begin, end, seed, local.counters)
+
+        ranges = iter(ranges)
+        with ThreadPoolExecutor(max_workers=self.n_threads, initializer=init_thread) as pool:
+            pending = deque(pool.submit(run, *r) for r in itertools.islice(ranges, self.prefetch))
+            try:
+                while pending:
+                    result = pending.popleft().result()
+                    for r in itertools.islice(ranges, 1):
+                        pending.append(pool.submit(run, *r))
+                    yield result
+            finally:
+                for future in pending: # the consumer stopped early
+                    future.cancel()
+
+    def batches(self):
+        """Create the walks of the current epoch and shard.
+
+        Yields:
+            tuple: (walk matrix padded with `src.walk_matrix.WALK_PAD`, lengths of the walks), `chunk_size` walks
+                at a time (the last chunk may be shorter)
+        """
+        from src.walks_numba import walk_units_into
+
+        def generate_chunk(begin, end, seed, counters):
+            walks = np.empty((end - begin, walk_width(self.walk_len)), dtype=np.int64)
+            lengths = np.empty(end - begin, dtype=np.int64)
+            walk_units_into(
+                self.users, begin, end, self.walk_len, self.graph, self.p, self.transitions,
+                self.return_param, self.inout_param, walks, lengths, seed, counters
+            )
+            return walks, lengths
+
+        rng = np.random.default_rng([self.seed, self.epoch]) if self.shuffle else None
+        for walks, lengths in self._prefetch(generate_chunk, rng):
+            if rng is not None:
+                order = rng.permutation(len(walks))
+                walks, lengths = walks[order], lengths[order]
+            yield walks, lengths
+
+    def pairs(self, window: int = 5, n_negatives: int = 5, keep_layers: bool = False, power: float = 0.75):
+        """Create skip-gram training pairs of the walks of the current epoch and shard, see `src.skipgram`.
+
+        The walks themselves are never returned, which saves turning them into pairs in Python.
+
+        Args:
+            window: maximum distance of a context from its center
+            n_negatives: number of negative samples per pair
+            keep_layers: if true, layer tokens are part of the windows. Otherwise they are skipped.
+            power: exponent of the degree in the negative sampling distribution
+
+        Yields:
+            tuple: (centers, contexts, negatives of shape (n_pairs, `n_negatives`)) of `chunk_size` walks at a time
+        """
+        from src.skipgram import unigram_table, pair_arrays, pairs_units_into, compact_pairs
+
+        unigram_prob, unigram_alias = unigram_table(self.graph, power)
+
+        def generate_chunk(begin, end, seed, counters):
+            centers, contexts, negatives, n_pairs = pair_arrays(end - begin, self.walk_len, window, n_negatives, keep_layers)
+            pairs_units_into(
+                self.users, begin, end, self.walk_len, self.graph, self.p, self.transitions,
+                self.return_param, self.inout_param, seed, window, keep_layers, unigram_prob, unigram_alias,
+                centers, contexts, negatives, n_pairs, counters
+            )
+            return compact_pairs(centers, contexts, negatives, n_pairs)
+
+        rng = np.random.default_rng([self.seed, self.epoch]) if self.shuffle else None
+        for centers, contexts, negatives in self._prefetch(generate_chunk, rng):
+            if rng is not None:
+                order = rng.permutation(len(centers))
+                centers, contexts, negatives = centers[order], contexts[order], negatives[order]
+            yield centers, contexts, negatives
+
+    def __iter__(self):
+        "Yield the walks of the current epoch and shard one by one, as arrays without padding"
+        for walks, lengths in self.batches():
+            for row, n in zip(walks, lengths):
+                yield row[:n]
+
+
+class WalkDataset(IterableDataset):
+    """PyTorch `IterableDataset` of walks from a `WalkStream`.
+
+    Every DataLoader worker gets a copy of the stream and creates its own shard of the units. With
+    distributed training, pass `rank` and `world_size` to shard over the ranks as well.
+    Call `set_epoch` before each epoch (in the main process, before iterating over the DataLoader)
+    to get new walks.
+
+    With `batch_size=None` the dataset yields single walks as 1-D int64 tensors of varying length.
+    Otherwise it yields (walks, lengths) tensors of `batch_size` walks padded with `src.walk_matrix.WALK_PAD`;
+    use it with `DataLoader(dataset, batch_size=None)`.
+
+    Args:
+        stream: `WalkStream`. Its `chunk_size` is set to `batch_size` if given.
+        batch_size: number of walks per item, or None for single walks
+        rank, world_size: position of this process in distributed training
+    """
+    def __init__(self, stream: WalkStream, batch_size: int = None, rank: int = 0, world_size: int = 1):
+        if torch is None:
+            raise ImportError("torch is required for WalkDataset")
+        self.stream = stream
+        self.batch_size = batch_size
+        if batch_size is not None:
+            stream.chunk_size = batch_size
+        self.rank = rank
+        self.world_size = world_size
+
+    def set_epoch(self, epoch: int):
+        self.stream.set_epoch(epoch)
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        self.stream.set_shard(self.rank * num_workers + worker_id, self.world_size * num_workers)
+        if self.batch_size is None:
+            for walk in self.stream:
+                yield torch.from_numpy(walk)
+        else:
+            for walks, lengths in self.stream.batches():
+                yield torch.from_numpy(walks), torch.from_numpy(lengths)
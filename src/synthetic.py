@@ -0,0 +1,252 @@
+"""Synthetic layered graphs that resemble the population network.
+
+Nodes are `0, ..., n_nodes - 1`, laid out in "geographic" order: consecutive nodes form
+households, consecutive households form extended families and neighborhood blocks.
+All layers are built from one vectorized primitive, `group_edges`, which links the
+members of each group to their nearest co-members in a ring, so a group of any size
+costs at most `max_degree` edges per member.
+"""
+
+import pickle
+from dataclasses import dataclass, asdict
+from pathlib import Path
+import numpy as np
+
+from src.graph import (
+    LayeredCSRGraph,
+    SUBSET_COUNTS,
+    index_dtype,
+    layer_mask_from_indptr,
+    alias_arrays
+)
+
+
+LAYER_NAMES = ["family", "colleague", "classmate", "neighbor", "household"]
+
+
+@dataclass
+class GraphSpec:
+    """Parameters of a synthetic graph.
+
+    Attributes:
+        n_nodes: number of nodes
+        household_sizes, household_probs: distribution of the household sizes
+        households_per_family: mean number of households in an extended family
+        max_family: maximum number of family ties per node
+        colleague_share: share of the nodes that have colleagues
+        colleague_min_size, colleague_alpha: workplaces have `colleague_min_size` plus a Pareto(`colleague_alpha`)
+            distributed number of workers, so a few of them are very large.
+        max_colleagues: maximum number of colleagues per node
+        classmate_share, classmate_min_size, classmate_alpha, max_classmates: the same for schools
+        households_per_block: mean number of households in a neighborhood block
+        max_neighbors: maximum number of neighbors per node
+    """
+    n_nodes: int
+    household_sizes: tuple = (1, 2, 3, 4, 5, 6)
+    household_probs: tuple = (0.38, 0.33, 0.12, 0.12, 0.04, 0.01)
+    households_per_family: float = 4.0
+    max_family: int = 10
+    colleague_share: float = 0.5
+    colleague_min_size: int = 2
+    colleague_alpha: float = 1.2
+    max_colleagues: int = 20
+    classmate_share: float = 0.2
+    classmate_min_size: int = 10
+    classmate_alpha: float = 2.0
+    max_classmates: int = 20
+    households_per_block: float = 15.0
+    max_neighbors: int = 10
+
+
+def partition(n_items: int, draw_sizes):
+    """Split `n_items` into consecutive groups.
+
+    Args:
+        n_items: number of items
+        draw_sizes: function that returns an array of `k` random positive group sizes
+
+    Returns:
+        int64 array of group sizes that sums to `n_items`; the last group may be truncated
+    """
+    sizes = []
+    remaining = n_items
+    while remaining > 0:
+        batch = np.asarray(draw_sizes(max(remaining // 4, 16)), dtype=np.int64)
+        total = np.cumsum(batch)
+        n_fit = np.searchsorted(total, remaining)
+        if n_fit < len(batch):
+            sizes.append(batch[:n_fit])
+            sizes.append([remaining - (total[n_fit - 1] if n_fit > 0 else 0)])
+            break
+        sizes.append(batch)
+        remaining -= total[-1]
+    if not sizes:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(sizes).astype(np.int64)
+
+
+def group_edges(members: np.ndarray, sizes: np.ndarray, max_degree: int):
+    """Link the members of consecutive groups.
+
+    Each group is a ring in the order of `members`; every member is linked to the
+    `max_degree // 2` members on either side, so groups of up to `max_degree + 1`
+    members are cliques.
+
+    Args:
+        members: node of each position; the first `sizes[0]` positions are the first group, etc.
+        sizes: size of each group
+        max_degree: maximum number of links per member
+
+    Returns:
+        tuple: (source nodes, target nodes) with each undirected edge in both directions
+    """
+    n = len(members)
+    size_of = np.repeat(sizes, sizes)
+    start = np.repeat(np.cumsum(sizes) - sizes, sizes)
+    position = np.arange(n) - start
+    reach = np.minimum(size_of // 2, max_degree // 2)
+
+    row = np.repeat(np.arange(n), reach)
+    offset = np.arange(len(row)) - np.repeat(np.cumsum(reach) - reach, reach) + 1
+    col = start[row] + (position[row] + offset) % size_of[row]
+    keep = ~((2 * offset == size_of[row]) & (position[row] >= size_of[row] // 2)) # the same edge from both sides
+
+    source = members[row[keep]]
+    target = members[col[keep]]
+    return np.concatenate([source, target]), np.concatenate([target, source])
+
+
+def heavy_tailed_sizes(rng, min_size: int, alpha: float, max_size: int):
+    "Size sampler for `partition` with `min_size` plus a Pareto(`alpha`) tail"
+    def draw(k):
+        return np.minimum(min_size + np.floor(rng.pareto(alpha, size=k) * min_size), max_size)
+    return draw
+
+
+def generate_edges(spec: GraphSpec, seed: int = 0):
+    """Draw the edges of all layers of a synthetic graph.
+
+    Returns:
+        dict of layer name (see `LAYER_NAMES`) -> (source nodes, target nodes)
+    """
+    rng = np.random.default_rng(seed)
+    n = spec.n_nodes
+    nodes = np.arange(n, dtype=np.int64)
+    edges = {}
+
+    household_sizes = partition(
+        n, lambda k: rng.choice(spec.household_sizes, size=k, p=spec.household_probs)
+    )
+    household_of = np.repeat(np.arange(len(household_sizes)), household_sizes)
+    edges["household"] = group_edges(nodes, household_sizes, max(spec.household_sizes))
+
+    def households_to_nodes(households_per_group):
+        "Sizes in nodes of groups of consecutive households"
+        bounds = np.concatenate([[0], np.cumsum(households_per_group)])
+        node_bounds = np.concatenate([[0], np.cumsum(household_sizes)])[bounds]
+        return np.diff(node_bounds)
+
+    family_households = partition(len(household_sizes), lambda k: rng.geometric(1 / spec.households_per_family, size=k))
+    edges["family"] = group_edges(nodes, households_to_nodes(family_households), spec.max_family)
+
+    block_households = partition(len(household_sizes), lambda k: rng.geometric(1 / spec.households_per_block, size=k))
+    source, target = group_edges(nodes, households_to_nodes(block_households), spec.max_neighbors)
+    other_household = household_of[source] != household_of[target]
+    edges["neighbor"] = source[other_household], target[other_household]
+
+    for layer, share, min_size, alpha, max_degree in [
+        ("colleague", spec.colleague_share, spec.colleague_min_size, spec.colleague_alpha, spec.max_colleagues),
+        ("classmate", spec.classmate_share, spec.classmate_min_size, spec.classmate_alpha, spec.max_classmates)
+    ]:
+        members = rng.permutation(n)[:int(n * share)]
+        sizes = partition(len(members), heavy_tailed_sizes(rng, min_size, alpha, max(n, 1)))
+        edges[layer] = group_edges(members, sizes, max_degree)
+
+    return edges
+
+
+def edges_to_graph(n_nodes: int, layer_edges: list):
+    """Build a `LayeredCSRGraph` on nodes `0, ..., n_nodes - 1` from edge arrays.
+
+    Neighbors are sorted like in `src.graph.convert_to_csr`.
+
+    Args:
+        n_nodes: number of nodes
+        layer_edges: list of (source nodes, target nodes), one per layer
+
+    Returns:
+        `LayeredCSRGraph`
+    """
+    dtype = index_dtype(n_nodes)
+    indptr = np.zeros((len(layer_edges), n_nodes + 1), dtype=np.int64)
+    indices = []
+    offset = 0
+    for l, (source, target) in enumerate(layer_edges):
+        order = np.argsort(source * np.int64(n_nodes) + target) # faster than lexsort
+        indices.append(target[order].astype(dtype))
+        indptr[l, 0] = offset
+        np.cumsum(np.bincount(source, minlength=n_nodes), out=indptr[l, 1:])
+        indptr[l, 1:] += offset
+        offset += len(source)
+
+    indices = np.concatenate(indices) if indices else np.empty(0, dtype=dtype)
+    layer_mask = layer_mask_from_indptr(indptr)
+    alias_prob, alias_index = alias_arrays(indptr, None)
+    return LayeredCSRGraph(
+        node_ids=np.arange(n_nodes, dtype=np.int64),
+        indptr=indptr,
+        indices=indices,
+        layer_mask=layer_mask,
+        layer_count=SUBSET_COUNTS[layer_mask].astype(np.uint8),
+        alias_prob=alias_prob,
+        alias_index=alias_index
+    )
+
+
+def generate_graph(spec: GraphSpec, layer_names: list = LAYER_NAMES, seed: int = 0):
+    """Generate a synthetic graph.
+
+    Args:
+        spec: `GraphSpec`
+        layer_names: layers to include, in this order
+        seed: random seed
+
+    Returns:
+        tuple: (dense indices of the start nodes, i.e. all nodes, `LayeredCSRGraph`)
+    """
+    edges = generate_edges(spec, seed)
+    graph = edges_to_graph(spec.n_nodes, [edges[name] for name in layer_names])
+    return np.arange(spec.n_nodes, dtype=np.int64), graph
+
+
+def layer_dict(graph: LayeredCSRGraph, l: int, all_nodes: bool = False):
+    """Adjacency dict of one layer, as stored in `<layer>_<year>_adjacency_dict.pkl`.
+
+    Args:
+        graph: `LayeredCSRGraph`
+        l: index of the layer
+        all_nodes: if true, nodes without edges on this layer are keys with an empty list.
+    """
+    neighbors = graph.node_ids[graph.indices[graph.indptr[l, 0]:graph.indptr[l, -1]]].tolist()
+    bounds = (graph.indptr[l] - graph.indptr[l, 0]).tolist()
+    node_ids = graph.node_ids.tolist()
+    return {
+        node_ids[i]: neighbors[bounds[i]:bounds[i + 1]]
+        for i in range(len(node_ids)) if all_nodes or bounds[i + 1] > bounds[i]
+    }
+
+
+def write_pickles(graph: LayeredCSRGraph, layer_names: list, data_dir: str, year: int):
+    """Write each layer as `data_dir`/`layer`_`year`_adjacency_dict.pkl.
+
+    The family layer lists every node, because without a connected node file it defines the start nodes
+    (see `src.utils.load_data`).
+    """
+    for l, name in enumerate(layer_names):
+        with Path(data_dir, f"{name}_{year}_adjacency_dict.pkl").open("wb") as pkl_file:
+            pickle.dump(layer_dict(graph, l, all_nodes=name == "family"), pkl_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def spec_dict(spec: GraphSpec):
+    "`spec` as a json-serializable dict"
+    return {key: list(value) if isinstance(value, tuple) else value for key, value in asdict(spec).items()}
@@ -0,0 +1,48 @@
+"Wall-time measurement of pipeline phases"
+
+import sys
+import resource
+from time import perf_counter
+from contextlib import contextmanager
+
+from src.async_timing import Elapsed
+
+
+@contextmanager
+def timer():
+    "Synchronous counterpart of `src.async_timing.timer`"
+    e = Elapsed()
+    t = perf_counter()
+    yield e
+    e.time = perf_counter() - t
+
+
+def peak_rss_mb():
+    "Peak resident set size of this process so far, in MB"
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin": # bytes on macOS, KB on Linux
+        return maxrss / 2**20
+    return maxrss / 2**10
+
+
+class PhaseTimer:
+    """Record the wall time of named phases.
+
+    Args:
+        verbose: if true, prints the time of each phase when it ends.
+        metrics: optional `src.progress.MetricsLog` that receives a "phase" record when a phase ends.
+    """
+    def __init__(self, verbose: bool = True, metrics = None):
+        self.verbose = verbose
+        self.metrics = metrics
+        self.times = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        with timer() as t:
+            yield t
+        self.times[name] = self.times.get(name, 0.0) + t.time
+        if self.verbose:
+            print(f"{name}: {t.time:.2f}s")
+        if self.metrics is not None:
+            self.metrics.write("phase", name=name, seconds=t.time, peak_rss_mb=peak_rss_mb())
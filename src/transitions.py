@@ -0,0 +1,101 @@
+"""Layer-to-layer transition matrices.
+
+Instead of keeping the current layer with probability `p`, a walk can choose the layer of each step
+from row `current layer` of a transition matrix, restricted to the layers in which the current node has
+edges. The renormalized rows are precomputed for every (current layer, layer mask) pair, so a walk only
+needs one uniform draw and a scan over at most `MAX_LAYERS` cumulative probabilities per step.
+"""
+
+import json
+from pathlib import Path
+import numpy as np
+
+from src.graph import MAX_LAYERS, SUBSET_LAYERS, layer_subset_table
+
+
+NO_TRANSITIONS = np.empty((0, 0, 0), dtype=np.float64) # marks a walk that uses the resampling probability `p`
+
+
+def transition_table(matrix):
+    """Precompute the cumulative transition probabilities for every subset of layers.
+
+    Args:
+        matrix: array of shape (n_layers, n_layers) of non-negative weights; `matrix[i, j]` is the relative
+            probability of going from layer `i` to layer `j`. Rows do not need to sum to 1.
+
+    Returns:
+        array of shape (n_layers, 2**n_layers, n_layers). Entry `[i, mask, k]` is the probability that the
+        next layer is one of the first `k + 1` layers of `src.graph.SUBSET_LAYERS[mask]`, coming from layer `i`.
+        If layer `i` has no weight on any layer in `mask`, the layers in `mask` are equally likely.
+
+    Raises:
+        ValueError if the matrix is not square, has more than `MAX_LAYERS` layers or has negative entries.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1]:
+        raise ValueError(f"transition matrix must be square, got shape {matrix.shape}")
+    n_layers = matrix.shape[0]
+    if n_layers > MAX_LAYERS:
+        raise ValueError(f"transition matrix has {n_layers} layers, at most {MAX_LAYERS} are supported")
+    if (matrix < 0).any() or not np.isfinite(matrix).all():
+        raise ValueError("transition matrix must have finite non-negative entries")
+
+    subsets, counts = layer_subset_table(n_layers)
+    in_subset = subsets >= 0
+    table = np.zeros((n_layers, 2**n_layers, n_layers), dtype=np.float64)
+    for i in range(n_layers):
+        weights = np.where(in_subset, matrix[i][np.maximum(subsets, 0)], 0)
+        totals = weights.sum(axis=1, keepdims=True)
+        weights = np.where(totals > 0, weights, in_subset) # no weight on any available layer: uniform
+        table[i] = np.cumsum(weights, axis=1) / np.maximum(weights.sum(axis=1, keepdims=True), 1)
+        table[i, np.arange(2**n_layers), np.maximum(counts - 1, 0)] = 1 # guard against rounding
+    return table
+
+
+def sample_transition(table: np.ndarray, layer_index: int, layer_mask: int, count: int, draw: float):
+    """Choose the next layer from a `transition_table`.
+
+    Args:
+        table: output of `transition_table`
+        layer_index: current layer
+        layer_mask: bitmask of the layers in which the current node has edges
+        count: number of layers in `layer_mask`
+        draw: uniform random number in [0, 1)
+
+    Returns:
+        int: the next layer, or -1 if the mask is empty
+    """
+    if count == 0:
+        return -1
+    row = table[layer_index, layer_mask]
+    k = 0
+    while k < count - 1 and draw >= row[k]:
+        k += 1
+    return SUBSET_LAYERS[layer_mask, k]
+
+
+def transition_matrix(spec: dict, layer_names: list):
+    """Build a transition matrix from nested dicts of layer names.
+
+    Args:
+        spec: dict of current layer -> dict of next layer -> weight. Missing entries have weight 0;
+            a missing row gives equal weights to all layers.
+        layer_names: names of the layers in the order of the graph, see `src.utils.layers_to_read`
+
+    Raises:
+        ValueError if `spec` refers to a layer that is not in `layer_names`.
+    """
+    unknown = (set(spec) | {name for row in spec.values() for name in row}) - set(layer_names)
+    if unknown:
+        raise ValueError(f"transition matrix refers to unknown layers {sorted(unknown)}, expected some of {layer_names}")
+    matrix = np.ones((len(layer_names), len(layer_names)), dtype=np.float64)
+    for i, current in enumerate(layer_names):
+        if current in spec:
+            matrix[i] = [spec[current].get(name, 0) for name in layer_names]
+    return matrix
+
+
+def read_transition_matrix(path: str, layer_names: list):
+    "Read a transition matrix from a json file in the format of `transition_matrix`"
+    with Path(path).open() as f:
+        return transition_matrix(json.load(f), layer_names)
@@ -1,14 +1,14 @@
 
 import pickle 
-from numba.typed import Dict, List
-from numba.core import types
-import numba
 import numpy as np
 from itertools import islice
 from pathlib import Path
 import warnings
 import os 
 
+from src.graph import MAX_LAYERS
+from src.timing import PhaseTimer
+
 
 def load_data(data_dir, 
               year, 
@@ -33,51 +33,126 @@ def load_data(data_dir,
         tuple: (
             list of users, 
             list of layers, 
-            dictionary of users indicating on which layers they have at least one connection
+            dictionary of users with the bitmask of layers on which they have at least one connection
             )
     
     Raises:
         UserWarning when `connected_node_file` is not provided.
     
     """
+    unique_users, layers, masks = load_data_arrays(data_dir, year, connected_node_file, layer_types)
+    node_layer_dict = dict(zip(unique_users.tolist(), masks.tolist()))
+    unique_users = sample_users(unique_users.tolist(), sample_size)
 
-    possible_layers = ["family", "colleague", "classmate", "neighbor", "household"]
-    assert all([layer in possible_layers for layer in layer_types])
+    return unique_users, layers, node_layer_dict
+
+
+def load_data_arrays(data_dir, 
+                     year, 
+                     connected_node_file = None, 
+                     layer_types: list = ["neighbor", "colleague"],
+                     timer: PhaseTimer = None
+                     ):
+    """Load layered network data, returning the users and their layers as arrays.
+
+    Same as `load_data`, but without per-user Python loops. Users are not sampled; use `sample_users`.
+
+    Args:
+        data_dir, year, connected_node_file, layer_types: see `load_data`
+        timer: if given, records the time of each phase.
+
+    Returns:
+        tuple: (
+            int64 array of connected users, 
+            list of layers, 
+            uint8 array with the bitmask of layers on which each user has at least one connection
+            )
+    """
+    timer = timer or PhaseTimer(verbose=False)
+    layer_types = layers_to_read(layer_types, connected_node_file)
 
     if connected_node_file:
-        with Path(data_dir + connected_node_file + "_" + str(year) + ".pkl").open("rb") as pkl_file:
-            unique_users = list(pickle.load(pkl_file))
+        with timer.phase("load connected users"):
+            with Path(data_dir + connected_node_file + "_" + str(year) + ".pkl").open("rb") as pkl_file:
+                connected = pickle.load(pkl_file)
+                unique_users = np.fromiter(connected, dtype=np.int64, count=len(connected))
     else:
         warnings.warn("connected_node_file not provided; using edges from family network. Do this only with fake data.")
-        layer_types = list(set(layer_types + ["family"]))
-
 
     layers = []
     for ltype in layer_types:
-        with Path(data_dir + ltype + "_" + str(year) + "_adjacency_dict.pkl").open("rb") as pkl_file:
-            edges = dict(pickle.load(pkl_file))
+        with timer.phase(f"load {ltype}"):
+            with Path(data_dir + ltype + "_" + str(year) + "_adjacency_dict.pkl").open("rb") as pkl_file:
+                edges = dict(pickle.load(pkl_file))
+
+                if not connected_node_file and ltype == "family":
+                    unique_users = np.fromiter(edges.keys(), dtype=np.int64, count=len(edges))
 
-            if not connected_node_file and ltype == "family":
-                unique_users = list(edges.keys())
+                layers.append(edges)
 
-            layers.append(edges)
+    with timer.phase("layer masks"):
+        masks = layer_masks(unique_users, layers)
 
-    node_layer_dict = {}
-    for user in unique_users:
-        node_layer_dict[user] = []
-        
-        for i, layer in enumerate(layers):
-            if user in layer:
-                if len(layer[user]) > 0:
-                    node_layer_dict[user].append(i)
+    return unique_users, layers, masks
 
 
+def layers_to_read(layer_types: list, connected_node_file = None):
+    """Layers that `load_data` reads, in order: `layer_types`, plus the family layer if 
+    there is no `connected_node_file` because it then defines the connected users."""
+    possible_layers = ["family", "colleague", "classmate", "neighbor", "household"]
+    assert all([layer in possible_layers for layer in layer_types])
+    if not connected_node_file and "family" not in layer_types:
+        layer_types = layer_types + ["family"]
+    return layer_types
+
+
+def load_weights(data_dir, year, connected_node_file = None, layer_types: list = ["neighbor", "colleague"]):
+    """Load optional edge weights, stored as "`data_dir`/`layer`_`year`_weights_dict.pkl".
+
+    Each file holds a dict of node -> weights of its neighbors, in the order of the adjacency dict.
+
+    Returns:
+        list: for each layer read by `load_data`, the weights dict, or None if the layer has no weights file.
+    """
+    weights = []
+    for ltype in layers_to_read(layer_types, connected_node_file):
+        weight_file = Path(data_dir + ltype + "_" + str(year) + "_weights_dict.pkl")
+        if weight_file.exists():
+            with weight_file.open("rb") as pkl_file:
+                weights.append(dict(pickle.load(pkl_file)))
+        else:
+            weights.append(None)
+    return weights
+
+
+def sample_users(users, sample_size: int = -1):
+    "If `sample_size` is non-negative, returns a random sample of this size of `users`. The sample is the same in every run."
     if sample_size > 0:
         rng = np.random.default_rng(seed=95359385252)
-        unique_users = list(rng.choice(unique_users, size=sample_size))
+        sample = rng.choice(users, size=sample_size)
+        users = list(sample) if isinstance(users, list) else sample
+    return users
 
-    return unique_users, layers, node_layer_dict
 
+def layer_masks(users: list, layers: list):
+    """Compute for each user the layers on which they have at least one connection.
+    
+    Args:
+        users: list of node identifiers.
+        layers: list of adjacency lists
+
+    Returns:
+        np.ndarray: uint8 bitmask per user; bit `i` is set if the user has edges on `layers[i]`.
+    """
+    assert len(layers) <= MAX_LAYERS
+    users = np.asarray(users, dtype=np.int64)
+    masks = np.zeros(len(users), dtype=np.uint8)
+    for i, layer in enumerate(layers):
+        keys = np.fromiter(layer.keys(), dtype=np.int64, count=len(layer))
+        degrees = np.fromiter(map(len, layer.values()), dtype=np.int64, count=len(layer))
+        has_edges = np.isin(users, keys[degrees > 0])
+        masks |= has_edges.astype(np.uint8) << i
+    return masks
 
 
 def convert_to_numba(users: list, layers: list, node_layer_dict: dict):
@@ -86,23 +161,26 @@ def convert_to_numba(users: list, layers: list, node_layer_dict: dict):
     Args:
         users: list of node identifiers.
         layers: list of adjacency lists
-        node_layer_dict: dictionary indicating 
+        node_layer_dict: dictionary with the bitmask of layers on which each node has an edge
 
     Returns:
         the same objects with data types compatible for numba acceleration.
     
     """
+    import numba # imported here so that loading the data does not need numba
+    from numba.typed import Dict, List
+    from numba.core import types
 
     users_numba = List(users)
     users_numba = numba.int64(users_numba)
 
     node_layer_dict_numba = Dict.empty(
         key_type=types.int64,
-        value_type=types.int64[:]
+        value_type=types.int64
     )   
     for k, v in node_layer_dict.items():
         k = types.int64(k)
-        node_layer_dict_numba[k] = np.asarray(v, dtype=np.int64)
+        node_layer_dict_numba[k] = v
 
     layers_numba = List()
     for layer in layers: 
@@ -141,5 +219,5 @@ def get_n_cores(interactive: bool=False):
     # print(f"Have the following CPU cores: {cpus_avail}") 
     n_cores = len(cpus_avail)
     if interactive:
-        n_cores = n_cores // 2
+        n_cores = max(n_cores // 2, 1)
     return n_cores
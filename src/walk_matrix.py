@@ -0,0 +1,83 @@
+"Fixed-width walk matrices"
+
+import numpy as np
+
+
+WALK_PAD = np.iinfo(np.int32).min # fills the entries after the end of a walk
+NODE_PAD = -1 # fills the node entries after the end of a compact walk
+LAYER_PAD = np.iinfo(np.uint8).max # fills the layer entries after the end of a compact walk
+
+
+def walk_width(walk_len: int):
+    "Maximum number of entries in a walk of `walk_len` steps: the start node plus a layer token and a node per step"
+    return 2 * walk_len + 1
+
+
+def unpad(walks: np.ndarray, lengths: np.ndarray):
+    "Convert a walk matrix to a list of variable-length walks"
+    return [row[:n].tolist() for row, n in zip(walks, lengths)]
+
+
+def walk_dtype(node_ids: np.ndarray):
+    "Smallest integer type that can hold walks over nodes with identifiers `node_ids`, including layer tokens and `WALK_PAD`"
+    if len(node_ids) == 0 or (node_ids.min() > WALK_PAD and node_ids.max() <= np.iinfo(np.int32).max):
+        return np.int32
+    return np.int64
+
+
+def compact_arrays(n_walks: int, walk_len: int):
+    """Allocate compact walks: dense node indices and the layer index of each step in separate arrays.
+
+    A walk of `walk_len` steps takes 5 * walk_len + 4 bytes, against 16 * walk_len + 8 for an int64 walk matrix.
+
+    Returns:
+        tuple: (int32 nodes of shape (n_walks, walk_len + 1), uint8 layers of shape (n_walks, walk_len),
+            int64 number of nodes of each walk)
+    """
+    return (
+        np.empty((n_walks, walk_len + 1), dtype=np.int32),
+        np.empty((n_walks, walk_len), dtype=np.uint8),
+        np.empty(n_walks, dtype=np.int64)
+    )
+
+
+def to_compact(walks: np.ndarray, lengths: np.ndarray, node_ids: np.ndarray):
+    """Convert a walk matrix with original node identifiers and layer tokens to compact walks.
+
+    Args:
+        walks, lengths: walk matrix and number of entries of each walk, see `src.walks_numba.walk_into`
+        node_ids: sorted original identifiers of the dense node indices, `LayeredCSRGraph.node_ids`
+
+    Returns:
+        tuple: (nodes, layers, number of nodes of each walk) as from `compact_arrays`
+    """
+    walk_len = (walks.shape[1] - 1) // 2
+    n_nodes = (np.asarray(lengths, dtype=np.int64) + 1) // 2
+    nodes, layers, out_lengths = compact_arrays(len(walks), walk_len)
+    node_valid = np.arange(walk_len + 1) < n_nodes[:, None]
+    layer_valid = np.arange(walk_len) < n_nodes[:, None] - 1
+    nodes[:] = np.where(node_valid, np.searchsorted(node_ids, walks[:, 0::2]), NODE_PAD)
+    layers[:] = np.where(layer_valid, -walks[:, 1::2] - 1, LAYER_PAD)
+    out_lengths[:] = n_nodes
+    return nodes, layers, out_lengths
+
+
+def from_compact(nodes: np.ndarray, layers: np.ndarray, lengths: np.ndarray, node_ids: np.ndarray, dtype=np.int64):
+    """Convert compact walks back to a walk matrix with original node identifiers and layer tokens.
+
+    Args:
+        nodes, layers, lengths: compact walks, see `compact_arrays`
+        node_ids: original identifiers of the dense node indices
+        dtype: integer type of the walk matrix, see `walk_dtype`
+
+    Returns:
+        tuple: (walk matrix padded with `WALK_PAD`, number of entries of each walk)
+    """
+    walk_len = layers.shape[1]
+    n_nodes = np.asarray(lengths, dtype=np.int64)
+    walks = np.empty((len(nodes), walk_width(walk_len)), dtype=dtype)
+    node_valid = np.arange(walk_len + 1) < n_nodes[:, None]
+    layer_valid = np.arange(walk_len) < n_nodes[:, None] - 1
+    walks[:, 0::2] = np.where(node_valid, node_ids[np.where(node_valid, nodes, 0)], WALK_PAD)
+    walks[:, 1::2] = np.where(layer_valid, -layers.astype(np.int64) - 1, WALK_PAD)
+    return walks, 2 * n_nodes - 1
@@ -1,6 +1,9 @@
 
 import numpy as np 
 
+from src.graph import SUBSET_LAYERS, SUBSET_COUNTS
+from src.alias import alias_sample
+from src.transitions import sample_transition
 
 
 
@@ -16,19 +19,33 @@ def custom_sample(choice_set: list):
     return np.int64(chosen)
 
 
+def sample_layer(layer_mask: int):
+    "Sample uniformly one of the layers in `layer_mask`. Returns -1 if the mask is empty."
+    count = SUBSET_COUNTS[layer_mask]
+    if count == 0:
+        return -1
+    return SUBSET_LAYERS[layer_mask, np.random.randint(count)]
+
+
 def single_walk(start_node: int,
                 walk_len: int, 
                 node_layer_dict: dict, 
                 layers: list,
-                p: float=0.8):
+                p: float=0.8,
+                alias_tables: list=None,
+                transitions: np.ndarray=None):
     """Create a single random walk starting at one node.
     
     Args:
         start_node: the node from which to start
         walk_len: the length of the random walk 
-        node_layer_dict: dictionary indicating the layer indices in which each node as at least one edge.
+        node_layer_dict: dictionary with the bitmask of layers in which each node has at least one edge.
         layers: list of dicts. Each layer is an edge list, indicating the connected nodes for each node. 
         p: probability of resampling the layer. 
+        alias_tables: optional list with, for each layer, the output of `src.alias.alias_tables`, or None
+            for a layer with equal weights. Neighbors are then sampled proportionally to their weights.
+        transitions: optional output of `src.transitions.transition_table`. If given, the layer of each step
+            after the first is drawn from it instead of using `p`.
     
     Returns:
         list: a sequence of node identifiers
@@ -36,16 +53,20 @@ def single_walk(start_node: int,
     current_node = start_node
     walk = [start_node]
 
-    layer_indices = node_layer_dict[current_node]
-    layer_index = custom_sample(layer_indices)
+    layer_mask = node_layer_dict[current_node]
+    layer_index = sample_layer(layer_mask)
     if layer_index == -1:
         return walk
 
     for draw in np.random.rand(walk_len):
-        layer_indices = node_layer_dict[current_node]
+        layer_mask = node_layer_dict[current_node]
 
-        if draw > p or layer_index not in layer_indices: # because graph is not directed, a node may be reachable on one layer but does not have any outgoing connections on that layer
-            layer_index = custom_sample(layer_indices)
+        if transitions is not None:
+            layer_index = sample_transition(transitions, layer_index, layer_mask, SUBSET_COUNTS[layer_mask], draw)
+            if layer_index == -1:
+                break
+        elif draw > p or not (layer_mask >> layer_index) & 1: # because graph is not directed, a node may be reachable on one layer but does not have any outgoing connections on that layer
+            layer_index = sample_layer(layer_mask)
             if layer_index == -1:
                 break
 
@@ -53,7 +74,10 @@ def single_walk(start_node: int,
         adjacent_nodes = current_layer[current_node]
 
         walk.append(-layer_index - 1) # the first node is indicated by 0
-        next_node = custom_sample(adjacent_nodes)
+        if alias_tables is not None and alias_tables[layer_index] is not None:
+            next_node = alias_sample(adjacent_nodes, *alias_tables[layer_index][current_node])
+        else:
+            next_node = custom_sample(adjacent_nodes)
         if next_node == -1:
             break
         
@@ -67,7 +91,9 @@ def create_walks(users: list,
                  walk_len: int,
                  node_layer_dict: dict,
                  layers: list,
-                 p: float=0.8
+                 p: float=0.8,
+                 alias_tables: list=None,
+                 transitions: np.ndarray=None
                  ):
     """Create 1 random walk for each node"""
     walks = []
@@ -76,7 +102,9 @@ def create_walks(users: list,
                            walk_len=walk_len,
                            node_layer_dict=node_layer_dict,
                            layers=layers,
-                           p=p)
+                           p=p,
+                           alias_tables=alias_tables,
+                           transitions=transitions)
         walks.append(walk)
     return walks
 
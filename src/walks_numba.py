@@ -3,6 +3,12 @@ import numpy as np
 from numba.typed import List
 from numba.core import types
 
+from src.graph import SUBSET_LAYERS, SUBSET_COUNTS
+from src.walk_matrix import WALK_PAD, NODE_PAD, LAYER_PAD
+from src.rng import seed_stream, reseed_walk, next_float, next_below, random_seed
+from src.transitions import NO_TRANSITIONS
+from src.progress import COUNT_WALKS, COUNT_STEPS, COUNT_EARLY
+
 
 @numba.njit(nogil=True)
 def custom_sample(choice_set: list):
@@ -16,6 +22,113 @@ def custom_sample(choice_set: list):
     
     return np.int64(chosen)
 
+
+@numba.njit(nogil=True)
+def sample_layer(layer_mask: types.int64, count: types.int64):
+    "Sample uniformly one of the `count` layers in `layer_mask`. Returns -1 if the mask is empty."
+    if count == 0:
+        return -1
+    return SUBSET_LAYERS[layer_mask, np.random.randint(count)]
+
+
+@numba.njit(nogil=True)
+def sample_layer_rng(layer_mask: types.int64, count: types.int64, state):
+    "Same as `sample_layer`, drawing from the random stream `state`"
+    if count == 0:
+        return -1
+    return SUBSET_LAYERS[layer_mask, next_below(state, count)]
+
+
+@numba.njit(nogil=True)
+def sample_transition_rng(transitions: numba.float64[:, :, :], layer_index: types.int64, layer_mask: types.int64, count: types.int64, state):
+    "Numba version of `src.transitions.sample_transition`, drawing from the random stream `state`"
+    if count == 0:
+        return -1
+    draw = next_float(state)
+    k = 0
+    while k < count - 1 and draw >= transitions[layer_index, layer_mask, k]:
+        k += 1
+    return SUBSET_LAYERS[layer_mask, k]
+
+
+@numba.njit(nogil=True)
+def has_edge(graph, node: types.int64, target: types.int64):
+    "Whether `node` and `target` are adjacent on any layer, by binary search in the sorted adjacency lists"
+    indptr = graph.indptr
+    indices = graph.indices
+    mask = graph.layer_mask[node]
+    for l in range(indptr.shape[0]):
+        if (mask >> l) & 1:
+            begin = indptr[l, node]
+            end = indptr[l, node + 1]
+            k = begin + np.searchsorted(indices[begin:end], target)
+            if k < end and indices[k] == target:
+                return True
+    return False
+
+
+@numba.njit(nogil=True)
+def build_alias_tables(indptr: numba.int64[:, :], weights: numba.float64[:]):
+    """Build the alias tables of all adjacency lists of a `LayeredCSRGraph`, see `src.alias.alias_table`.
+
+    Args:
+        indptr: offsets of the graph
+        weights: weight of each edge, aligned with the graph's `indices`
+
+    Returns:
+        tuple: (float32 probabilities, int32 alias positions within each adjacency list), aligned with `indices`
+    """
+    n_edges = weights.shape[0]
+    prob = np.ones(n_edges, dtype=np.float32)
+    alias = np.empty(n_edges, dtype=np.int32)
+
+    max_degree = 0
+    for l in range(indptr.shape[0]):
+        for i in range(indptr.shape[1] - 1):
+            max_degree = max(max_degree, indptr[l, i + 1] - indptr[l, i])
+    scaled = np.empty(max_degree, dtype=np.float64)
+    small = np.empty(max_degree, dtype=np.int64)
+    large = np.empty(max_degree, dtype=np.int64)
+
+    for l in range(indptr.shape[0]):
+        for i in range(indptr.shape[1] - 1):
+            begin = indptr[l, i]
+            n = indptr[l, i + 1] - begin
+            for k in range(n):
+                alias[begin + k] = k
+            total = weights[begin:begin + n].sum()
+            if n == 0 or total <= 0:
+                continue
+
+            n_small = 0
+            n_large = 0
+            for k in range(n):
+                scaled[k] = weights[begin + k] * n / total
+                if scaled[k] < 1:
+                    small[n_small] = k
+                    n_small += 1
+                else:
+                    large[n_large] = k
+                    n_large += 1
+
+            while n_small > 0 and n_large > 0:
+                n_small -= 1
+                n_large -= 1
+                s = small[n_small]
+                g = large[n_large]
+                prob[begin + s] = scaled[s]
+                alias[begin + s] = g
+                scaled[g] = scaled[g] + scaled[s] - 1
+                if scaled[g] < 1:
+                    small[n_small] = g
+                    n_small += 1
+                else:
+                    large[n_large] = g
+                    n_large += 1
+
+    return prob, alias
+
+
 @numba.njit(nogil=True)
 def create_walks(
     nodes: numba.int64[:],
@@ -49,7 +162,7 @@ def single_walk(start_node: types.int64,
     Args:
         start_node: the node from which to start
         walk_len: the length of the random walk 
-        node_layer_dict: dictionary indicating the layer indices in which each node as at least one edge.
+        node_layer_dict: dictionary with the bitmask of layers in which each node has at least one edge.
         layers: list of numba.typed.Dict. Each layer is an edge list, indicating the connected nodes for each node. 
         p: probability of resampling the layer. 
     
@@ -62,16 +175,16 @@ def single_walk(start_node: types.int64,
     walk.append(start_node)
 
 
-    layer_indices = node_layer_dict[current_node]
-    layer_index = custom_sample(layer_indices)
+    layer_mask = node_layer_dict[current_node]
+    layer_index = sample_layer(layer_mask, SUBSET_COUNTS[layer_mask])
     if layer_index == -1:
         return walk
 
     for draw in np.random.rand(walk_len):
-        layer_indices = node_layer_dict[current_node]
+        layer_mask = node_layer_dict[current_node]
 
-        if draw > p or layer_index not in layer_indices:
-            layer_index = custom_sample(layer_indices)
+        if draw > p or not (layer_mask >> layer_index) & 1:
+            layer_index = sample_layer(layer_mask, SUBSET_COUNTS[layer_mask])
             if layer_index == -1:
                 break
 
@@ -87,3 +200,445 @@ def single_walk(start_node: types.int64,
         current_node = next_node
 
     return walk 
+
+
+@numba.njit(nogil=True)
+def walk_steps_into(start_node: types.int64,
+                    walk_len: int,
+                    graph,
+                    p: float,
+                    transitions: numba.float64[:, :, :],
+                    return_param: float,
+                    inout_param: float,
+                    nodes_out,
+                    layers_out,
+                    state):
+    """Core of `walk_into`: write the dense indices of the nodes of a walk and the layer index of each step.
+
+    Args:
+        start_node, walk_len, graph, p, transitions, return_param, inout_param, state: see `walk_into`
+        nodes_out: integer buffer of at least `walk_len + 1` entries
+        layers_out: integer buffer of at least `walk_len` entries
+
+    Returns:
+        int: the number of nodes written, i.e. the number of steps + 1. Entries after them are not touched.
+    """
+    indptr = graph.indptr
+    indices = graph.indices
+    layer_mask = graph.layer_mask
+    layer_count = graph.layer_count
+    alias_prob = graph.alias_prob
+    alias_index = graph.alias_index
+    weighted = alias_prob.shape[0] > 0
+    use_transitions = transitions.shape[0] > 0
+    second_order = return_param != 1.0 or inout_param != 1.0
+    max_bias = max(1.0 / return_param, 1.0, 1.0 / inout_param)
+    min_bias = min(1.0 / return_param, 1.0, 1.0 / inout_param)
+
+    previous_node = -1
+    current_node = start_node
+    nodes_out[0] = start_node
+    n = 1
+
+    layer_index = sample_layer_rng(layer_mask[current_node], layer_count[current_node], state)
+    if layer_index != -1:
+        for _ in range(walk_len):
+            if use_transitions:
+                layer_index = sample_transition_rng(
+                    transitions, layer_index, layer_mask[current_node], layer_count[current_node], state
+                )
+                if layer_index == -1:
+                    break
+            elif next_float(state) > p or not (layer_mask[current_node] >> layer_index) & 1:
+                layer_index = sample_layer_rng(layer_mask[current_node], layer_count[current_node], state)
+                if layer_index == -1:
+                    break
+
+            begin = indptr[layer_index, current_node]
+            end = indptr[layer_index, current_node + 1]
+            while True:
+                k = next_below(state, end - begin)
+                if weighted and next_float(state) >= alias_prob[begin + k]:
+                    k = alias_index[begin + k]
+                next_node = indices[begin + k]
+                if not second_order or previous_node == -1:
+                    break
+
+                draw = next_float(state) * max_bias
+                if next_node == previous_node:
+                    bias = 1.0 / return_param
+                elif draw < min_bias: # accepted whatever the distance, skip the search
+                    break
+                elif has_edge(graph, previous_node, next_node):
+                    bias = 1.0
+                else:
+                    bias = 1.0 / inout_param
+                if draw < bias:
+                    break
+
+            layers_out[n - 1] = layer_index
+            nodes_out[n] = next_node
+            n += 1
+            previous_node = current_node
+            current_node = next_node
+
+    return n
+
+
+@numba.njit(nogil=True)
+def walk_into(start_node: types.int64,
+              walk_len: int,
+              graph,
+              p: float,
+              transitions: numba.float64[:, :, :],
+              return_param: float,
+              inout_param: float,
+              out: numba.int64[:],
+              state):
+    """Write a single random walk on a `LayeredCSRGraph` into a buffer.
+
+    If the graph has alias tables, neighbors are drawn proportionally to the edge weights.
+
+    Unless `return_param` and `inout_param` are both 1, the walk is second-order as in node2vec: a
+    candidate `x` for the step after `prev -> current` is weighted by `1 / return_param` if it is `prev`,
+    by 1 if it is adjacent to `prev` on any layer and by `1 / inout_param` otherwise. Candidates are drawn
+    as in a first-order walk and accepted with probability weight / max weight, so the graph needs no
+    per-edge precomputation. Draws below the smallest weight are accepted without looking up the distance;
+    otherwise a lookup costs one binary search per layer of `prev`.
+
+    Args:
+        start_node: dense index of the node from which to start
+        walk_len: the length of the random walk
+        graph: `LayeredCSRGraph`
+        p: probability of resampling the layer.
+        transitions: output of `src.transitions.transition_table`. The layer of each step after the first is
+            drawn from it instead of using `p`. Ignored if empty (`src.transitions.NO_TRANSITIONS`).
+        return_param: node2vec return parameter `p`. Must be positive.
+        inout_param: node2vec in-out parameter `q`. Must be positive.
+        out: buffer of at least `2 * walk_len + 1` entries. Entries after the end of the walk are set to `WALK_PAD`.
+        state: random stream from `src.rng.seed_stream`
+
+    Returns:
+        int: the number of entries written
+    """
+    n_nodes = walk_steps_into(
+        start_node, walk_len, graph, p, transitions, return_param, inout_param, out[0::2], out[1::2], state
+    )
+    # interleave in place: the nodes are already at even positions and the layers at odd ones
+    node_ids = graph.node_ids
+    for i in range(n_nodes):
+        out[2 * i] = node_ids[out[2 * i]]
+    for i in range(n_nodes - 1):
+        out[2 * i + 1] = -out[2 * i + 1] - 1 # the first layer is indicated by -1
+    n = 2 * n_nodes - 1
+    out[n:] = WALK_PAD
+    return n
+
+
+@numba.njit(nogil=True)
+def single_walk_csr(start_node: types.int64,
+                    walk_len: int,
+                    graph,
+                    p: float=0.8,
+                    transitions=None,
+                    return_param: float=1.0,
+                    inout_param: float=1.0):
+    """Create a single random walk on a `LayeredCSRGraph`.
+
+    Args:
+        start_node: dense index of the node from which to start
+        walk_len: the length of the random walk
+        graph: `LayeredCSRGraph`
+        p: probability of resampling the layer.
+        transitions: optional output of `src.transitions.transition_table`, used instead of `p`
+        return_param, inout_param: node2vec parameters, see `walk_into`
+
+    Returns:
+        list: a sequence of original node identifiers, interleaved with layer tokens
+    """
+    if transitions is None:
+        transitions = NO_TRANSITIONS
+    buffer = np.empty(2 * walk_len + 1, dtype=np.int64)
+    n = walk_into(start_node, walk_len, graph, p, transitions, return_param, inout_param, buffer, seed_stream(random_seed(), 0))
+    walk = List.empty_list(types.int64)
+    for i in range(n):
+        walk.append(buffer[i])
+    return walk
+
+
+@numba.njit(nogil=True)
+def create_walks_csr(
+    nodes: numba.int64[:],
+    walk_len: int,
+    graph,
+    p: float=0.8,
+    transitions=None,
+    return_param: float=1.0,
+    inout_param: float=1.0
+    ):
+    "Create 1 random walk for each node, given as dense indices into `graph`. See `single_walk_csr`."
+    if transitions is None:
+        transitions = NO_TRANSITIONS
+    state = seed_stream(random_seed(), 0)
+    buffer = np.empty(2 * walk_len + 1, dtype=np.int64)
+    result = List()
+    for node in nodes:
+        n = walk_into(node, walk_len, graph, p, transitions, return_param, inout_param, buffer, state)
+        walk = List.empty_list(types.int64)
+        for i in range(n):
+            walk.append(buffer[i])
+        result.append(walk)
+    return result
+
+
+@numba.njit(nogil=True)
+def create_walks_into(
+    nodes: numba.int64[:],
+    walk_len: int,
+    graph,
+    p: float,
+    transitions: numba.float64[:, :, :],
+    return_param: float,
+    inout_param: float,
+    out: numba.int64[:, :],
+    lengths: numba.int64[:],
+    seed: int=-1
+    ):
+    """Create 1 random walk for each node and write them into caller-supplied buffers.
+
+    Args:
+        nodes: dense indices of the start nodes
+        walk_len: the length of the random walks
+        graph: `LayeredCSRGraph`
+        p: probability of resampling the layer.
+        transitions: transition table, see `walk_into`
+        return_param, inout_param: node2vec parameters, see `walk_into`
+        out: array of shape (len(nodes), 2 * walk_len + 1). Row `i` receives the walk from `nodes[i]`,
+            padded with `WALK_PAD`.
+        lengths: array of shape (len(nodes),) receiving the number of entries in each walk.
+        seed: seed of the random stream. If negative, it is drawn from numba's global generator.
+    """
+    if seed < 0:
+        seed = random_seed()
+    state = seed_stream(seed, 0)
+    for i in range(nodes.shape[0]):
+        lengths[i] = walk_into(nodes[i], walk_len, graph, p, transitions, return_param, inout_param, out[i], state)
+
+
+@numba.njit(nogil=True)
+def create_walks_matrix(
+    nodes: numba.int64[:],
+    walk_len: int,
+    graph,
+    p: float=0.8,
+    seed: int=-1,
+    transitions=None,
+    return_param: float=1.0,
+    inout_param: float=1.0
+    ):
+    """Create 1 random walk for each node as a fixed-width matrix.
+
+    Returns:
+        tuple: (walks of shape (len(nodes), 2 * walk_len + 1) padded with `WALK_PAD`, lengths of the walks)
+    """
+    if transitions is None:
+        transitions = NO_TRANSITIONS
+    out = np.empty((nodes.shape[0], 2 * walk_len + 1), dtype=np.int64)
+    lengths = np.empty(nodes.shape[0], dtype=np.int64)
+    create_walks_into(nodes, walk_len, graph, p, transitions, return_param, inout_param, out, lengths, seed)
+    return out, lengths
+
+
+@numba.njit(nogil=True, parallel=True)
+def create_walks_parallel(
+    nodes: numba.int64[:],
+    walk_len: int,
+    graph,
+    p: float,
+    transitions: numba.float64[:, :, :],
+    return_param: float,
+    inout_param: float,
+    out: numba.int64[:, :],
+    lengths: numba.int64[:],
+    seed: int
+    ):
+    """Create 1 random walk for each node on all numba threads.
+
+    The nodes are split into one contiguous block per thread, and each block is walked
+    with its own random stream derived from `seed`. The result is reproducible for a given
+    seed and number of threads (`numba.set_num_threads`).
+
+    Args: see `create_walks_into`.
+    """
+    n_nodes = nodes.shape[0]
+    n_streams = numba.get_num_threads()
+    for stream in numba.prange(n_streams):
+        state = seed_stream(seed, stream)
+        begin = stream * n_nodes // n_streams
+        end = (stream + 1) * n_nodes // n_streams
+        for i in range(begin, end):
+            lengths[i] = walk_into(nodes[i], walk_len, graph, p, transitions, return_param, inout_param, out[i], state)
+
+
+@numba.njit(nogil=True)
+def walk_units_into(
+    nodes: numba.int64[:],
+    unit_begin: int,
+    unit_end: int,
+    walk_len: int,
+    graph,
+    p: float,
+    transitions: numba.float64[:, :, :],
+    return_param: float,
+    inout_param: float,
+    out: numba.int64[:, :],
+    lengths: numba.int64[:],
+    seed: int,
+    counters: numba.int64[:]
+    ):
+    """Sequential version of `create_walks_units`, for schedulers that call it from their own threads.
+
+    `counters` is the row of `src.progress.new_counters` owned by the calling thread.
+    """
+    n_nodes = nodes.shape[0]
+    state = np.empty(1, dtype=np.uint64)
+    for row in range(unit_end - unit_begin):
+        unit = unit_begin + row
+        node_position = unit % n_nodes
+        reseed_walk(state, seed, node_position, unit // n_nodes)
+        n = walk_into(
+            nodes[node_position], walk_len, graph, p, transitions, return_param, inout_param, out[row], state
+        )
+        lengths[row] = n
+        counters[COUNT_WALKS] += 1
+        counters[COUNT_STEPS] += (n - 1) // 2
+        if n < out.shape[1]:
+            counters[COUNT_EARLY] += 1
+
+
+@numba.njit(nogil=True, parallel=True)
+def create_walks_units(
+    nodes: numba.int64[:],
+    unit_begin: int,
+    unit_end: int,
+    walk_len: int,
+    graph,
+    p: float,
+    transitions: numba.float64[:, :, :],
+    return_param: float,
+    inout_param: float,
+    out: numba.int64[:, :],
+    lengths: numba.int64[:],
+    seed: int,
+    counters: numba.int64[:, :]
+    ):
+    """Create the walks of a range of units of the start node x repeat space on all numba threads.
+
+    Unit `u` is repeat `u // len(nodes)` of the walk from `nodes[u % len(nodes)]`, which
+    matches the order of `np.tile(nodes, n_walks)`. Each walk has its own random stream
+    derived from (seed, u % len(nodes), u // len(nodes)), so the output does not depend on
+    how the units are split over shards or threads.
+
+    Args:
+        nodes: dense indices of the start nodes
+        unit_begin: first unit to create
+        unit_end: end of the range of units (exclusive)
+        walk_len: the length of the random walks
+        graph: `LayeredCSRGraph`
+        p: probability of resampling the layer.
+        transitions: transition table, see `walk_into`
+        return_param, inout_param: node2vec parameters, see `walk_into`
+        out: array of shape (unit_end - unit_begin, 2 * walk_len + 1) receiving the walks
+        lengths: array of shape (unit_end - unit_begin,) receiving the number of entries in each walk.
+        seed: global seed
+        counters: progress counters from `src.progress.new_counters`; the thread that creates a block of
+            walks adds to row `block % len(counters)`.
+    """
+    n_units = unit_end - unit_begin
+    n_streams = numba.get_num_threads()
+    for stream in numba.prange(n_streams):
+        begin = stream * n_units // n_streams
+        end = (stream + 1) * n_units // n_streams
+        walk_units_into(
+            nodes, unit_begin + begin, unit_begin + end, walk_len, graph, p, transitions, return_param, inout_param,
+            out[begin:end], lengths[begin:end], seed, counters[stream % counters.shape[0]]
+        )
+
+
+@numba.njit(nogil=True)
+def compact_units_into(
+    nodes: numba.int64[:],
+    unit_begin: int,
+    unit_end: int,
+    walk_len: int,
+    graph,
+    p: float,
+    transitions: numba.float64[:, :, :],
+    return_param: float,
+    inout_param: float,
+    walk_nodes: numba.int32[:, :],
+    walk_layers: numba.uint8[:, :],
+    lengths: numba.int64[:],
+    seed: int,
+    counters: numba.int64[:]
+    ):
+    "Sequential version of `create_compact_units`, for schedulers that call it from their own threads"
+    n_nodes = nodes.shape[0]
+    state = np.empty(1, dtype=np.uint64)
+    for row in range(unit_end - unit_begin):
+        unit = unit_begin + row
+        node_position = unit % n_nodes
+        reseed_walk(state, seed, node_position, unit // n_nodes)
+        n = walk_steps_into(
+            nodes[node_position], walk_len, graph, p, transitions, return_param, inout_param,
+            walk_nodes[row], walk_layers[row], state
+        )
+        walk_nodes[row, n:] = NODE_PAD
+        walk_layers[row, n - 1:] = LAYER_PAD
+        lengths[row] = n
+        counters[COUNT_WALKS] += 1
+        counters[COUNT_STEPS] += n - 1
+        if n < walk_nodes.shape[1]:
+            counters[COUNT_EARLY] += 1
+
+
+@numba.njit(nogil=True, parallel=True)
+def create_compact_units(
+    nodes: numba.int64[:],
+    unit_begin: int,
+    unit_end: int,
+    walk_len: int,
+    graph,
+    p: float,
+    transitions: numba.float64[:, :, :],
+    return_param: float,
+    inout_param: float,
+    walk_nodes: numba.int32[:, :],
+    walk_layers: numba.uint8[:, :],
+    lengths: numba.int64[:],
+    seed: int,
+    counters: numba.int64[:, :]
+    ):
+    """`create_walks_units` in the compact encoding of `src.walk_matrix.compact_arrays`.
+
+    The walks are the same as those of `create_walks_units` with the same arguments, see
+    `src.walk_matrix.from_compact`.
+
+    Args:
+        nodes, unit_begin, unit_end, walk_len, graph, p, transitions, return_param, inout_param, seed, counters:
+            see `create_walks_units`
+        walk_nodes: int32 array of shape (unit_end - unit_begin, walk_len + 1) receiving the dense node indices,
+            padded with `NODE_PAD`
+        walk_layers: uint8 array of shape (unit_end - unit_begin, walk_len) receiving the layer index of each step,
+            padded with `LAYER_PAD`
+        lengths: array of shape (unit_end - unit_begin,) receiving the number of nodes in each walk.
+    """
+    n_units = unit_end - unit_begin
+    n_streams = numba.get_num_threads()
+    for stream in numba.prange(n_streams):
+        begin = stream * n_units // n_streams
+        end = (stream + 1) * n_units // n_streams
+        compact_units_into(
+            nodes, unit_begin + begin, unit_begin + end, walk_len, graph, p, transitions, return_param, inout_param,
+            walk_nodes[begin:end], walk_layers[begin:end], lengths[begin:end], seed, counters[stream % counters.shape[0]]
+        )
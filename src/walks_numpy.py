@@ -0,0 +1,113 @@
+"""Random walks with NumPy only, for sites without a working numba build.
+
+Instead of one walk at a time, all walks of a batch advance one step together: every step
+is a handful of array operations over the walkers that are still active, on the flat CSR
+arrays of a `LayeredCSRGraph`. Walkers that reach a node without edges are dropped from
+the active set. The walks follow the same rules as `src.walks_numba.walk_into` (first order
+only) and are written in the same walk matrix format, but come from NumPy's generator, so
+they are not the same walks as those of the numba kernels for a given seed.
+"""
+
+import numpy as np
+
+from src.graph import LayeredCSRGraph, SUBSET_LAYERS
+from src.walk_matrix import WALK_PAD, walk_width
+from src.transitions import NO_TRANSITIONS
+
+
+STEP_BLOCK = 8 # steps collected in a step-major buffer before they are copied into the walk matrix
+
+def sample_layers(layer_mask: np.ndarray, count: np.ndarray, draw: np.ndarray):
+    "Vectorized `src.walks.sample_layer` given uniform draws in [0, 1). Returns -1 where the mask is empty."
+    return SUBSET_LAYERS[layer_mask, (draw * count).astype(np.int64)]
+
+
+def sample_transitions(transitions: np.ndarray, layer_index: np.ndarray, layer_mask: np.ndarray, count: np.ndarray,
+                       draw: np.ndarray):
+    "Vectorized `src.transitions.sample_transition`. Returns -1 where the mask is empty."
+    rows = transitions[layer_index, layer_mask]
+    k = np.minimum((draw[:, None] >= rows).sum(axis=1), np.maximum(count - 1, 0))
+    return np.where(count > 0, SUBSET_LAYERS[layer_mask, k], -1)
+
+
+def create_walks_lockstep(nodes: np.ndarray, walk_len: int, graph: LayeredCSRGraph, p: float = 0.8,
+                          transitions: np.ndarray = NO_TRANSITIONS, rng=None, out: np.ndarray = None,
+                          lengths: np.ndarray = None):
+    """Create 1 random walk for each node, advancing all walks one step at a time.
+
+    Args:
+        nodes: dense indices of the start nodes
+        walk_len: the length of the random walks
+        graph: `LayeredCSRGraph`; weighted graphs are sampled with their alias tables
+        p: probability of keeping the layer, see `src.walks_numba.walk_into`
+        transitions: optional layer transition table, see `src.transitions.transition_table`
+        rng: seed or `np.random.Generator`
+        out: optional array of shape (len(nodes), 2 * walk_len + 1) receiving the walks, padded with `WALK_PAD`
+        lengths: optional array of shape (len(nodes),) receiving the number of entries in each walk
+
+    Returns:
+        tuple: (walk matrix, lengths of the walks), see `src.walks_numba.create_walks_matrix`
+    """
+    rng = np.random.default_rng(rng)
+    nodes = np.asarray(nodes, dtype=np.int64)
+    if out is None:
+        out = np.empty((len(nodes), walk_width(walk_len)), dtype=np.int64)
+    if lengths is None:
+        lengths = np.empty(len(nodes), dtype=np.int64)
+    weighted = len(graph.alias_prob) > 0
+    use_transitions = transitions.shape[0] > 0
+    row_len = graph.indptr.shape[1]
+    indptr = graph.indptr.reshape(-1)
+
+    out[:, 0] = graph.node_ids[nodes]
+    lengths[:] = out.shape[1]
+    # writing a column of the row-major walk matrix per step touches a cache line per walk, so the
+    # entries of STEP_BLOCK steps are collected in contiguous rows and copied over in one go
+    block = np.empty((2 * STEP_BLOCK, len(nodes)), dtype=out.dtype)
+    block_begin = 1
+
+    # state of the active walkers only: their rows in `out`, current nodes and layers
+    rows = np.arange(len(nodes))
+    current = nodes
+    layer = sample_layers(graph.layer_mask[current], graph.layer_count[current], rng.random(len(rows)))
+    for step in range(walk_len):
+        if step % STEP_BLOCK == 0:
+            block[:] = WALK_PAD
+        if (layer < 0).any():
+            rows, current, layer = _drop_finished(rows, current, layer, lengths, 2 * step + 1)
+
+        mask = graph.layer_mask[current]
+        count = graph.layer_count[current]
+        if use_transitions:
+            layer = sample_transitions(transitions, layer, mask, count, rng.random(len(rows)))
+        else:
+            resample = (rng.random(len(rows)) > p) | (((mask >> layer) & 1) == 0)
+            if resample.any():
+                layer[resample] = sample_layers(mask[resample], count[resample], rng.random(resample.sum()))
+        if (layer < 0).any():
+            rows, current, layer = _drop_finished(rows, current, layer, lengths, 2 * step + 1)
+
+        offset = layer * row_len + current
+        begin = indptr[offset]
+        degree = indptr[offset + 1] - begin
+        edge = begin + (rng.random(len(rows)) * degree).astype(np.int64)
+        if weighted:
+            alias = rng.random(len(rows)) >= graph.alias_prob[edge]
+            edge[alias] = begin[alias] + graph.alias_index[edge[alias]]
+        current = graph.indices[edge].astype(np.int64)
+
+        k = 2 * (step % STEP_BLOCK)
+        block[k, rows] = -layer - 1
+        block[k + 1, rows] = graph.node_ids[current]
+        if step % STEP_BLOCK == STEP_BLOCK - 1 or step == walk_len - 1:
+            out[:, block_begin:2 * step + 3] = block[:k + 2].T
+            block_begin = 2 * step + 3
+    return out, lengths
+
+
+def _drop_finished(rows: np.ndarray, current: np.ndarray, layer: np.ndarray, lengths: np.ndarray, length: int):
+    "Record the length of the walkers without a layer to continue on, and return the state of the others"
+    finished = layer < 0
+    lengths[rows[finished]] = length
+    active = ~finished
+    return rows[active], current[active], layer[active]
@@ -0,0 +1,223 @@
+"Writers for walk matrices"
+
+import csv
+from pathlib import Path
+import numpy as np
+
+from src.walk_matrix import WALK_PAD, walk_width, unpad, from_compact
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+OUTPUT_FORMATS = ["csv", "npy", "parquet", "compact"]
+OUTPUT_SUFFIXES = { # files written per format
+    "csv": [".csv"],
+    "npy": [".npy", "_lengths.npy"],
+    "parquet": [".parquet"],
+    "compact": ["_nodes.npy", "_layers.npy", "_n_nodes.npy", "_node_ids.npy"]
+}
+
+
+def column_names(walk_len: int):
+    "Names of the columns of a walk table"
+    return ["SOURCE"] + ["STEP_" + str(i) for i in range(walk_width(walk_len) - 1)]
+
+
+class CSVWalkWriter:
+    """Write walks to a csv file with a `SOURCE, STEP_0, ...` header, one walk per row.
+
+    Args:
+        filename: output file without extension
+        walk_len: the length of the random walks
+    """
+    def __init__(self, filename: str, walk_len: int):
+        self.path = Path(filename + ".csv")
+        self.file = self.path.open("w", newline="")
+        self.writer = csv.writer(self.file, delimiter=",")
+        self.writer.writerow(column_names(walk_len))
+
+    def write(self, walks, lengths):
+        "Append a chunk of walks, given as a walk matrix and the lengths of the walks"
+        self.writer.writerows(unpad(walks, lengths))
+
+    def close(self, check: bool = True):
+        self.file.close()
+
+
+class NpyWalkWriter:
+    """Write walks to a memory-mappable `.npy` walk matrix padded with `WALK_PAD`, and their lengths to `_lengths.npy`.
+
+    Read them back with `read_npy_walks`.
+
+    Args:
+        filename: output file without extension
+        walk_len: the length of the random walks
+        n_walks: total number of walks that will be written
+        dtype: integer type of the walk matrix, see `src.walk_matrix.walk_dtype`
+    """
+    def __init__(self, filename: str, walk_len: int, n_walks: int, dtype=np.int32):
+        self.walks = np.lib.format.open_memmap(
+            filename + ".npy", mode="w+", dtype=dtype, shape=(n_walks, walk_width(walk_len))
+        )
+        self.lengths = np.lib.format.open_memmap(
+            filename + "_lengths.npy", mode="w+", dtype=np.int32, shape=(n_walks,)
+        )
+        self.row = 0
+
+    def write(self, walks, lengths):
+        end = self.row + len(walks)
+        self.walks[self.row:end] = walks
+        self.lengths[self.row:end] = lengths
+        self.row = end
+
+    def close(self, check: bool = True):
+        """Flush and release the files.
+
+        Args:
+            check: raise a ValueError if the number of walks written is not `n_walks`. Pass False when closing
+                after a failure, so the original error is not hidden.
+        """
+        n_walks = len(self.walks)
+        self.walks.flush()
+        self.lengths.flush()
+        del self.walks, self.lengths
+        if check and self.row != n_walks:
+            raise ValueError(f"expected {n_walks} walks, but {self.row} were written")
+
+
+class ParquetWalkWriter:
+    """Write walks to a compressed parquet file with the same columns as the csv output.
+
+    Entries after the end of a walk are null. Each chunk is written as one row group.
+
+    Args:
+        filename: output file without extension
+        walk_len: the length of the random walks
+        dtype: integer type of the columns
+        compression: parquet compression codec
+    """
+    def __init__(self, filename: str, walk_len: int, dtype=np.int32, compression: str = "zstd"):
+        if pa is None:
+            raise ImportError("pyarrow is required to write parquet files")
+        self.names = column_names(walk_len)
+        self.dtype = dtype
+        schema = pa.schema([(name, pa.from_numpy_dtype(dtype)) for name in self.names])
+        self.writer = pq.ParquetWriter(filename + ".parquet", schema, compression=compression)
+
+    def write(self, walks, lengths):
+        columns = [
+            pa.array(walks[:, j].astype(self.dtype), mask=walks[:, j] == WALK_PAD)
+            for j in range(walks.shape[1])
+        ]
+        self.writer.write_table(pa.Table.from_arrays(columns, names=self.names), row_group_size=len(walks))
+
+    def close(self, check: bool = True):
+        self.writer.close()
+
+
+class CompactWalkWriter:
+    """Write compact walks (see `src.walk_matrix.compact_arrays`) to memory-mappable `.npy` files.
+
+    Writes `_nodes.npy` (int32 dense node indices), `_layers.npy` (uint8 layer index of each step),
+    `_n_nodes.npy` (number of nodes of each walk) and `_node_ids.npy` (original identifier of each dense index).
+    Read them back with `read_compact_walks`.
+
+    Args:
+        filename: output file without extension
+        walk_len: the length of the random walks
+        n_walks: total number of walks that will be written
+        node_ids: original identifiers of the dense node indices, `LayeredCSRGraph.node_ids`
+    """
+    def __init__(self, filename: str, walk_len: int, n_walks: int, node_ids: np.ndarray):
+        self.nodes = np.lib.format.open_memmap(
+            filename + "_nodes.npy", mode="w+", dtype=np.int32, shape=(n_walks, walk_len + 1)
+        )
+        self.layers = np.lib.format.open_memmap(
+            filename + "_layers.npy", mode="w+", dtype=np.uint8, shape=(n_walks, walk_len)
+        )
+        self.lengths = np.lib.format.open_memmap(
+            filename + "_n_nodes.npy", mode="w+", dtype=np.int32, shape=(n_walks,)
+        )
+        np.save(filename + "_node_ids.npy", np.asarray(node_ids))
+        self.row = 0
+
+    def write(self, nodes, layers, lengths):
+        "Append a chunk of compact walks"
+        end = self.row + len(nodes)
+        self.nodes[self.row:end] = nodes
+        self.layers[self.row:end] = layers
+        self.lengths[self.row:end] = lengths
+        self.row = end
+
+    def close(self, check: bool = True):
+        "Flush and release the files, see `NpyWalkWriter.close`"
+        n_walks = len(self.nodes)
+        self.nodes.flush()
+        self.layers.flush()
+        self.lengths.flush()
+        del self.nodes, self.layers, self.lengths
+        if check and self.row != n_walks:
+            raise ValueError(f"expected {n_walks} walks, but {self.row} were written")
+
+
+def make_writer(output_format: str, filename: str, walk_len: int, n_walks: int, dtype=np.int64, node_ids: np.ndarray = None):
+    """Create a writer for `output_format`, one of `OUTPUT_FORMATS`.
+
+    The "compact" writer takes chunks of compact walks and needs `node_ids`; the others take walk matrices.
+    """
+    if output_format == "csv":
+        return CSVWalkWriter(filename, walk_len)
+    elif output_format == "npy":
+        return NpyWalkWriter(filename, walk_len, n_walks, dtype)
+    elif output_format == "parquet":
+        return ParquetWalkWriter(filename, walk_len, dtype)
+    elif output_format == "compact":
+        if node_ids is None:
+            raise ValueError("the compact output format needs node_ids")
+        return CompactWalkWriter(filename, walk_len, n_walks, node_ids)
+    raise ValueError(f"unknown output format {output_format}, choose one of {OUTPUT_FORMATS}")
+
+
+def rename_output(source: str, target: str, output_format: str):
+    "Move the files of an output written to `source` (without extension) to `target`, replacing existing files"
+    for suffix in OUTPUT_SUFFIXES[output_format]:
+        Path(source + suffix).replace(target + suffix)
+
+
+def remove_output(filename: str, output_format: str):
+    "Delete the files of an output, if they exist"
+    for suffix in OUTPUT_SUFFIXES[output_format]:
+        Path(filename + suffix).unlink(missing_ok=True)
+
+
+def read_npy_walks(filename: str, mmap_mode: str = "r"):
+    """Load walks written by `NpyWalkWriter` without parsing or copying them.
+
+    Returns:
+        tuple: (walk matrix padded with `WALK_PAD`, lengths of the walks)
+    """
+    return np.load(filename + ".npy", mmap_mode=mmap_mode), np.load(filename + "_lengths.npy", mmap_mode=mmap_mode)
+
+
+def read_compact_walks(filename: str, mmap_mode: str = "r", interleaved: bool = False):
+    """Load walks written by `CompactWalkWriter`.
+
+    Args:
+        filename: output file without extension
+        mmap_mode: see `np.load`
+        interleaved: if true, convert them to a walk matrix with original node identifiers, like `read_npy_walks`
+            returns. This loads all walks into memory.
+
+    Returns:
+        tuple: (nodes, layers, lengths, node_ids) memory-mapped, or (walk matrix, lengths) if `interleaved`
+    """
+    nodes, layers, lengths, node_ids = (
+        np.load(filename + suffix, mmap_mode=mmap_mode) for suffix in OUTPUT_SUFFIXES["compact"]
+    )
+    if interleaved:
+        return from_compact(nodes, layers, lengths, node_ids)
+    return nodes, layers, lengths, node_ids